@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+"""
+Loading cost of the ECO opening book: the pickled dict of SAN lines (what used to be
+unpickled at import) versus the compiled, memory-mapped book. Each variant runs in a
+fresh interpreter, reporting the time to load it and do one lookup, and the peak RSS.
+
+    python benchmarks/opening_book.py
+"""
+
+import subprocess, sys
+
+VARIANTS = {
+    'pickle': "from chess4fun.opening._opening import load_ECO_book_dict; book = load_ECO_book_dict(); book.get('1. e4 e5 *')",
+    'compiled': "from chess4fun.opening._opening import opening_book; book = opening_book(); book.get(0)",
+}
+
+SCRIPT = """
+import resource, time
+import chess, chess.pgn, chess.polyglot, pickle
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - t
+rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(elapsed, rss_after - rss_before)
+"""
+
+def main():
+    print(f"{'variant':<10} {'load (ms)':>10} {'peak RSS delta (kB)':>20}")
+    for name, code in VARIANTS.items():
+        output = subprocess.run([sys.executable, '-c', SCRIPT.format(code=code)], capture_output=True, text=True, check=True).stdout
+        elapsed, rss = output.split()
+        print(f"{name:<10} {float(elapsed) * 1000:>10.1f} {int(rss):>20}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+"""
+Cold start cost: the import time of each entry point, and the time from interpreter start to
+the first window being shown (the app window, with its first paint done). Each measurement
+runs in a fresh interpreter. Also checks that the headless packages do not pull in GUI
+libraries. Exits with status 1 if time-to-first-window exceeds ``--budget`` seconds.
+
+    python benchmarks/startup.py [--budget 2.0] [--repeat 5]
+
+Set QT_QPA_PLATFORM=offscreen to run it without a display.
+"""
+
+import argparse, os, subprocess, sys
+
+GUI_MODULES = ('PySide2', 'PySide6', 'pygame', 'matplotlib')
+
+IMPORT_SCRIPT = """
+import sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(elapsed, ','.join(sorted({{m.split('.')[0] for m in sys.modules}} & set({gui_modules!r}))) or '-')
+"""
+
+WINDOW_SCRIPT = """
+import time
+t = time.perf_counter()
+import sys
+from chess4fun.gui._gui import QApplication, app_window
+app = QApplication(sys.argv)
+window = app_window(app=app)
+window.show()
+app.processEvents()
+print(time.perf_counter() - t)
+"""
+
+def run(script: str = None) -> str:
+    return subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout.split()
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="chess4fun cold start benchmark")
+    parser.add_argument("--budget", type=float, default=2.0, help="maximum time to first window (sec)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement; the best is reported")
+    args = parser.parse_args(argv)
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+    status = 0
+    print(f"{'import':<20} {'time (ms)':>10}  GUI libraries loaded")
+    for module in ('chess4fun.opening', 'chess4fun.analysis', 'chess4fun.gui'):
+        runs = [run(IMPORT_SCRIPT.format(module=module, gui_modules=GUI_MODULES)) for _ in range(args.repeat)]
+        loaded = runs[0][1]
+        print(f"{module:<20} {min(float(elapsed) for elapsed, _ in runs) * 1000:>10.1f}  {loaded}")
+        if module != 'chess4fun.gui' and loaded != '-':
+            print(f"FAIL: {module} imports {loaded}")
+            status = 1
+    first_window = min(float(run(WINDOW_SCRIPT)[0]) for _ in range(args.repeat))
+    print(f"{'first window':<20} {first_window * 1000:>10.1f}  (budget {args.budget * 1000:.0f} ms)")
+    if first_window > args.budget:
+        print("FAIL: time to first window is over budget")
+        status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
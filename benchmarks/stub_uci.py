@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+"""
+A stand-in UCI engine for the benchmarks: every ``go`` is answered at once with one ``info``
+line per MultiPV (depth 1, a made-up score) and ``bestmove`` (the first legal move in UCI
+order), so what is measured is chess4fun's own per-call cost, not a search.
+
+    python benchmarks/stub_uci.py
+"""
+
+import sys
+
+import chess
+
+def main() -> None:
+    board, multipv = chess.Board(), 1
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+        command = tokens[0]
+        if command == "uci":
+            print("id name chess4fun-stub")
+            print("option name Hash type spin default 16 min 1 max 33554432")
+            print("option name Threads type spin default 1 min 1 max 512")
+            print("option name MultiPV type spin default 1 min 1 max 500")
+            print("option name SyzygyPath type string default <empty>")
+            print("uciok")
+        elif command == "isready":
+            print("readyok")
+        elif command == "setoption" and len(tokens) >= 5 and tokens[2] == "MultiPV":
+            multipv = int(tokens[4])
+        elif command == "position":
+            moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+            board = chess.Board() if tokens[1] == "startpos" else chess.Board(" ".join(tokens[2:moves]))
+            for uci in tokens[moves + 1:]:
+                board.push_uci(uci)
+        elif command == "go":
+            moves = sorted(board.legal_moves, key=chess.Move.uci)
+            for i, move in enumerate(moves[:multipv]):
+                print(f"info depth 1 seldepth 1 multipv {i + 1} score cp {20 - 10 * i} nodes 20 nps 20000 time 1 pv {move.uci()}")
+            print(f"bestmove {moves[0].uci() if moves else '(none)'}")
+        elif command == "quit":
+            break
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+"""
+Benchmark suite, to measure optimizations and catch performance regressions:
+
+    opening   ``find_opening`` latency versus game length
+    engine    per-call overhead of ``evaluate_position`` and ``advise_move``, against the stub
+              UCI engine (benchmarks/stub_uci.py) so that no Stockfish is needed and no search
+              time is counted; ``raw_analyse`` is python-chess alone, for reference
+    render    board frame cost per event (new position, cached position, arrows, resize)
+    search    the built-in engine (chess4fun.engine) to a fixed depth, in process: search speed
+              without any external engine
+    plot      ``EvaluationDialog.update_plot`` (and the repaint) versus game length
+    startup   import times and time to first window (fresh interpreters, see startup.py)
+
+Every benchmark reports the median and best per-call time (ms) as JSON (``-o``). With a
+baseline (``--baseline``, written by ``--save-baseline``), medians slower than the baseline
+by more than ``--threshold`` are reported and the exit status is 1.
+
+    python benchmarks/suite.py [--only opening,engine] [--repeat 50] [-o results.json]
+                               [--baseline benchmarks/baseline.json] [--threshold 0.25] [--save-baseline]
+
+The render and plot benchmarks need the GUI libraries and are skipped without them; they run
+offscreen unless QT_QPA_PLATFORM is set.
+"""
+
+import argparse, asyncio, json, os, pathlib, platform, random, statistics, sys, time
+
+import chess
+import chess.engine
+import chess.svg
+
+benchmarks_dir = pathlib.Path(__file__).parent.absolute()
+STUB_ENGINE = [sys.executable, str(benchmarks_dir / "stub_uci.py")]
+
+BENCHMARKS = {}
+
+def benchmark(group: str = None):
+    def register(function):
+        BENCHMARKS[group] = function
+        return function
+    return register
+
+def timings(function = None, repeat: int = None) -> list:
+    """Calls ``function`` ``repeat`` times, returning the time of each call (ms)."""
+    elapsed = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        function()
+        elapsed.append((time.perf_counter() - t) * 1000)
+    return elapsed
+
+def random_game(n_plies: int = None, rng: random.Random = None) -> list:
+    """A random move stack of ``n_plies`` plies (restarted if the game ends before)."""
+    while True:
+        board = chess.Board()
+        while len(board.move_stack) < n_plies and not board.is_game_over():
+            board.push(rng.choice(sorted(board.legal_moves, key=chess.Move.uci)))
+        if len(board.move_stack) == n_plies:
+            return board.move_stack
+
+def out_of_book_board() -> chess.Board:
+    return chess.Board("r1bq1rk1/pp2bppp/2n1pn2/2pp4/3P4/2PBPN2/PP1N1PPP/R1BQ1RK1 w - - 0 8")
+
+@benchmark("opening")
+def opening_benchmarks(repeat: int = None) -> dict:
+    from chess4fun.opening import find_opening
+    rng = random.Random(0)
+    results = {}
+    for n_plies in (4, 8, 16, 32, 64, 128):
+        move_stack = random_game(n_plies, rng)
+        results[f"find_opening/plies={n_plies}"] = timings(lambda: find_opening(move_stack), repeat)
+    return results
+
+@benchmark("navigation")
+def navigation_benchmarks(repeat: int = None) -> dict:
+    from chess4fun.data import game_navigator
+    rng = random.Random(3)
+    results = {}
+    for n_plies in (50, 150, 300):
+        navigator = game_navigator()
+        for move in random_game(n_plies, rng):
+            navigator.push(move)
+        plies = iter([rng.randrange(n_plies + 1) for _ in range(repeat)])
+        results[f"navigation/go_to/plies={n_plies}"] = timings(lambda: navigator.go_to(next(plies)), repeat)
+        results[f"navigation/back/plies={n_plies}"] = timings(lambda: navigator.back() or navigator.go_to(n_plies), repeat)
+    return results
+
+@benchmark("engine")
+def engine_benchmarks(repeat: int = None) -> dict:
+    from chess4fun._preferences import preferences
+    from chess4fun.analysis import engine_session, evaluate_position, advise_move, search_budget
+    preferences['evaluation_cache'] = False
+    preferences['syzygy_path'] = None
+    board, limit = out_of_book_board(), chess.engine.Limit(depth=1)
+    results = {}
+    with chess.engine.SimpleEngine.popen_uci(STUB_ENGINE) as engine:
+        engine.analyse(board, limit)
+        results["engine/raw_analyse"] = timings(lambda: engine.analyse(board, limit), repeat)
+    session = engine_session(command=STUB_ENGINE)
+    try:
+        calls = {
+            "engine/evaluate_position": lambda: evaluate_position(board, session=session, limit=limit),
+            "engine/evaluate_position_multipv=3": lambda: evaluate_position(board, session=session, limit=limit, multipv=3),
+            "engine/advise_move": lambda: advise_move(board, session=session, limit=limit),
+            "engine/advise_move_budget": lambda: advise_move(board, session=session, budget=search_budget(depth=1)),
+        }
+        asyncio.run(calls["engine/evaluate_position"]()) # engine started
+        for name, call in calls.items():
+            results[name] = timings(lambda: asyncio.run(call()), repeat)
+    finally:
+        session.close()
+    return results
+
+@benchmark("search")
+def search_benchmarks(repeat: int = None) -> dict:
+    from chess4fun.engine import search_engine, evaluate
+    board = out_of_book_board()
+    results = {"search/evaluate": timings(lambda: evaluate(board), repeat)}
+    positions = {"start": chess.Board(), "middlegame": board,
+                 "endgame": chess.Board("8/5pk1/6p1/3R4/1r5P/6P1/5PK1/8 w - - 0 40")}
+    for name, position in positions.items():
+        engine = search_engine()
+        def search():
+            engine.clear() # every run searches the same tree
+            engine.search(position, depth=4)
+        results[f"search/depth=4/{name}"] = timings(search, min(repeat, 5))
+    return results
+
+def _qt_app():
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    from chess4fun.gui._gui import QApplication
+    return QApplication.instance() or QApplication(sys.argv)
+
+@benchmark("render")
+def render_benchmarks(repeat: int = None) -> dict:
+    app = _qt_app()
+    from chess4fun.gui._render import board_renderer
+    rng = random.Random(1)
+    boards = []
+    while len(boards) < repeat + 1:
+        board = chess.Board()
+        for move in random_game(40, rng):
+            board.push(move)
+            boards.append(board.copy(stack=False))
+    renderer = board_renderer()
+    renderer.frame(boards[0]) # piece sprites drawn
+    positions = iter(boards[1:])
+    results = {"render/new_position": timings(lambda: renderer.frame(next(positions)), repeat)}
+    results["render/cached"] = timings(lambda: renderer.frame(boards[0]), repeat)
+    arrows = [chess.svg.Arrow(tail, head, color=color) for tail, head, color in
+              ((chess.E2, chess.E4, '#15781B'), (chess.D2, chess.D4, '#0050C8'), (chess.G1, chess.F3, '#C88C00'))]
+    positions = iter(boards[1:])
+    results["render/arrows"] = timings(lambda: renderer.frame(next(positions), arrows=arrows), repeat)
+    sizes = iter(range(400, 400 + repeat))
+    results["render/resize"] = timings(lambda: renderer.frame(boards[0], width=next(sizes), height=600), repeat)
+    return results
+
+@benchmark("plot")
+def plot_benchmarks(repeat: int = None) -> dict:
+    app = _qt_app()
+    from chess4fun.gui import _gui
+    rng = random.Random(2)
+    results = {}
+    for n_plies in (50, 200, 800):
+        scores = [chess.engine.PovScore(chess.engine.Cp(rng.randint(-300, 300)), chess.WHITE) for _ in range(n_plies + repeat)]
+        dialog = _gui.EvaluationDialog()
+        dialog.score_graph.resize(800, 600)
+        for ply in range(1, n_plies):
+            dialog.update_plot(ply, scores[ply - 1])
+        dialog.score_graph.grab()
+        plies = iter(range(n_plies, n_plies + repeat))
+        def append():
+            ply = next(plies)
+            dialog.update_plot(ply, scores[ply - 1])
+            dialog.score_graph.grab()
+        results[f"plot/append/plies={n_plies}"] = timings(append, repeat)
+        def update_last():
+            dialog.update_plot(n_plies + repeat - 1, scores[-1])
+            dialog.score_graph.grab()
+        results[f"plot/update_last/plies={n_plies}"] = timings(update_last, repeat)
+        dialog.deleteLater()
+    return results
+
+@benchmark("startup")
+def startup_benchmarks(repeat: int = None) -> dict:
+    sys.path.insert(0, str(benchmarks_dir))
+    import startup
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    repeat = min(repeat, 5) # each run is a fresh interpreter
+    results = {}
+    for module in ('chess4fun.opening', 'chess4fun.analysis', 'chess4fun.gui'):
+        script = startup.IMPORT_SCRIPT.format(module=module, gui_modules=startup.GUI_MODULES)
+        results[f"import/{module}"] = [float(startup.run(script)[0]) * 1000 for _ in range(repeat)]
+    results["startup/first_window"] = [float(startup.run(startup.WINDOW_SCRIPT)[0]) * 1000 for _ in range(repeat)]
+    return results
+
+def summarize(elapsed: list = None) -> dict:
+    return {"median_ms": statistics.median(elapsed), "min_ms": min(elapsed), "runs": len(elapsed)}
+
+def compare(results: dict = None, baseline: dict = None, threshold: float = None) -> list:
+    """Returns the names of the benchmarks whose median is slower than the baseline's by more than ``threshold``."""
+    regressions = []
+    print(f"\n{'benchmark':<40} {'median (ms)':>12} {'baseline':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["median_ms"], result["median_ms"]
+        change = after / before - 1 if before > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40} {after:>12.3f} {before:>12.3f} {change:>+8.0%}{flag}")
+    return regressions
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="chess4fun benchmark suite")
+    parser.add_argument("--only", default=None, help=f"comma-separated groups to run (default: all of {','.join(BENCHMARKS)})")
+    parser.add_argument("--repeat", type=int, default=50, help="calls per benchmark")
+    parser.add_argument("-o", "--output", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=str(benchmarks_dir / "baseline.json"), help="baseline results (JSON) to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="fail when a median is slower than the baseline by more than this fraction")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    groups = args.only.split(",") if args.only else list(BENCHMARKS)
+    results = {}
+    print(f"{'benchmark':<40} {'median (ms)':>12} {'min (ms)':>12}")
+    for group in groups:
+        try:
+            measured = BENCHMARKS[group](args.repeat)
+        except ImportError as error:
+            print(f"{group + ' (skipped)':<40} {error}")
+            continue
+        for name, elapsed in measured.items():
+            results[name] = summarize(elapsed)
+            print(f"{name:<40} {results[name]['median_ms']:>12.3f} {results[name]['min_ms']:>12.3f}")
+    report = {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    status = 0
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"\nbaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file)["results"], args.threshold)
+        if regressions:
+            print(f"FAIL: {len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
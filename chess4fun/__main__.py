@@ -4,9 +4,115 @@
 #
 # License: LGPL-3.0
  
+import argparse
+import os
 import sys
 
-from .gui import main
+from ._preferences import preferences
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m chess4fun", description="Chess for fun! Without a command, the app window is opened.")
+    subparsers = parser.add_subparsers(dest="command")
+    analyze_parser = subparsers.add_parser("analyze", help="annotate every game of a PGN file with evals and ?!/?/?? marks")
+    analyze_parser.add_argument("input", help="input PGN file")
+    analyze_parser.add_argument("-o", "--output", required=True, help="output PGN file")
+    analyze_parser.add_argument("--engine", default=preferences['chess_engine_exe_path'], help="chess engine (stockfish) executable path; the built-in engine if it cannot be run")
+    analyze_parser.add_argument("--hash", type=int, default=preferences['chess_engine_hash_size'], help="total hash size (MB), split across workers")
+    analyze_parser.add_argument("--time", type=float, default=None, help="search time per ply (sec)")
+    analyze_parser.add_argument("--depth", type=int, default=None, help="search depth per ply")
+    analyze_parser.add_argument("--workers", type=int, default=None, help="number of engine processes (default: number of CPUs)")
+    import_parser = subparsers.add_parser("import", help="import the games of PGN files into the local game database")
+    import_parser.add_argument("input", nargs="+", help="input PGN file(s)")
+    import_parser.add_argument("--workers", type=int, default=None, help="number of parsing processes (default: number of CPUs)")
+    export_parser = subparsers.add_parser("export", help="export games of the local game database to a PGN file")
+    export_parser.add_argument("-o", "--output", required=True, help="output PGN file")
+    export_parser.add_argument("--player", default=None, help="games of this player (either color)")
+    export_parser.add_argument("--eco", default=None, help="ECO code or code prefix, e.g. C60 or C6")
+    export_parser.add_argument("--result", default=None, help="1-0, 0-1 or 1/2-1/2")
+    export_parser.add_argument("--date-from", default=None, help="YYYY.MM.DD")
+    export_parser.add_argument("--date-to", default=None, help="YYYY.MM.DD")
+    serve_parser = subparsers.add_parser("serve", help="serve analysis over HTTP from one shared pool of engines (clients: the analysis_server preference)")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    serve_parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    serve_parser.add_argument("--engine", default=preferences['chess_engine_exe_path'], help="chess engine (stockfish) executable path; the built-in engine if it cannot be run")
+    serve_parser.add_argument("--hash", type=int, default=preferences['chess_engine_hash_size'], help="total hash size (MB), split across the engines")
+    serve_parser.add_argument("--time", type=float, default=None, help="default search time per position (sec), when a client gives no limit")
+    serve_parser.add_argument("--workers", type=int, default=None, help="number of engine processes (default: number of CPUs)")
+    serve_parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    tournament_parser = subparsers.add_parser("tournament", help="play engine-vs-engine games over a process pool, writing them to a PGN file")
+    tournament_parser.add_argument("-e", "--engine", action="append", required=True, help="engine executable path (at least two, or one played against itself)")
+    tournament_parser.add_argument("--tc", action="append", default=None, help="time control: one for all engines, or one per engine, e.g. 10+0.1, movetime=0.5, depth=12, nodes=100000")
+    tournament_parser.add_argument("--option", action="append", default=None, help="UCI options: one for all engines, or one per engine, e.g. Hash=64,Threads=1")
+    tournament_parser.add_argument("-n", "--games", type=int, default=2, help="games per pair of engines")
+    tournament_parser.add_argument("-o", "--output", required=True, help="output PGN file (games are appended)")
+    tournament_parser.add_argument("--workers", type=int, default=None, help="number of games played at once (default: number of CPUs)")
+    tournament_parser.add_argument("--openings", type=int, default=None, help="number of ECO book openings to draw from (default: one per game pair, 0 for none)")
+    tournament_parser.add_argument("--seed", type=int, default=None, help="random seed for drawing the openings")
+    tournament_parser.add_argument("--resign-score", type=int, default=700, help="adjudicate a loss below this eval (cp), 0 to disable")
+    tournament_parser.add_argument("--draw-score", type=int, default=10, help="adjudicate a draw within this eval (cp), -1 to disable")
+    tournament_parser.add_argument("--max-plies", type=int, default=500, help="adjudicate a draw after this many plies")
+    tournament_parser.add_argument("--max-move-time", type=float, default=120.0, help="sec after which an engine still searching a depth or nodes move counts as hung")
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        from .gui import main as gui_main
+        return gui_main()
+    elif args.command == "analyze":
+        import chess.engine
+        from .analysis import analyse_pgn_file
+        preferences['chess_engine_exe_path'] = args.engine
+        limit = None
+        if args.time is not None or args.depth is not None:
+            limit = chess.engine.Limit(time=args.time, depth=args.depth)
+        n_games = analyse_pgn_file(args.input, args.output, limit=limit, n_workers=args.workers, hash_size=args.hash)
+        print(f"{n_games} game(s) analyzed, written to {args.output}")
+        return 0
+    elif args.command == "import":
+        from .data import user_game
+        store = user_game()
+        for input_path in args.input:
+            n_games = store.import_pgn(input_path, progress=lambda n_games: print(f"\r{input_path}: {n_games} games", end="", flush=True),
+                                       n_workers=args.workers).result()
+            print(f"\r{input_path}: {n_games} games imported")
+        store.close()
+        return 0
+    elif args.command == "export":
+        from .data import user_game
+        store = user_game()
+        n_games = store.export_pgn(args.output, player=args.player, eco=args.eco, result=args.result, date_from=args.date_from, date_to=args.date_to)
+        store.close()
+        print(f"{n_games} game(s) exported to {args.output}")
+        return 0
+    elif args.command == "serve":
+        from .analysis import serve_analysis
+        preferences['chess_engine_exe_path'] = args.engine
+        preferences['analysis_server'] = None # this is the server
+        if args.time is not None:
+            preferences['chess_engine_search_time'] = args.time
+        return serve_analysis(host=args.host, port=args.port, n_workers=args.workers, hash_size=args.hash, verbose=args.verbose)
+    elif args.command == "tournament":
+        from .tournament import time_control, engine_player, adjudication_rules, sample_openings, run_tournament
+        engines = args.engine if len(args.engine) > 1 else args.engine * 2
+        def per_engine(values: list = None, default: str = None) -> list:
+            values = values or [default]
+            if len(values) not in (1, len(engines)):
+                parser.error("give one value for all engines or one per engine")
+            return values * len(engines) if len(values) == 1 else values
+        players = []
+        for i, (command, tc, options) in enumerate(zip(engines, per_engine(args.tc, "movetime=0.1"), per_engine(args.option, ""))):
+            options = dict(option.split("=", 1) for option in options.split(",") if option)
+            players.append(engine_player(name=f"{i + 1}-{os.path.basename(command)}", command=command, options=options, time_control=time_control.parse(tc, max_move_time=args.max_move_time)))
+        n_openings = (args.games + 1) // 2 if args.openings is None else args.openings
+        openings = sample_openings(n_openings, seed=args.seed) if n_openings > 0 else None
+        adjudication = adjudication_rules(resign_score=args.resign_score or None, draw_score=None if args.draw_score < 0 else args.draw_score,
+                                          max_plies=args.max_plies)
+        def report(result: dict = None) -> None:
+            print(f"round {result['round']}: {result['white']} - {result['black']} {result['result']}", flush=True)
+        standings = run_tournament(players, n_games=args.games, output_path=args.output, openings=openings, adjudication=adjudication,
+                                   n_workers=args.workers, callback=report)
+        for name, score in standings.items():
+            print(f"{name}: +{score['wins']} ={score['draws']} -{score['losses']}" + (f" ({score['unfinished']} unfinished)" if score['unfinished'] else ""))
+        return 0
 
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+# preference settings (default)
+preferences = {'chess_engine_exe_path': '/usr/local/bin/stockfish',
+               'builtin_engine': True, # analyze with the built-in engine (chess4fun.engine) when the engine above cannot be run
+               'chess_engine_hash_size': 4096, # MB
+               'chess_engine_search_time': 5.0, # sec; the most a move gets, unless searches stop early
+               'chess_engine_search_depth': None, # plies; no depth limit if None
+               'chess_engine_search_nodes': None, # no node limit if None
+               'play_sound': True,
+               'evaluate_position': True,
+               'evaluation_cache': True,
+               'speculative_analysis': True, # analyze the expected next positions while the engine is idle
+               'multipv': 3, # candidate moves shown by "Advise Next"
+               'opening_book': True,
+               'opening_book_path': None, # external polyglot .bin book; the built-in ECO book if None
+               'syzygy_path': None, # Syzygy tablebase directories (os.pathsep separated); probed ahead of the engine, and passed to it
+               'analysis_server': None, # e.g. "http://127.0.0.1:8765": analyze on a shared server (python -m chess4fun serve) instead of a local engine
+               'telemetry': False} # timing spans and engine statistics (see chess4fun._telemetry); also on with CHESS4FUN_TELEMETRY=1
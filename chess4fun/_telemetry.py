@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import cProfile
+import functools
+import inspect
+import io
+import json
+import math
+import os
+import pstats
+import threading
+import time
+
+from ._preferences import preferences
+
+
+class histogram(object):
+    """Count, sum, min, max and power-of-two buckets (bucket ``e`` counts the values in ``(2**(e-1), 2**e]``) of a series of values."""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets = {}
+
+    def add(self, value: float = None) -> None:
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        exponent = math.frexp(value)[1] if value > 0 else 0
+        if value > 0 and value == 2 ** (exponent - 1):
+            exponent -= 1
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "total": self.total, "mean": self.total / self.count if self.count else None,
+                "min": self.min if self.count else None, "max": self.max if self.count else None,
+                "buckets": {f"<={2 ** exponent:g}": n for exponent, n in sorted(self.buckets.items())}}
+
+
+class _span(object):
+    __slots__ = ("recorder", "name", "start")
+
+    def __init__(self, recorder = None, name: str = None):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(self.name, (time.perf_counter() - self.start) * 1000)
+
+
+class _null_span(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_SPAN = _null_span()
+
+# engine-reported statistics collected from info dicts, as "info.<key>"
+ENGINE_STATS = ("nps", "depth", "seldepth", "hashfull", "nodes", "tbhits")
+
+
+class telemetry_recorder(object):
+    """
+    Timing spans and engine statistics, aggregated into histograms.
+
+    ``with telemetry.span("engine.spawn"): ...`` times a block (ms, wall clock, so it also covers
+    awaits) and ``@telemetry.timed("render.frame")`` every call of a function; :meth:`record_info`
+    collects what the engine reports (nps, depth, hashfull, ...). All are no-ops unless :attr:`enabled` (the ``telemetry`` preference), costing one attribute
+    test. :meth:`snapshot` returns everything as a dict, :meth:`save` appends it as one JSON line
+    to ``telemetry.jsonl`` in the data directory. :meth:`start_profile` / :meth:`stop_profile`
+    capture a cProfile of the calling thread (e.g. one interaction in the app) to a ``.prof`` file.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._started = time.time()
+        self._profile = None
+
+    def span(self, name: str = None):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _span(self, name)
+
+    def timed(self, name: str = None):
+        """Decorator timing each call of a function (or coroutine function) as span ``name``."""
+        def decorate(function):
+            if inspect.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def timed_coroutine(*args, **kwargs):
+                    if not self.enabled:
+                        return await function(*args, **kwargs)
+                    with _span(self, name):
+                        return await function(*args, **kwargs)
+                return timed_coroutine
+            @functools.wraps(function)
+            def timed_function(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _span(self, name):
+                    return function(*args, **kwargs)
+            return timed_function
+        return decorate
+
+    def record(self, name: str = None, value: float = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = histogram()
+            self._histograms[name].add(value)
+
+    def record_info(self, info = None) -> None:
+        """Collects the engine statistics of an info dict (or a list of them, from a multipv search)."""
+        if not self.enabled or not info:
+            return
+        for line in info if isinstance(info, list) else [info]:
+            for key in ENGINE_STATS:
+                if line.get(key) is not None:
+                    self.record(f"info.{key}", line[key])
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms = {}
+            self._started = time.time()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            histograms = {name: hist.to_dict() for name, hist in sorted(self._histograms.items())}
+        return {"started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._started)),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "histograms": histograms}
+
+    def save(self, path: str = None) -> str:
+        """Appends the snapshot as one JSON line to ``path`` (default: ``telemetry.jsonl`` in the data directory)."""
+        from .data import data_root_path
+        path = path or data_root_path / "telemetry.jsonl"
+        with open(path, "a") as log_file:
+            log_file.write(json.dumps(self.snapshot()) + "\n")
+        return str(path)
+
+    def start_profile(self) -> None:
+        """Starts profiling the calling thread (if not already profiling)."""
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop_profile(self, path: str = None, n_lines: int = 30) -> tuple:
+        """
+        Stops profiling and dumps the profile to ``path`` (default: ``profiles/<time>.prof`` in the data
+        directory). Returns ``(path, summary)``, the summary being the top ``n_lines`` by cumulative time.
+        """
+        profile, self._profile = self._profile, None
+        if profile is None:
+            return None, ""
+        profile.disable()
+        if path is None:
+            from .data import data_root_path
+            os.makedirs(data_root_path / "profiles", exist_ok=True)
+            path = data_root_path / "profiles" / time.strftime("%Y%m%d-%H%M%S.prof")
+        profile.dump_stats(str(path))
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(n_lines)
+        return str(path), summary.getvalue()
+
+    @property
+    def is_profiling(self) -> bool:
+        return self._profile is not None
+
+
+telemetry = telemetry_recorder(enabled=preferences['telemetry'] or os.environ.get("CHESS4FUN_TELEMETRY", "") not in ("", "0"))
@@ -4,6 +4,17 @@
 #
 # License: LGPL-3.0
 
-from ._analysis import evaluate_position, advise_move
+from ._analysis import evaluate_position, evaluate_position_stream, search_move, advise_move, book_move, evaluate_positions
+from ._budget import search_budget
+from ._engine import engine_session, engine_pool, default_engine_session
+from ._cache import evaluation_cache, default_evaluation_cache
+from ._game import classify_move, analyse_game, annotate_game, analyse_games, analyse_pgn_file
+from ._speculate import speculative_analysis, likely_positions
+from ._client import analysis_client
+from ._server import analysis_server, serve_analysis
 
-__all__ = ["evaluate_position", "advise_move",]
+__all__ = ["evaluate_position", "evaluate_position_stream", "search_move", "advise_move", "search_budget", "book_move", "evaluate_positions", "engine_session", "engine_pool", "default_engine_session",
+           "evaluation_cache", "default_evaluation_cache",
+           "classify_move", "analyse_game", "annotate_game", "analyse_games", "analyse_pgn_file",
+           "speculative_analysis", "likely_positions",
+           "analysis_client", "analysis_server", "serve_analysis",]
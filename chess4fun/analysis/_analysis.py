@@ -5,26 +5,347 @@
 # License: LGPL-3.0
 
 import asyncio
+import itertools
+import shutil
 import chess
 import chess.engine
 
-async def evaluate_position(board: chess.Board = None) -> None:
-    from ..gui import preferences
-    if preferences['chess_engine_exe_path'] is None:
+from .._preferences import preferences
+from .._telemetry import telemetry
+from ..opening import choose_book_move
+from ..endgame import probe_position, tablebase_move
+from ..engine import BUILTIN_ENGINE
+from ._engine import engine_session, engine_pool, default_engine_session
+from ._cache import evaluation_cache, default_evaluation_cache, engine_identity
+from ._budget import search_budget
+from ._client import analysis_client
+
+MATE_SCORE = 100000
+TB_WIN_SCORE = 19000 # cp; engines report tablebase wins as scores around 20000
+
+def _engine_command():
+    # the external engine if it can be run, else the built-in one (if allowed), else None
+    path = preferences['chess_engine_exe_path']
+    if path is not None and shutil.which(path) is not None:
+        return path
+    return BUILTIN_ENGINE if preferences['builtin_engine'] else None
+
+def _engine_args(session: engine_session = None) -> tuple:
+    """Returns ``(session, kwargs)`` for an engine call, or ``(None, None)`` if no engine is available."""
+    session = session or default_engine_session
+    if session.command is not None:
+        return session, {}
+    command = _engine_command()
+    if command is None:
+        return None, None
+    if command is BUILTIN_ENGINE:
+        return session, {"command": command, "options": {}} # its own (small) hash size; no tablebases
+    options = {"Hash": preferences['chess_engine_hash_size']}
+    if preferences['syzygy_path']:
+        options["SyzygyPath"] = preferences['syzygy_path']
+    return session, {"command": command, "options": options}
+
+def _remote() -> analysis_client:
+    # client mode: the analysis server of the preferences, if any
+    url = preferences['analysis_server']
+    return analysis_client.for_url(url) if url else None
+
+def _default_limit() -> chess.engine.Limit:
+    return search_budget.from_preferences().limit()
+
+def _default_pool(n_workers: int = None, hash_size: int = None, threads: int = 1) -> engine_pool:
+    command = _engine_command()
+    if command is None:
+        return None
+    if command is BUILTIN_ENGINE:
+        return engine_pool(command=command, n_workers=n_workers)
+    return engine_pool(command=command, n_workers=n_workers,
+                       hash_size=hash_size or preferences['chess_engine_hash_size'], threads=threads, syzygy_path=preferences['syzygy_path'])
+
+@telemetry.timed("analysis.evaluate_position")
+async def evaluate_position(board: chess.Board = None, session: engine_session = None, limit: chess.engine.Limit = None,
+                            multipv: int = None, cache: evaluation_cache = None, **kwargs):
+    """
+    Evaluates a position, returning the engine's info dict. With ``multipv``, the top
+    ``multipv`` candidate moves are searched at once and a list of info dicts (each with
+    its own score and PV, best first) is returned. Positions covered by the tablebases are
+    answered from them, without the engine. Without a ``session``, in client mode (the
+    ``analysis_server`` preference), the analysis server evaluates it.
+    """
+    if session is None and _remote() is not None and not set(kwargs) - {"game"}:
+        return await _remote().evaluate(board, limit=limit or _default_limit(), multipv=multipv)
+    if multipv is not None:
+        multipv = max(1, min(multipv, board.legal_moves.count())) # never more lines than legal moves
+    if not set(kwargs) - {"game"}:
+        info = probe_position(board, multipv=multipv)
+        if info is not None:
+            return info
+    session, engine_kwargs = _engine_args(session)
+    if session is None:
         return None
-    transport, engine = await chess.engine.popen_uci(command=preferences['chess_engine_exe_path'])
-    await engine.configure({"Hash": preferences['chess_engine_hash_size']})
-    info = await engine.analyse(board, chess.engine.Limit(time=preferences['chess_engine_search_time']))
-    await engine.quit()
+    limit = limit or _default_limit()
+    if cache is None and preferences['evaluation_cache']:
+        cache = default_evaluation_cache
+    if set(kwargs) - {"game"}:
+        cache = None # only plain evaluations are cached
+    if cache is not None:
+        engine = engine_identity(engine_kwargs.get("command") or session.command)
+        info = cache.get(board, limit, engine, multipv=multipv)
+        if info is not None:
+            return info
+    if multipv is not None:
+        kwargs["multipv"] = multipv
+    info = await session.analyse(board, limit, **engine_kwargs, **kwargs)
+    if cache is not None:
+        cache.put(board, engine, info, limit=limit)
     return info
 
-async def advise_move(board: chess.Board = None) -> None:
-    from ..gui import preferences
-    if preferences['chess_engine_exe_path'] is None:
+# early stop of progressive evaluation: the best move and score (within STABLE_SCORE_CP)
+# have not changed over STABLE_DEPTHS successive depths, from MIN_STABLE_DEPTH on
+MIN_STABLE_DEPTH = 12
+STABLE_DEPTHS = 4
+STABLE_SCORE_CP = 15
+
+def _is_stable(infos: list = None, min_depth: int = MIN_STABLE_DEPTH, n_depths: int = STABLE_DEPTHS, score_cp: int = STABLE_SCORE_CP) -> bool:
+    # infos: the last info of each completed depth, most recent last
+    if len(infos) < n_depths or infos[-1].get("depth", 0) < min_depth:
+        return False
+    recent = infos[-n_depths:]
+    if any(not info.get("pv") or info["pv"][0] != recent[-1]["pv"][0] for info in recent):
+        return False
+    scores = [info["score"].relative.score(mate_score=MATE_SCORE) for info in recent]
+    return max(scores) - min(scores) <= score_cp
+
+def _is_bound(info: chess.engine.InfoDict = None) -> bool:
+    # a fail-high or fail-low of an aspiration window: a bound on the score, not the score
+    return bool(info.get("lowerbound") or info.get("upperbound"))
+
+def _is_resolved(info: chess.engine.InfoDict = None) -> bool:
+    # of a completed depth: a forced mate or a tablebase result, searching on will not change the outcome
+    score = info["score"].relative
+    return score.is_mate() or abs(score.score()) >= TB_WIN_SCORE
+
+def _add_depth(completed: list = None, info: chess.engine.InfoDict = None) -> None:
+    # keeps the last info of each depth
+    if completed and info.get("depth", 0) == completed[-1].get("depth", 0):
+        completed[-1] = info # a later line of the same depth
+    else:
+        completed.append(info)
+
+async def evaluate_position_stream(board: chess.Board = None, session: engine_session = None, limit: chess.engine.Limit = None,
+                                   target_depth: int = None, early_stop: bool = True, cache: evaluation_cache = None):
+    """
+    Progressive evaluation: an async generator yielding the engine's info dict (depth, score,
+    pv, nps, ...) each time the search deepens, so a usable eval is available within a few
+    hundred ms. The search stops at ``limit`` (default: the search time preference), once
+    ``target_depth`` is reached, or, if ``early_stop``, once the best move and score are stable
+    over several depths. The caller may also stop it by leaving the loop. The last info is cached.
+    A position covered by the tablebases yields its exact result once. In client mode, the infos
+    are streamed from the analysis server.
+    """
+    if session is None and _remote() is not None:
+        async for info in _remote().evaluate_stream(board, limit=limit or _default_limit(), target_depth=target_depth, early_stop=early_stop):
+            yield info
+        return
+    info = probe_position(board)
+    if info is not None:
+        yield info
+        return
+    session, engine_kwargs = _engine_args(session)
+    if session is None:
+        return
+    limit = limit or _default_limit()
+    if cache is None and preferences['evaluation_cache']:
+        cache = default_evaluation_cache
+    if cache is not None:
+        engine = engine_identity(engine_kwargs.get("command") or session.command)
+        info = cache.get(board, chess.engine.Limit(depth=target_depth) if target_depth else limit, engine)
+        if info is not None:
+            yield info
+            return
+    completed, info, searched = [], None, None
+    stream = session.analysis(board, limit, **engine_kwargs)
+    try:
+        async for info in stream:
+            yield info
+            _add_depth(completed, info)
+            if target_depth is not None and info.get("depth", 0) >= target_depth:
+                break
+            if early_stop and _is_stable(completed):
+                searched = limit # as good as searching to the limit: cached as such, so the next stream with it is served
+                break
+        else:
+            searched = limit
+    finally:
+        await stream.aclose()
+        if cache is not None and info is not None:
+            cache.put(board, engine, info, limit=searched)
+
+def book_move(board: chess.Board = None, random: bool = False) -> chess.engine.PlayResult:
+    """Returns a book move (with the main book reply as ponder) while in book, or None."""
+    if not preferences['opening_book']:
         return None
-    transport, engine = await chess.engine.popen_uci(command=preferences['chess_engine_exe_path'])
-    await engine.configure({"Hash": preferences['chess_engine_hash_size']})
-    if not board.is_game_over():
-        result = await engine.play(board, chess.engine.Limit(time=preferences['chess_engine_search_time']))
-    await engine.quit()
-    return result
+    move = choose_book_move(board, path=preferences['opening_book_path'], random=random)
+    if move is None:
+        return None
+    board = board.copy(stack=False)
+    board.push(move)
+    return chess.engine.PlayResult(move, choose_book_move(board, path=preferences['opening_book_path']), info={"string": "book"})
+
+@telemetry.timed("analysis.search_move")
+async def search_move(board: chess.Board = None, session: engine_session = None, budget: search_budget = None, remaining: float = None, **kwargs) -> chess.engine.PlayResult:
+    """
+    Searches the best move within ``budget`` (default: the search preferences), with ``remaining``
+    seconds on the clock if playing with one. With the budget's ``early_stop``, a single legal move
+    is returned without searching, and the search ends as soon as the best move is stable or the
+    position is resolved. The result's ``info`` is the engine's last info. Positions covered by the
+    tablebases are played from them, without the engine.
+    """
+    budget = budget or search_budget.from_preferences()
+    moves = list(board.legal_moves)
+    if budget.early_stop and len(moves) == 1:
+        return chess.engine.PlayResult(moves[0], None, info={"string": "only move"})
+    result = tablebase_move(board)
+    if result is not None:
+        return result
+    session, engine_kwargs = _engine_args(session)
+    if session is None:
+        return None
+    limit = budget.limit(board, remaining)
+    if not budget.early_stop:
+        return await session.play(board, limit, info=chess.engine.INFO_ALL, **engine_kwargs, **kwargs)
+    completed, info = [], None
+    stream = session.analysis(board, limit, **engine_kwargs, **kwargs)
+    try:
+        async for line in stream:
+            if _is_bound(line):
+                continue
+            if completed and line.get("depth", 0) > completed[-1].get("depth", 0) and _is_resolved(completed[-1]):
+                break # the depth just completed has resolved the position
+            info = line
+            _add_depth(completed, info)
+            if _is_stable(completed, min_depth=budget.stable_depth, n_depths=budget.stable_depths):
+                break
+    finally:
+        await stream.aclose()
+    if info is None or not info.get("pv"):
+        return await session.play(board, limit, **engine_kwargs, **kwargs)
+    pv = info["pv"]
+    return chess.engine.PlayResult(pv[0], pv[1] if len(pv) > 1 else None, info=info)
+
+@telemetry.timed("analysis.advise_move")
+async def advise_move(board: chess.Board = None, session: engine_session = None, limit: chess.engine.Limit = None, book_random: bool = False,
+                      budget: search_budget = None, **kwargs) -> chess.engine.PlayResult:
+    """
+    Advises a move, from the opening book while in book (a weighted random one if ``book_random``), else from
+    the engine: searched to ``limit`` if given, else within ``budget`` (see :func:`search_move`).
+    In client mode, the analysis server advises it.
+    """
+    if session is None and _remote() is not None and not kwargs:
+        return await _remote().advise(board, limit=limit, budget=budget or search_budget.from_preferences(), book_random=book_random)
+    if board.is_game_over():
+        return None
+    result = book_move(board, random=book_random)
+    if result is not None:
+        return result
+    if limit is None:
+        return await search_move(board, session=session, budget=budget, **kwargs)
+    result = tablebase_move(board)
+    if result is not None:
+        return result
+    session, engine_kwargs = _engine_args(session)
+    if session is None:
+        return None
+    return await session.play(board, limit, **engine_kwargs, **kwargs)
+
+async def _fan_out(items = None, pool: engine_pool = None, work = None, ordered: bool = True, max_pending: int = None):
+    """
+    Runs ``await work(session, item)`` for every item over the sessions of ``pool``,
+    yielding ``(index, result)``. The input is consumed lazily, and at most ``max_pending``
+    items (default: twice the number of workers) are in flight or waiting to be yielded.
+    """
+    items = enumerate(items)
+    slots = asyncio.Semaphore(max_pending or 2 * pool.n_workers)
+    results = asyncio.Queue()
+
+    async def worker(session: engine_session = None):
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    index, item = next(items)
+                except StopIteration:
+                    slots.release()
+                    return
+                await results.put((index, await work(session, item), None))
+        except Exception as exc:
+            await results.put((None, None, exc))
+        finally:
+            await results.put(None)
+
+    tasks = [asyncio.ensure_future(worker(session)) for session in pool.sessions]
+    n_running, buffered, next_index = len(tasks), {}, 0
+    try:
+        while n_running > 0:
+            item = await results.get()
+            if item is None:
+                n_running -= 1
+                continue
+            index, result, exc = item
+            if exc is not None:
+                raise exc
+            if not ordered:
+                yield index, result
+                slots.release()
+                continue
+            buffered[index] = result
+            while next_index in buffered:
+                yield next_index, buffered.pop(next_index)
+                next_index += 1
+                slots.release()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def evaluate_positions(boards = None, limit: chess.engine.Limit = None, n_workers: int = None, hash_size: int = None, threads: int = 1,
+                             ordered: bool = True, max_pending: int = None, pool: engine_pool = None, multipv: int = None):
+    """
+    Evaluates an iterable of boards (or FEN strings) over a pool of engines.
+    With ``multipv``, each result is a list of the top candidate lines (see :func:`evaluate_position`).
+
+    This is an async generator yielding ``(index, info)`` pairs as results come in, in input
+    order if ``ordered`` else in completion order. The input is consumed lazily, and at most
+    ``max_pending`` positions (default: twice the number of workers) are in flight or waiting
+    to be yielded, so a slow consumer or an endless input never piles up memory.
+    ``hash_size`` is the total budget for the whole pool (default: the preference setting).
+    If no ``pool`` is given, one is started for this call and shut down afterwards, or in client mode,
+    the positions are sent to the analysis server in batches of ``max_pending``.
+    """
+    if pool is None and _remote() is not None:
+        limit, batch_size = limit or _default_limit(), max_pending or 16
+        boards, index = iter(boards), 0
+        while True:
+            batch = list(itertools.islice(boards, batch_size))
+            if not batch:
+                return
+            for info in await _remote().evaluate_many(batch, limit=limit, multipv=multipv):
+                yield index, info
+                index += 1
+    own_pool = pool is None
+    if own_pool:
+        pool = _default_pool(n_workers=n_workers, hash_size=hash_size, threads=threads)
+        if pool is None:
+            return
+    limit = limit or _default_limit()
+
+    async def work(session: engine_session = None, board = None):
+        if isinstance(board, str):
+            board = chess.Board(board)
+        return await evaluate_position(board, session=session, limit=limit, multipv=multipv)
+
+    try:
+        async for index, info in _fan_out(boards, pool=pool, work=work, ordered=ordered, max_pending=max_pending):
+            yield index, info
+    finally:
+        if own_pool:
+            await asyncio.get_event_loop().run_in_executor(None, pool.close)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import chess
+import chess.engine
+
+from .._preferences import preferences
+
+MIN_MOVE_TIME = 0.01 # sec
+CLOCK_SAFETY = 0.4 # never spend more than this fraction of the remaining clock on one move
+
+
+class search_budget(object):
+    """
+    How much search a move gets.
+
+    A fixed budget is a ``time`` (sec), ``depth`` and/or ``nodes`` limit per move, whichever is
+    reached first. With a clock (:meth:`limit` given the ``remaining`` time of the side to move),
+    the move gets its share of the clock: ``remaining / moves_to_go`` (estimated from the move
+    number if not given) plus most of the ``increment``, still capped by ``time``, ``depth`` and
+    ``nodes``.
+
+    The budget is an upper bound: with ``early_stop``, :func:`search_move` stops as soon as the
+    best move has held for ``stable_depths`` depths (from ``stable_depth`` on) or the position is
+    resolved (mate or tablebase score), and a single legal move is played without searching.
+    """
+    def __init__(self, time: float = None, depth: int = None, nodes: int = None, increment: float = 0.0, moves_to_go: int = None,
+                 early_stop: bool = True, stable_depth: int = 18, stable_depths: int = 6):
+        self.time = time
+        self.depth = depth
+        self.nodes = nodes
+        self.increment = increment
+        self.moves_to_go = moves_to_go
+        self.early_stop = early_stop
+        self.stable_depth = stable_depth
+        self.stable_depths = stable_depths
+
+    @classmethod
+    def from_preferences(cls, **kwargs) -> "search_budget":
+        return cls(time=preferences['chess_engine_search_time'], depth=preferences['chess_engine_search_depth'],
+                   nodes=preferences['chess_engine_search_nodes'], **kwargs)
+
+    def allocate(self, board: chess.Board = None, remaining: float = None) -> float:
+        """Returns the time (sec) for the next move of ``board``, or None if the budget has no time limit."""
+        if remaining is None:
+            return self.time
+        moves_to_go = self.moves_to_go or max(15, 45 - board.fullmove_number // 2)
+        allocated = min(remaining / moves_to_go + 0.75 * self.increment, CLOCK_SAFETY * remaining)
+        if self.time is not None:
+            allocated = min(allocated, self.time)
+        return max(MIN_MOVE_TIME, allocated)
+
+    def limit(self, board: chess.Board = None, remaining: float = None) -> chess.engine.Limit:
+        return chess.engine.Limit(time=self.allocate(board, remaining), depth=self.depth, nodes=self.nodes)
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import array
+import atexit
+import collections
+import os
+import sqlite3
+import struct
+import threading
+
+import chess
+import chess.engine
+import chess.polyglot
+
+from ..data import data_root_path, pack_move, unpack_move
+
+CACHE_VERSION = 4 # the store is rebuilt when this changes
+LINE_HEADER = struct.Struct("<iBH") # score, is mate, PV length
+
+def engine_identity(command: str = None) -> str:
+    """Identifies an engine build by its executable path and modification time (of each existing file, for a command line)."""
+    if not isinstance(command, str):
+        return " ".join(engine_identity(part) if os.path.isfile(part) else part for part in command)
+    path = os.path.abspath(command)
+    try:
+        return f"{path}@{int(os.path.getmtime(path))}"
+    except OSError:
+        return path
+
+def _pack_lines(infos: list = None) -> bytes:
+    # one record per PV line: the score relative to the side to move, then the packed PV moves
+    packed = []
+    for info in infos:
+        score = info["score"].relative
+        pv = info.get("pv", [])
+        packed.append(LINE_HEADER.pack(score.mate() if score.is_mate() else score.score(), int(score.is_mate()), len(pv)))
+        packed.append(array.array("H", [pack_move(move) for move in pv]).tobytes())
+    return b"".join(packed)
+
+def _unpack_lines(packed: bytes = None) -> list:
+    lines, offset = [], 0
+    while offset < len(packed):
+        score, mate, n_moves = LINE_HEADER.unpack_from(packed, offset)
+        offset += LINE_HEADER.size
+        pv = array.array("H", packed[offset:offset + 2 * n_moves])
+        offset += 2 * n_moves
+        lines.append((chess.engine.Mate(score) if mate else chess.engine.Cp(score), [unpack_move(move) for move in pv]))
+    return lines
+
+def _satisfies(entry: tuple = None, limit: chess.engine.Limit = None, multipv: int = 1) -> bool:
+    # nodes and time are checked against the limit searched to as well: engines report a little less than they were given
+    depth, nodes, time, n_lines, searched_nodes, searched_time = entry[:6]
+    if n_lines < multipv:
+        return False
+    if limit.depth is not None:
+        return depth >= limit.depth
+    if limit.nodes is not None:
+        return max(nodes, searched_nodes) >= limit.nodes
+    if limit.time is not None:
+        return max(time, searched_time) >= limit.time
+    return False # clock and mate limits are not reused
+
+def _covers(entry: tuple = None, other: tuple = None) -> bool:
+    # whether every request served by other is served by entry too
+    depth, nodes, time, n_lines, searched_nodes, searched_time = entry[:6]
+    other_depth, other_nodes, other_time, other_lines, other_searched_nodes, other_searched_time = other[:6]
+    return (depth >= other_depth and n_lines >= other_lines and max(nodes, searched_nodes) >= max(other_nodes, other_searched_nodes)
+            and max(time, searched_time) >= max(other_time, other_searched_time))
+
+
+class evaluation_cache(object):
+    """
+    Engine evaluations keyed by (engine identity, Zobrist hash of the position).
+
+    Recent positions are kept in an in-memory LRU of at most ``max_entries``; all entries
+    are written to a compact SQLite store under the data directory, so they survive
+    restarts. A deeper result is reused for a shallower request, a MultiPV result for a
+    request with as many lines or fewer. One result is kept per position and number of lines,
+    unless a deeper result with as many lines or more makes it useless. A
+    search that ran to its node or time limit serves later requests with that limit, whatever
+    the engine reported.
+    Scores are stored relative to the side to move.
+    """
+    def __init__(self, path = data_root_path / "evaluation_cache.sqlite3", max_entries: int = 100000, flush_every: int = 64):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._dirty = {}
+        self._engine_ids = {}
+        self._db = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # with self._lock held
+        if self._db is None:
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+                with self._db:
+                    self._db.execute("DROP TABLE IF EXISTS evaluation")
+                    self._db.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+            self._db.execute("CREATE TABLE IF NOT EXISTS engine (id INTEGER PRIMARY KEY, name TEXT UNIQUE)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS evaluation (engine INTEGER, key INTEGER, depth INTEGER, nodes INTEGER, time REAL, "
+                             "multipv INTEGER, searched_nodes INTEGER, searched_time REAL, lines BLOB, PRIMARY KEY (engine, key, multipv)) WITHOUT ROWID")
+            atexit.register(self.close)
+        return self._db
+
+    def _engine_id(self, engine: str = None) -> int:
+        # with self._lock held
+        if engine not in self._engine_ids:
+            db = self._connect()
+            db.execute("INSERT OR IGNORE INTO engine (name) VALUES (?)", (engine,))
+            self._engine_ids[engine] = db.execute("SELECT id FROM engine WHERE name = ?", (engine,)).fetchone()[0]
+        return self._engine_ids[engine]
+
+    def _lookup(self, engine: str = None, key: int = None) -> tuple:
+        # with self._lock held; the entries of a position, by number of lines
+        entries = self._entries.get((engine, key))
+        if entries is not None:
+            self._entries.move_to_end((engine, key))
+            return entries
+        rows = self._connect().execute("SELECT depth, nodes, time, multipv, searched_nodes, searched_time, lines FROM evaluation "
+                                       "WHERE engine = ? AND key = ? ORDER BY multipv", (self._engine_id(engine), key - (1 << 63))).fetchall()
+        if not rows:
+            return ()
+        entries = tuple(tuple(row) for row in rows)
+        self._remember((engine, key), entries)
+        return entries
+
+    def _remember(self, cache_key: tuple = None, entries: tuple = None) -> None:
+        # with self._lock held
+        self._entries[cache_key] = entries
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, board: chess.Board = None, limit: chess.engine.Limit = None, engine: str = None, multipv: int = None):
+        """
+        Returns a cached info dict good enough for ``limit``, or None. With ``multipv``,
+        returns a list of that many info dicts (best line first), like the engine does.
+        """
+        with self._lock:
+            entries = [entry for entry in self._lookup(engine, chess.polyglot.zobrist_hash(board)) if _satisfies(entry, limit, multipv or 1)]
+        if not entries:
+            return None
+        depth, nodes, time, n_lines, _, _, lines = max(entries, key=lambda entry: entry[0])
+        infos = [{"score": chess.engine.PovScore(score, board.turn), "depth": depth, "nodes": nodes, "time": time, "pv": pv, "multipv": rank}
+                 for rank, (score, pv) in enumerate(_unpack_lines(lines)[:multipv or 1], start=1)]
+        return infos if multipv is not None else infos[0]
+
+    def put(self, board: chess.Board = None, engine: str = None, info = None, limit: chess.engine.Limit = None) -> None:
+        """
+        Stores an info dict, or the list of info dicts of a MultiPV search. ``limit`` is the limit
+        the search ran to, if it was not stopped before.
+        """
+        infos = info if isinstance(info, list) else [info]
+        if not infos or any("score" not in info for info in infos):
+            return
+        searched_nodes, searched_time = (limit.nodes or 0, limit.time or 0.0) if limit is not None else (0, 0.0)
+        entry = (infos[0].get("depth", 0), infos[0].get("nodes", 0), infos[0].get("time", 0.0), len(infos), searched_nodes, searched_time, _pack_lines(infos))
+        cache_key = (engine, chess.polyglot.zobrist_hash(board))
+        with self._lock:
+            previous = self._lookup(*cache_key) # on disk too: the entries may have left memory, or be from an earlier run
+            if any(_covers(other, entry) for other in previous):
+                return
+            entries = tuple(sorted([other for other in previous if other[3] != entry[3] and not _covers(entry, other)] + [entry], key=lambda entry: entry[3]))
+            self._remember(cache_key, entries)
+            self._dirty[cache_key] = entries
+            if len(self._dirty) >= self.flush_every:
+                self._flush()
+
+    def _flush(self) -> None:
+        # with self._lock held
+        if not self._dirty:
+            return
+        db = self._connect()
+        rows = [((self._engine_id(engine), key - (1 << 63)), entries) for (engine, key), entries in self._dirty.items()]
+        with db:
+            db.executemany("DELETE FROM evaluation WHERE engine = ? AND key = ?", [position for position, _ in rows])
+            db.executemany("INSERT INTO evaluation VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [position + entry for position, entries in rows for entry in entries])
+        self._dirty.clear()
+
+    def flush(self) -> None:
+        """Writes pending entries to disk."""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._flush()
+                self._db.close()
+                self._db = None
+                self._engine_ids.clear()
+
+
+default_evaluation_cache = evaluation_cache()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import asyncio
+import http.client
+import json
+import socket
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import chess
+import chess.engine
+
+from ._budget import search_budget
+
+DEFAULT_PORT = 8765
+
+# the JSON wire format of the analysis server: boards as their root FEN and moves (so the
+# engine sees the game's repetitions), scores relative to the side to move, moves in UCI
+
+def board_to_json(board: chess.Board = None) -> dict:
+    return {"fen": board.root().fen(), "moves": [move.uci() for move in board.move_stack]}
+
+def board_from_json(data: dict = None) -> chess.Board:
+    board = chess.Board(data["fen"])
+    for uci in data.get("moves", []):
+        board.push_uci(uci)
+    if not board.is_valid():
+        raise ValueError(f"invalid position {board.fen()}")
+    return board
+
+def limit_to_json(limit: chess.engine.Limit = None) -> dict:
+    if limit is None:
+        return None
+    return {key: getattr(limit, key) for key in ("time", "depth", "nodes", "mate") if getattr(limit, key) is not None}
+
+def limit_from_json(data: dict = None) -> chess.engine.Limit:
+    return None if data is None else chess.engine.Limit(**data)
+
+def budget_to_json(budget: search_budget = None) -> dict:
+    return None if budget is None else dict(vars(budget))
+
+def budget_from_json(data: dict = None) -> search_budget:
+    return None if data is None else search_budget(**data)
+
+def info_to_json(info = None):
+    """An info dict (or a list of them, or None) as JSON-serializable data."""
+    if info is None or isinstance(info, list):
+        return info if info is None else [info_to_json(line) for line in info]
+    data = {}
+    for key, value in info.items():
+        if key == "score":
+            relative = value.relative
+            data["score"] = {"mate" if relative.is_mate() else "cp": relative.mate() if relative.is_mate() else relative.score(), "turn": value.turn}
+        elif key in ("pv", "refutation_pv"):
+            data[key] = [move.uci() for move in value]
+        elif isinstance(value, (bool, int, float, str)):
+            data[key] = value
+    return data
+
+def info_from_json(data = None):
+    """The reverse of :func:`info_to_json`."""
+    if data is None or isinstance(data, list):
+        return data if data is None else [info_from_json(line) for line in data]
+    info = dict(data)
+    if "score" in data:
+        score = data["score"]
+        relative = chess.engine.Mate(score["mate"]) if "mate" in score else chess.engine.Cp(score["cp"])
+        info["score"] = chess.engine.PovScore(relative, score["turn"])
+    for key in ("pv", "refutation_pv"):
+        if key in data:
+            info[key] = [chess.Move.from_uci(uci) for uci in data[key]]
+    return info
+
+def result_to_json(result: chess.engine.PlayResult = None) -> dict:
+    if result is None:
+        return None
+    return {"move": result.move.uci() if result.move else None, "ponder": result.ponder.uci() if result.ponder else None,
+            "info": info_to_json(result.info), "draw_offered": result.draw_offered, "resigned": result.resigned}
+
+def result_from_json(data: dict = None) -> chess.engine.PlayResult:
+    if data is None:
+        return None
+    return chess.engine.PlayResult(chess.Move.from_uci(data["move"]) if data["move"] else None, chess.Move.from_uci(data["ponder"]) if data["ponder"] else None,
+                                   info=info_from_json(data["info"]) or {}, draw_offered=data["draw_offered"], resigned=data["resigned"])
+
+
+class analysis_client(object):
+    """
+    Client of an analysis server (``python -m chess4fun serve``, see :class:`analysis_server`) at
+    ``url``. The methods mirror :func:`evaluate_position`, :func:`evaluate_position_stream`,
+    :func:`advise_move` and :func:`evaluate_positions`, and return the same types; those functions
+    use the client themselves when the ``analysis_server`` preference is set (client mode). The
+    HTTP calls run in the default executor, so the caller's event loop is never blocked. Server-side
+    failures are raised as :class:`chess.engine.EngineError`.
+    """
+    _clients = {}
+
+    def __init__(self, url: str = None, timeout: float = 600.0):
+        self.url = (url or f"http://127.0.0.1:{DEFAULT_PORT}").rstrip("/")
+        self.timeout = timeout
+
+    @classmethod
+    def for_url(cls, url: str = None) -> "analysis_client":
+        """A client per server, shared."""
+        if url not in cls._clients:
+            cls._clients[url] = cls(url)
+        return cls._clients[url]
+
+    def _open(self, path: str = None, payload: dict = None):
+        request = urllib.request.Request(self.url + path, data=None if payload is None else json.dumps(payload).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as error:
+            try:
+                message = json.loads(error.read())["error"]
+            except Exception:
+                message = str(error)
+            raise chess.engine.EngineError(f"analysis server: {message}") from None
+        except urllib.error.URLError as error:
+            raise chess.engine.EngineError(f"analysis server {self.url} unreachable: {error.reason}") from None
+
+    def _request(self, path: str = None, payload: dict = None):
+        with self._open(path, payload) as response:
+            return json.loads(response.read())
+
+    async def _call(self, path: str = None, payload: dict = None):
+        return await asyncio.get_event_loop().run_in_executor(None, self._request, path, payload)
+
+    def status(self) -> dict:
+        """The server's pool and request counters."""
+        return self._request("/status")
+
+    async def evaluate(self, board: chess.Board = None, limit: chess.engine.Limit = None, multipv: int = None):
+        return info_from_json(await self._call("/evaluate", {"board": board_to_json(board), "limit": limit_to_json(limit), "multipv": multipv}))
+
+    async def evaluate_many(self, boards: list = None, limit: chess.engine.Limit = None, multipv: int = None) -> list:
+        """Evaluates several boards (or FEN strings) in one request, spread over the server's pool."""
+        boards = [chess.Board(board) if isinstance(board, str) else board for board in boards]
+        payload = {"boards": [board_to_json(board) for board in boards], "limit": limit_to_json(limit), "multipv": multipv}
+        return [info_from_json(info) for info in await self._call("/batch", payload)]
+
+    async def advise(self, board: chess.Board = None, limit: chess.engine.Limit = None, budget: search_budget = None, book_random: bool = False):
+        payload = {"board": board_to_json(board), "limit": limit_to_json(limit), "budget": budget_to_json(budget), "book_random": book_random}
+        return result_from_json(await self._call("/advise", payload))
+
+    def _open_stream(self, path: str = None, payload: dict = None) -> tuple:
+        # (response, socket): the socket to shut down, from any thread, to stop reading and tell the server
+        url = urllib.parse.urlsplit(self.url + path)
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=self.timeout)
+        try:
+            connection.request("POST", url.path, body=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"})
+            sock = connection.sock
+            response = connection.getresponse()
+        except OSError as error:
+            connection.close()
+            raise chess.engine.EngineError(f"analysis server {self.url} unreachable: {error}") from None
+        if response.status != 200:
+            try:
+                message = json.loads(response.read())["error"]
+            except Exception:
+                message = f"HTTP {response.status}"
+            response.close()
+            raise chess.engine.EngineError(f"analysis server: {message}")
+        return response, sock
+
+    async def evaluate_stream(self, board: chess.Board = None, limit: chess.engine.Limit = None, target_depth: int = None, early_stop: bool = True):
+        """
+        Async generator of the progressive evaluation's infos, as the server streams them. Leaving
+        the loop closes the connection, and the server stops the search if no one else follows it.
+        """
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue()
+        closed = threading.Event()
+        opened = []
+        payload = {"board": board_to_json(board), "limit": limit_to_json(limit), "target_depth": target_depth, "early_stop": early_stop}
+
+        def put(item = None) -> None:
+            if not closed.is_set():
+                try:
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+                except RuntimeError: # the caller's loop is gone
+                    closed.set()
+
+        def read() -> None:
+            # in the executor: one JSON info per line, until the server closes the response
+            try:
+                response, sock = self._open_stream("/stream", payload)
+                opened.append(sock)
+                with response:
+                    if closed.is_set(): # left before the response came
+                        return
+                    for line in response:
+                        if closed.is_set():
+                            return
+                        put(json.loads(line))
+            except Exception as exc:
+                put(exc)
+            finally:
+                put(None)
+
+        loop.run_in_executor(None, read)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                if "error" in item:
+                    raise chess.engine.EngineError(f"analysis server: {item['error']}")
+                yield info_from_json(item)
+        finally:
+            closed.set()
+            for sock in opened: # wakes the reader up, and the server sees the connection go
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
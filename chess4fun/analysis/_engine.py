@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+
+import chess
+import chess.engine
+
+from .._telemetry import telemetry
+
+
+class engine_session(object):
+    """
+    A long-lived UCI engine shared by successive analysis calls.
+
+    The engine process lives on a dedicated event loop in a background thread, so that
+    it survives across ``asyncio.run()`` calls made by the caller. The process is only
+    (re)started when the executable path changes or the engine died, and options (e.g. "Hash")
+    are only sent when they differ from what has already been applied, so the hash table is
+    allocated once and the transposition table carries over from one move to the next.
+
+    ``command`` and ``options`` are the defaults used when a call does not pass its own.
+    """
+    def __init__(self, name: str = "chess4fun-engine", command: str = None, options: dict = None):
+        self.name = name
+        self.command = command
+        self.options = options
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._transport = None
+        self._engine = None
+        self._command = None
+        self._applied_options = {}
+        self._engine_lock = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._engine is not None and not self._engine.returncode.done()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Schedules ``coro`` on the engine loop; usable from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    async def _run(self, coro):
+        # runs on the caller's loop; cancelling the caller also cancels the engine command
+        return await asyncio.wrap_future(self.submit(coro))
+
+    async def _ensure_engine(self, command: str = None, options: dict = None) -> chess.engine.Protocol:
+        # on the engine loop
+        if self._engine is not None and (self._command != command or self._engine.returncode.done()):
+            await self._quit_engine()
+        if self._engine is None:
+            with telemetry.span("engine.spawn"):
+                self._transport, self._engine = await chess.engine.popen_uci(command=command)
+            self._command = command
+            self._applied_options = {}
+        options = options or {}
+        changed = {k: v for k, v in options.items() if self._applied_options.get(k) != v}
+        for name in [name for name in self._applied_options if name not in options]: # dropped: back to the engine's default
+            del self._applied_options[name]
+            if name in self._engine.options and self._engine.options[name].default is not None:
+                changed[name] = self._engine.options[name].default
+        if changed:
+            with telemetry.span("engine.configure"): # a new "Hash" size is allocated here
+                await self._engine.configure(changed)
+            self._applied_options.update({k: v for k, v in changed.items() if k in options})
+        return self._engine
+
+    async def _quit_engine(self) -> None:
+        # on the engine loop
+        engine, self._engine, self._transport = self._engine, None, None
+        self._applied_options = {}
+        if engine is not None and not engine.returncode.done():
+            try:
+                with telemetry.span("engine.quit"):
+                    await asyncio.wait_for(engine.quit(), timeout=5.0)
+            except (asyncio.TimeoutError, chess.engine.EngineError):
+                pass
+
+    async def _locked(self, command, options, call):
+        # on the engine loop; commands to a single engine must not overlap
+        if self._engine_lock is None:
+            self._engine_lock = asyncio.Lock()
+        async with self._engine_lock:
+            engine = await self._ensure_engine(command=command or self.command, options=self.options if options is None else options)
+            return await call(engine)
+
+    async def analyse(self, board: chess.Board = None, limit: chess.engine.Limit = None, command: str = None, options: dict = None, **kwargs) -> chess.engine.InfoDict:
+        board = board.copy()
+        with telemetry.span("engine.analyse"):
+            info = await self._run(self._locked(command, options, lambda engine: engine.analyse(board, limit, **kwargs)))
+        telemetry.record_info(info)
+        return info
+
+    async def play(self, board: chess.Board = None, limit: chess.engine.Limit = None, command: str = None, options: dict = None, **kwargs) -> chess.engine.PlayResult:
+        board = board.copy()
+        with telemetry.span("engine.play"):
+            result = await self._run(self._locked(command, options, lambda engine: engine.play(board, limit, **kwargs)))
+        telemetry.record_info(result.info)
+        return result
+
+    async def analysis(self, board: chess.Board = None, limit: chess.engine.Limit = None, command: str = None, options: dict = None, **kwargs):
+        """
+        Async generator of the engine's info dicts (those with a score) as the search deepens.
+        The search runs until ``limit`` is reached; closing the generator early stops it.
+        """
+        board = board.copy()
+        caller_loop = asyncio.get_event_loop()
+        queue = asyncio.Queue()
+
+        async def search(engine: chess.engine.Protocol = None):
+            # on the engine loop
+            try:
+                with await engine.analysis(board, limit, **kwargs) as analysis:
+                    async for info in analysis:
+                        if "score" in info:
+                            caller_loop.call_soon_threadsafe(queue.put_nowait, info)
+            except Exception as exc:
+                caller_loop.call_soon_threadsafe(queue.put_nowait, exc)
+            finally:
+                caller_loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        future = self.submit(self._locked(command, options, search))
+        try:
+            with telemetry.span("engine.analysis"):
+                while True:
+                    info = await queue.get()
+                    if info is None:
+                        return
+                    if isinstance(info, Exception):
+                        raise info
+                    telemetry.record_info(info)
+                    yield info
+        finally:
+            future.cancel()
+
+    def close(self) -> None:
+        """Quits the engine and stops the background loop. Safe to call more than once."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._quit_engine(), loop).result(timeout=10.0)
+        except Exception:
+            pass
+        self._engine_lock = None
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10.0)
+        loop.close()
+
+
+class engine_pool(object):
+    """
+    ``n_workers`` engine sessions splitting one memory budget, for batch analysis.
+
+    ``hash_size`` is the *total* hash budget (MB), divided evenly among the workers, so that
+    a pool never allocates N copies of the single-engine hash. Each worker searches with
+    ``threads`` threads; one thread per worker and one worker per core scales best.
+    ``syzygy_path`` is passed on to the engines as their SyzygyPath option.
+    """
+    def __init__(self, command: str = None, n_workers: int = None, hash_size: int = None, threads: int = 1, syzygy_path: str = None):
+        self.command = command
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.options = {"Threads": threads}
+        if hash_size is not None:
+            self.options["Hash"] = max(1, hash_size // self.n_workers)
+        if syzygy_path:
+            self.options["SyzygyPath"] = syzygy_path
+        self.sessions = [engine_session(name=f"chess4fun-engine-{i}", command=command, options=self.options) for i in range(self.n_workers)]
+
+    def close(self) -> None:
+        for session in self.sessions:
+            session.close()
+
+
+default_engine_session = engine_session()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import asyncio
+import chess
+import chess.engine
+import chess.pgn
+
+from ._analysis import evaluate_position, _default_limit, _default_pool, _fan_out, MATE_SCORE
+from ._engine import engine_session, engine_pool
+from ..data import read_games, pgn_writer
+
+SCORE_CAP = 1000 # centipawns; beyond this the game is decided and swings are not counted
+
+# centipawn loss thresholds, from the mover's point of view
+INACCURACY_CP_LOSS = 50
+MISTAKE_CP_LOSS = 100
+BLUNDER_CP_LOSS = 300
+
+def classify_move(cp_loss: int = None) -> int:
+    """Returns the NAG (``?!``, ``?`` or ``??``) for a move losing ``cp_loss`` centipawns, or None."""
+    if cp_loss >= BLUNDER_CP_LOSS:
+        return chess.pgn.NAG_BLUNDER
+    if cp_loss >= MISTAKE_CP_LOSS:
+        return chess.pgn.NAG_MISTAKE
+    if cp_loss >= INACCURACY_CP_LOSS:
+        return chess.pgn.NAG_DUBIOUS_MOVE
+    return None
+
+def _capped_score(score: chess.engine.PovScore = None, color: chess.Color = chess.WHITE) -> int:
+    cp = score.pov(color).score(mate_score=MATE_SCORE)
+    return max(-SCORE_CAP, min(SCORE_CAP, cp))
+
+async def _evaluate(board: chess.Board = None, session: engine_session = None, limit: chess.engine.Limit = None, game = None) -> chess.engine.InfoDict:
+    if board.is_checkmate():
+        return {"score": chess.engine.PovScore(chess.engine.Mate(0), board.turn)}
+    if board.is_game_over():
+        return {"score": chess.engine.PovScore(chess.engine.Cp(0), board.turn)}
+    return await evaluate_position(board, session=session, limit=limit, game=game)
+
+async def analyse_game(moves = None, board: chess.Board = None, limit: chess.engine.Limit = None, session: engine_session = None):
+    """
+    Evaluates every ply of a game and classifies each move by the eval swing it causes.
+
+    This is an async generator yielding one dict per ply as soon as it is evaluated, with keys
+    ``ply``, ``move``, ``san``, ``info`` (the engine info after the move), ``score`` (White's
+    point of view), ``cp_loss`` and ``nag``. All plies are searched as one engine "game", so the
+    transposition table is kept between successive plies.
+    """
+    board = chess.Board() if board is None else board.copy()
+    limit = limit or _default_limit()
+    game = object()
+    info = await _evaluate(board, session=session, limit=limit, game=game)
+    if info is None:
+        return
+    for ply, move in enumerate(moves, start=board.ply() + 1):
+        mover = board.turn
+        before = _capped_score(info["score"], mover)
+        san = board.san(move)
+        board.push(move)
+        info = await _evaluate(board, session=session, limit=limit, game=game)
+        cp_loss = max(0, before - _capped_score(info["score"], mover))
+        yield {"ply": ply, "move": move, "san": san, "info": info, "score": info["score"].white(),
+               "cp_loss": cp_loss, "nag": classify_move(cp_loss)}
+
+def annotate_game(game: chess.pgn.Game = None, ply_results: list = None) -> chess.pgn.Game:
+    """Adds ``[%eval ...]`` comments and move NAGs from :func:`analyse_game` results to the mainline of ``game``."""
+    for node, result in zip(game.mainline(), ply_results):
+        score = result["score"]
+        if score.is_mate():
+            if score.mate() != 0: # no eval after the mating move
+                node.comment = f"[%eval #{score.mate()}]"
+        else:
+            node.comment = f"[%eval {score.score() / 100:.2f}]"
+        if result["nag"] is not None:
+            node.nags.add(result["nag"])
+    return game
+
+async def analyse_games(games = None, limit: chess.engine.Limit = None, n_workers: int = None, hash_size: int = None, threads: int = 1,
+                        ordered: bool = True, max_pending: int = None, pool: engine_pool = None):
+    """
+    Analyses and annotates an iterable of :class:`chess.pgn.Game` over a pool of engines.
+
+    This is an async generator yielding ``(index, annotated_game)``; each game stays on one
+    engine for all its plies. See :func:`evaluate_positions` for the remaining arguments.
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = _default_pool(n_workers=n_workers, hash_size=hash_size, threads=threads)
+        if pool is None:
+            return
+    limit = limit or _default_limit()
+
+    async def work(session: engine_session = None, game: chess.pgn.Game = None):
+        ply_results = [result async for result in analyse_game(game.mainline_moves(), board=game.board(), limit=limit, session=session)]
+        return annotate_game(game, ply_results)
+
+    try:
+        async for index, game in _fan_out(games, pool=pool, work=work, ordered=ordered, max_pending=max_pending):
+            yield index, game
+    finally:
+        if own_pool:
+            await asyncio.get_event_loop().run_in_executor(None, pool.close)
+
+def analyse_pgn_file(input_path: str = None, output_path: str = None, limit: chess.engine.Limit = None,
+                     n_workers: int = None, hash_size: int = None, threads: int = 1) -> int:
+    """Annotates every game of a PGN file into ``output_path``, writing games as they finish. Returns the number of games."""
+    async def run() -> int:
+        with open(input_path, encoding="utf-8-sig", errors="replace") as pgn_file, pgn_writer(output_path, mode="w") as writer:
+            async for _, game in analyse_games(read_games(pgn_file), limit=limit, n_workers=n_workers, hash_size=hash_size, threads=threads):
+                writer.write(game)
+        return writer.n_games
+
+    return asyncio.run(run())
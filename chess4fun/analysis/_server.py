@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import asyncio
+import collections
+import http.server
+import json
+import queue
+import select
+import socket
+import sys
+import threading
+
+import chess.engine
+
+from ._engine import engine_pool
+from ._analysis import evaluate_position, evaluate_position_stream, advise_move, _default_pool
+from ._client import DEFAULT_PORT, board_from_json, limit_from_json, budget_from_json, info_to_json, result_to_json
+
+STREAM_HEARTBEAT = 0.25 # sec; how often a stream without news checks whether its client is still there
+
+
+class _shared_search(object):
+    # one search, followed by every request for it: the infos so far are replayed to a late follower
+    def __init__(self, on_leave = None):
+        self._lock = threading.Lock()
+        self._infos = []
+        self._followers = []
+        self._done = None # ("done", result, error) once finished
+        self.on_leave = on_leave # called as each follower leaves, done or not
+        self.n_followers = 0 # counted by the server, as requests join the search
+        self.future = None # of the search on the server loop
+
+    def publish(self, info = None) -> None:
+        with self._lock:
+            self._infos.append(info)
+            for follower in self._followers:
+                follower.put(("info", info, None))
+
+    @property
+    def done(self) -> bool:
+        return self._done is not None
+
+    def finish(self, result = None, error: Exception = None) -> None:
+        with self._lock:
+            self._done = ("done", result, error)
+            for follower in self._followers:
+                follower.put(self._done)
+            self._followers = []
+
+    def follow(self, heartbeat: float = None):
+        """
+        Yields the infos as they come, then returns the result (or raises the error). With a
+        ``heartbeat``, None is yielded when no info has come for that long.
+        """
+        follower = queue.Queue()
+        with self._lock:
+            for info in self._infos:
+                follower.put(("info", info, None))
+            if self._done is not None:
+                follower.put(self._done)
+            else:
+                self._followers.append(follower)
+        try:
+            while True:
+                try:
+                    kind, value, error = follower.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield None
+                    continue
+                if kind == "done":
+                    if error is not None:
+                        raise error
+                    return value
+                yield value
+        finally:
+            with self._lock:
+                if follower in self._followers:
+                    self._followers.remove(follower)
+            if self.on_leave is not None:
+                self.on_leave()
+
+    def wait(self):
+        follower = self.follow()
+        while True:
+            try:
+                next(follower)
+            except StopIteration as stop:
+                return stop.value
+
+
+class _request_handler(http.server.BaseHTTPRequestHandler):
+    server_version = "chess4fun"
+
+    def log_message(self, format: str = None, *args) -> None:
+        if self.server.analysis.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, status: int = None, data = None) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/status":
+            self._reply(200, self.server.analysis.status())
+        else:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        analysis = self.server.analysis
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/evaluate":
+                self._reply(200, analysis.evaluate(payload))
+            elif self.path == "/batch":
+                self._reply(200, analysis.batch(payload))
+            elif self.path == "/advise":
+                self._reply(200, analysis.advise(payload))
+            elif self.path == "/stream":
+                self._stream(analysis.stream(payload))
+            else:
+                self._reply(404, {"error": f"unknown path {self.path}"})
+        except (KeyError, TypeError, ValueError) as exc: # a malformed request
+            self._reply(400, {"error": f"{exc!r}"})
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError) as exc:
+            self._reply(502, {"error": f"{exc!r}"})
+        except Exception as exc:
+            self._reply(500, {"error": f"{exc!r}"})
+
+    def _client_gone(self) -> bool:
+        # the request is read in full: a readable connection is one the client has closed
+        if not select.select([self.connection], [], [], 0)[0]:
+            return False
+        try:
+            return self.connection.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    def _stream(self, infos = None) -> None:
+        # one JSON info per line, flushed as they come; the end of the response is the end of the search
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for info in infos:
+                if info is None: # no news: only check that the client is still there
+                    if self._client_gone():
+                        return
+                    continue
+                self.wfile.write((json.dumps(info) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # the client left
+        except Exception as exc: # the headers are sent: whatever the error, it is the last line
+            try:
+                self.wfile.write((json.dumps({"error": f"{exc!r}"}) + "\n").encode("utf-8"))
+            except OSError:
+                pass
+        finally:
+            infos.close() # leaves the search: the last follower to leave cancels it
+
+
+class analysis_server(object):
+    """
+    An HTTP JSON server sharing one pool of warm engines (see :class:`engine_pool`) among any
+    number of local clients (see :class:`analysis_client`), instead of an engine (and its hash)
+    per client process.
+
+    ``POST /evaluate``, ``/advise``, ``/batch`` and ``/stream`` run :func:`evaluate_position`
+    (with ``multipv``), :func:`advise_move`, several evaluations spread over the pool and
+    :func:`evaluate_position_stream` (answered as one JSON info per line, as the search deepens),
+    so the opening book, the tablebases and the evaluation cache are shared too. ``GET /status``
+    reports the pool and the request counters.
+
+    Identical requests in flight (same kind, game and limits) are coalesced: the later ones
+    follow the search started by the first, getting the infos it has already produced at once,
+    so that N clients on one position cost one search. A search all of whose clients have left
+    (a stream closed early) is cancelled, freeing its engine. Searches run on the server's event
+    loop thread, each on an idle engine of the pool (or waiting for one).
+    """
+    def __init__(self, pool: engine_pool = None, host: str = "127.0.0.1", port: int = DEFAULT_PORT, verbose: bool = False):
+        self.pool = pool
+        self.verbose = verbose
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="chess4fun-server", daemon=True)
+        self._loop_thread.start()
+        self._idle = asyncio.run_coroutine_threadsafe(self._idle_sessions(), self._loop).result()
+        self.httpd = http.server.ThreadingHTTPServer((host, port), _request_handler)
+        self.httpd.daemon_threads = True
+        self.httpd.analysis = self
+        self._serve_thread = None
+
+    async def _idle_sessions(self) -> asyncio.Queue:
+        # created on the server loop, which it belongs to
+        idle = asyncio.Queue()
+        for session in self.pool.sessions:
+            idle.put_nowait(session)
+        return idle
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _search(self, key: tuple = None, work = None, streaming: bool = False) -> _shared_search:
+        # the search in flight for key, or a new one running work(session)
+        with self._lock:
+            self.counters["requests"] += 1
+            shared = self._in_flight.get(key)
+            if shared is not None:
+                self.counters["coalesced"] += 1
+                shared.n_followers += 1
+                return shared
+            shared = self._in_flight[key] = _shared_search()
+            shared.on_leave = lambda: self._leave(key, shared)
+            shared.n_followers = 1
+            shared.future = asyncio.run_coroutine_threadsafe(self._run(key, shared, work, streaming), self._loop)
+        return shared
+
+    def _leave(self, key: tuple = None, shared: _shared_search = None) -> None:
+        # a request is done with its search; the search is cancelled if it was the last one, and still running
+        # (a finished search stays in flight until _run() is through with it)
+        with self._lock:
+            shared.n_followers -= 1
+            abandoned = shared.n_followers == 0 and self._in_flight.get(key) is shared and not (shared.done or shared.future.done())
+            if abandoned:
+                del self._in_flight[key] # a new request starts a new search
+                self.counters["abandoned"] += 1
+        if abandoned:
+            shared.future.cancel()
+
+    async def _run(self, key: tuple = None, shared: _shared_search = None, work = None, streaming: bool = False) -> None:
+        # on the server loop
+        session = await self._idle.get()
+        try:
+            if streaming:
+                info = None
+                async for info in work(session):
+                    shared.publish(info_to_json(info))
+                shared.finish(info_to_json(info))
+            else:
+                shared.finish(await work(session))
+        except asyncio.CancelledError:
+            shared.finish(error=chess.engine.EngineError("search abandoned"))
+            raise
+        except Exception as exc:
+            self.counters["errors"] += 1
+            shared.finish(error=exc)
+        finally:
+            self._idle.put_nowait(session)
+            with self._lock:
+                if self._in_flight.get(key) is shared:
+                    del self._in_flight[key]
+
+    @staticmethod
+    def _key(kind: str = None, board: chess.Board = None, payload: dict = None, *fields) -> tuple:
+        # the whole game, not only the position: its history decides repetitions and the fifty-move rule
+        game = (board.root().fen(), tuple(move.uci() for move in board.move_stack))
+        return (kind, game) + tuple(json.dumps(payload.get(field), sort_keys=True) for field in fields)
+
+    def evaluate(self, payload: dict = None):
+        board, limit, multipv = board_from_json(payload["board"]), limit_from_json(payload.get("limit")), payload.get("multipv")
+        shared = self._search(self._key("evaluate", board, payload, "limit", "multipv"),
+                              lambda session: evaluate_position(board, session=session, limit=limit, multipv=multipv))
+        return info_to_json(shared.wait())
+
+    def batch(self, payload: dict = None) -> list:
+        limit, multipv = limit_from_json(payload.get("limit")), payload.get("multipv")
+        searches = []
+        for board in map(board_from_json, payload["boards"]):
+            searches.append(self._search(self._key("evaluate", board, payload, "limit", "multipv"),
+                                         lambda session, board=board: evaluate_position(board, session=session, limit=limit, multipv=multipv)))
+        return [info_to_json(shared.wait()) for shared in searches]
+
+    def advise(self, payload: dict = None):
+        board, limit, budget = board_from_json(payload["board"]), limit_from_json(payload.get("limit")), budget_from_json(payload.get("budget"))
+        book_random = payload.get("book_random", False)
+        shared = self._search(self._key("advise", board, payload, "limit", "budget", "book_random"),
+                              lambda session: advise_move(board, session=session, limit=limit, budget=budget, book_random=book_random))
+        return result_to_json(shared.wait())
+
+    def stream(self, payload: dict = None):
+        board, limit = board_from_json(payload["board"]), limit_from_json(payload.get("limit"))
+        target_depth, early_stop = payload.get("target_depth"), payload.get("early_stop", True)
+        shared = self._search(self._key("stream", board, payload, "limit", "target_depth", "early_stop"),
+                              lambda session: evaluate_position_stream(board, session=session, limit=limit, target_depth=target_depth, early_stop=early_stop),
+                              streaming=True)
+        return shared.follow(heartbeat=STREAM_HEARTBEAT)
+
+    def status(self) -> dict:
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {"workers": self.pool.n_workers, "idle": self._idle.qsize(), "in_flight": in_flight, **self.counters}
+
+    def serve_forever(self) -> None:
+        self.httpd.serve_forever()
+
+    def start(self) -> "analysis_server":
+        """Serves in a background thread (e.g. in tests)."""
+        self._serve_thread = threading.Thread(target=self.serve_forever, name="chess4fun-http", daemon=True)
+        self._serve_thread.start()
+        return self
+
+    def close(self) -> None:
+        """Stops serving and shuts the pool down."""
+        if self._serve_thread is not None:
+            self.httpd.shutdown()
+            self._serve_thread.join()
+        self.httpd.server_close()
+        self.pool.close()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+
+
+def serve_analysis(host: str = "127.0.0.1", port: int = DEFAULT_PORT, n_workers: int = None, hash_size: int = None, verbose: bool = False) -> int:
+    """Runs an analysis server until interrupted, over a pool of the preferred engine (see :func:`evaluate_positions` for the pool arguments)."""
+    pool = _default_pool(n_workers=n_workers, hash_size=hash_size)
+    if pool is None:
+        print("no chess engine available", file=sys.stderr)
+        return 1
+    server = analysis_server(pool, host=host, port=port, verbose=verbose)
+    print(f"analysis server on {server.url} ({pool.n_workers} engine(s)); clients set the analysis_server preference to it", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import collections
+import concurrent.futures
+import threading
+
+import chess
+import chess.engine
+
+from .._telemetry import telemetry
+from ..data import position_key
+from ._analysis import evaluate_position_stream
+from ._engine import engine_session, default_engine_session
+
+
+def likely_positions(board: chess.Board = None, result = None, max_positions: int = 4) -> list:
+    """
+    The positions most likely to follow ``board``, most likely first, from what the engine already
+    said about it: ``result`` is an info dict (its PV), a list of them (MultiPV candidates, best
+    first) or a :class:`chess.engine.PlayResult` (the best move and its ponder move). The best line
+    gives the position after its first move and after the expected reply; the other candidates
+    give the positions after their first move.
+    """
+    if isinstance(result, chess.engine.PlayResult):
+        lines = [[move for move in (result.move, result.ponder) if move is not None]] if result.move is not None else []
+    elif isinstance(result, list):
+        lines = [info.get("pv", [])[:2 if rank == 0 else 1] for rank, info in enumerate(result)]
+    elif result:
+        lines = [result.get("pv", [])[:2]]
+    else:
+        lines = []
+    positions, keys = [], set()
+    for depth in (1, 2): # all the first moves before the replies
+        for line in lines:
+            if len(line) < depth:
+                continue
+            position = board.copy(stack=False)
+            for move in line[:depth]:
+                if move not in position.legal_moves:
+                    break
+                position.push(move)
+            else:
+                key = position_key(position)
+                if key not in keys and not position.is_game_over():
+                    keys.add(key)
+                    positions.append(position)
+    return positions[:max_positions]
+
+
+class speculative_analysis(object):
+    """
+    Analyzes the positions likely to come next while the engine would otherwise sit idle.
+
+    :meth:`speculate` queues positions (see :func:`likely_positions`); they are evaluated one at a
+    time on the engine loop with :func:`evaluate_position_stream` and the same limits as a real
+    evaluation, keeping the latest info of each. A real request for a position goes through
+    :meth:`claim` first: a position analyzed to the end is served at once, and the position being
+    analyzed is handed over, its search continuing (the rest of the queue is dropped). Any other
+    request pre-empts the speculation (:meth:`preempt`), so speculative work never delays a real
+    one by more than stopping a search. The results of the last ``max_results`` positions are kept.
+    """
+    def __init__(self, session: engine_session = None, max_results: int = 64):
+        self.session = session # None: the default session, or the analysis server in client mode
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self._future = None
+        self._generation = 0 # of the speculation job; a cancelled job must not touch the state of the next one
+        self._queue = collections.deque()
+        self._current = None # the key of the position being analyzed
+        self._listeners = [] # of the position being analyzed, once claimed
+        self._results = collections.OrderedDict() # key: (latest info, complete)
+
+    def speculate(self, boards: list = None) -> None:
+        """Replaces the queued speculation with ``boards`` (most likely first), skipping those already analyzed."""
+        self.preempt()
+        with self._lock:
+            if self._listeners: # claimed: the real evaluation goes on, no speculation behind it
+                return
+            for board in boards:
+                result = self._results.get(position_key(board))
+                if result is None or not result[1]:
+                    self._queue.append(board.copy(stack=False))
+            if self._queue and self._future is None:
+                self._generation += 1
+                self._future = (self.session or default_engine_session).submit(self._run(self._generation))
+
+    async def _run(self, generation: int = None) -> None:
+        # on the engine loop
+        try:
+            while True:
+                with self._lock:
+                    if generation != self._generation or not self._queue:
+                        if generation == self._generation:
+                            self._future = None
+                        return
+                    board = self._queue.popleft()
+                    key = self._current = position_key(board)
+                info = None
+                async for info in evaluate_position_stream(board, session=self.session):
+                    with self._lock:
+                        self._store(key, info, False)
+                        listeners = list(self._listeners)
+                    for listener in listeners:
+                        listener(info, False)
+                with self._lock:
+                    if info is not None:
+                        self._store(key, info, True)
+                    listeners, self._listeners, self._current = self._listeners, [], None
+                for listener in listeners:
+                    listener(info, True)
+        finally:
+            with self._lock:
+                if generation == self._generation:
+                    self._current, self._listeners = None, []
+
+    def _store(self, key: int = None, info: dict = None, complete: bool = None) -> None:
+        self._results[key] = (info, complete)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def claim(self, board: chess.Board = None, listener = None) -> concurrent.futures.Future:
+        """
+        Serves a real evaluation of ``board`` from the speculation, calling ``listener(info, done)`` with
+        each info as the search deepens and ``done`` true for the last one. Returns a future to cancel the
+        evaluation with, or None if ``board`` was not speculated on (the speculation is then pre-empted).
+        """
+        key = position_key(board)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None and result[1]:
+                served = concurrent.futures.Future()
+                served.set_result(result[0])
+            elif self._current == key and self._future is not None and not self._future.done():
+                self._queue.clear()
+                self._listeners.append(listener)
+                served = self._future
+            else:
+                served = None
+        if served is None:
+            telemetry.record("speculation.miss", 1)
+            self.preempt()
+            return None
+        if served.done():
+            telemetry.record("speculation.hit", 1)
+            listener(result[0], True)
+        else:
+            telemetry.record("speculation.continued", 1)
+            if result is not None:
+                listener(result[0], False)
+        return served
+
+    def preempt(self) -> None:
+        """Stops the speculation, unless a real evaluation has claimed its search."""
+        with self._lock:
+            if self._listeners:
+                return
+            future, self._future = self._future, None
+            self._generation += 1
+            self._queue.clear()
+            self._current = None
+        if future is not None:
+            future.cancel()
+
+    def cancel(self) -> None:
+        """Stops the speculation, claimed or not."""
+        with self._lock:
+            future, self._future = self._future, None
+            self._generation += 1
+            self._queue.clear()
+            self._current, self._listeners = None, []
+        if future is not None:
+            future.cancel()
+
+    def clear(self) -> None:
+        """Cancels, and forgets the results (e.g. after the engine or its settings change)."""
+        self.cancel()
+        with self._lock:
+            self._results.clear()
@@ -4,6 +4,9 @@
 #
 # License: LGPL-3.0
 
-from ._data import user_game
+from ._data import data_root_path, user_game, read_game_records, pack_move, unpack_move, position_key
+from ._navigator import game_navigator
+from ._pgn import read_headers, read_games, split_pgn, read_chunk, read_games_parallel, pgn_writer
 
-__all__ = ["user_game", ]
+__all__ = ["data_root_path", "user_game", "read_game_records", "pack_move", "unpack_move", "position_key", "game_navigator",
+           "read_headers", "read_games", "split_pgn", "read_chunk", "read_games_parallel", "pgn_writer", ]
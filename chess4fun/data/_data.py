@@ -4,7 +4,20 @@
 #
 # License: LGPL-3.0
 
+import array
+import concurrent.futures
+import json
 import pathlib
+import queue
+import sqlite3
+import threading
+
+import chess
+import chess.engine
+import chess.pgn
+import chess.polyglot
+
+from ._pgn import read_games_parallel, pgn_writer
 
 data_root_path = pathlib.Path.home() / ".chess4fun"
 
@@ -13,3 +26,439 @@ if not data_root_path.exists():
         data_root_path.mkdir(parents=True, exist_ok=True)
     except:
         raise IOError(f"cannot create data root path: {data_root_path}")
+
+def pack_move(move: chess.Move = None) -> int:
+    """Packs a move into 16 bits: from-square, to-square (6 bits each) and promotion piece type (4 bits)."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def unpack_move(packed: int = None) -> chess.Move:
+    return chess.Move(packed & 0x3f, (packed >> 6) & 0x3f, (packed >> 12) or None)
+
+NO_EVAL = -32768 # in the packed evals of a game: ply not evaluated
+EVAL_CAP = 32000 # cp; mates are stored as +/-(EVAL_CAP - moves to mate), +/-EVAL_CAP once given
+
+def pack_eval(score: chess.engine.PovScore = None) -> int:
+    """Packs a score into 16 bits, from White's point of view."""
+    if score is None:
+        return NO_EVAL
+    return max(-EVAL_CAP, min(EVAL_CAP, score.white().score(mate_score=EVAL_CAP)))
+
+def unpack_eval(packed: int = None) -> chess.engine.PovScore:
+    if packed == NO_EVAL:
+        return None
+    if abs(packed) > EVAL_CAP - 1000:
+        mate = EVAL_CAP - abs(packed)
+        if mate == 0: # Mate(-0) is the side of the point of view mated, MateGiven the other way round
+            return chess.engine.PovScore(chess.engine.MateGiven if packed > 0 else chess.engine.Mate(-0), chess.WHITE)
+        return chess.engine.PovScore(chess.engine.Mate(mate if packed > 0 else -mate), chess.WHITE)
+    return chess.engine.PovScore(chess.engine.Cp(packed), chess.WHITE)
+
+_ZOBRIST = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+_ZOBRIST_HASHER = chess.polyglot.ZobristHasher(_ZOBRIST)
+_ZOBRIST_PIECES = [[_ZOBRIST[64 * (2 * piece_type - 2 + color):64 * (2 * piece_type - 1 + color)] for color in (chess.BLACK, chess.WHITE)]
+                   for piece_type in chess.PIECE_TYPES] # [piece type - 1][color][square]
+
+def position_key(board: chess.Board = None) -> int:
+    """
+    The polyglot Zobrist hash of ``board`` (same as :func:`chess.polyglot.zobrist_hash`), about
+    twice as fast: the pieces are read off the bitboards instead of square by square.
+    """
+    key = 0
+    occupied_co = board.occupied_co
+    pieces = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings)
+    for squares, keys in zip(pieces, _ZOBRIST_PIECES):
+        for color in (chess.BLACK, chess.WHITE):
+            color_keys = keys[color]
+            bb = squares & occupied_co[color]
+            while bb:
+                lsb = bb & -bb
+                key ^= color_keys[lsb.bit_length() - 1]
+                bb ^= lsb
+    if board.castling_rights:
+        key ^= _ZOBRIST_HASHER.hash_castling(board)
+    if board.ep_square is not None:
+        key ^= _ZOBRIST_HASHER.hash_ep_square(board)
+    if board.turn == chess.WHITE:
+        key ^= _ZOBRIST[780]
+    return key
+
+# indexed header columns; all other headers are kept as JSON
+HEADER_COLUMNS = {"White": "white", "Black": "black", "WhiteElo": "white_elo", "BlackElo": "black_elo", "Event": "event", "Site": "site",
+                  "Date": "date", "Round": "round", "Result": "result", "ECO": "eco", "Opening": "opening", "FEN": "fen"}
+INTEGER_COLUMNS = {"white_elo", "black_elo"}
+GAME_COLUMNS = list(HEADER_COLUMNS.values()) + ["ply_count", "moves", "evals", "headers"]
+
+RESULT_STATS = {"1-0": 1, "1/2-1/2": 2, "0-1": 3} # the outcome counters of position_move
+STATS_EVAL_CAP = 1000 # cp; evals are capped when averaged, so that mate scores do not swamp them
+INDEX_VERSION = 1 # the position index is rebuilt from the games when this changes
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS game (id INTEGER PRIMARY KEY, white TEXT, black TEXT, white_elo INTEGER, black_elo INTEGER, event TEXT, site TEXT, "
+    "date TEXT, round TEXT, result TEXT, eco TEXT, opening TEXT, fen TEXT, ply_count INTEGER, moves BLOB, evals BLOB, headers TEXT)",
+    "CREATE INDEX IF NOT EXISTS game_white ON game (white)",
+    "CREATE INDEX IF NOT EXISTS game_black ON game (black)",
+    "CREATE INDEX IF NOT EXISTS game_eco ON game (eco)",
+    "CREATE INDEX IF NOT EXISTS game_result ON game (result)",
+    "CREATE INDEX IF NOT EXISTS game_date ON game (date)",
+    # every position (Zobrist hash) of every game, by ply
+    "CREATE TABLE IF NOT EXISTS position_game (key INTEGER, game INTEGER, ply INTEGER, PRIMARY KEY (key, game, ply)) WITHOUT ROWID",
+    # the moves played from every position, with the outcome counts and the eval sum after the move
+    "CREATE TABLE IF NOT EXISTS position_move (key INTEGER, move INTEGER, games INTEGER, white INTEGER, draws INTEGER, black INTEGER, "
+    "eval_sum INTEGER, evals INTEGER, PRIMARY KEY (key, move)) WITHOUT ROWID",
+]
+
+INSERT_GAME = f"INSERT INTO game (id, {', '.join(GAME_COLUMNS)}) VALUES (?, {', '.join('?' * len(GAME_COLUMNS))})"
+UPSERT_POSITION_MOVE = ("INSERT INTO position_move VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key, move) DO UPDATE SET "
+                        "games = games + excluded.games, white = white + excluded.white, draws = draws + excluded.draws, "
+                        "black = black + excluded.black, eval_sum = eval_sum + excluded.eval_sum, evals = evals + excluded.evals")
+
+def _game_row(headers: dict = None, moves: array.array = None, evals: array.array = None) -> tuple:
+    # a row of GAME_COLUMNS
+    row = []
+    for tag, column in HEADER_COLUMNS.items():
+        value = headers.get(tag)
+        if column in INTEGER_COLUMNS:
+            value = int(value) if value and value.isdigit() else None
+        row.append(value)
+    extra = {tag: value for tag, value in headers.items() if tag not in HEADER_COLUMNS and tag != "SetUp"}
+    has_evals = evals is not None and any(packed != NO_EVAL for packed in evals)
+    row += [len(moves), moves.tobytes(), evals.tobytes() if has_evals else None, json.dumps(extra) if extra else None]
+    return tuple(row)
+
+def _position_keys(board: chess.Board = None, moves: array.array = None) -> array.array:
+    # the Zobrist hashes of the positions of a game, from the starting position to the final one
+    board = board.copy(stack=False)
+    keys = array.array("Q", [position_key(board)])
+    for packed in moves:
+        board.push(unpack_move(packed))
+        keys.append(position_key(board))
+    return keys
+
+def _index_positions(db: sqlite3.Connection = None, records: list = None, first_id: int = None) -> None:
+    # within the caller's transaction; aggregates the move statistics of the batch before writing them
+    postings, stats = [], {}
+    for game_id, (headers, moves, evals, keys) in enumerate(records, start=first_id):
+        outcome = RESULT_STATS.get(headers.get("Result"))
+        for ply, key in enumerate(keys):
+            postings.append((key - (1 << 63), game_id, ply))
+            if ply == len(moves):
+                break
+            stat = stats.setdefault((key, moves[ply]), [0, 0, 0, 0, 0, 0])
+            stat[0] += 1
+            if outcome is not None:
+                stat[outcome] += 1
+            if evals is not None and evals[ply] != NO_EVAL:
+                stat[4] += max(-STATS_EVAL_CAP, min(STATS_EVAL_CAP, evals[ply]))
+                stat[5] += 1
+    db.executemany("INSERT OR IGNORE INTO position_game VALUES (?, ?, ?)", postings)
+    db.executemany(UPSERT_POSITION_MOVE, [(key - (1 << 63), move, *stat) for (key, move), stat in stats.items()])
+
+
+class _game_record_visitor(chess.pgn.BaseVisitor):
+    # collects the headers, packed mainline moves, [%eval] annotations and position hashes of a game, without building a tree
+    def begin_game(self):
+        self.headers = {}
+        self.moves = array.array("H")
+        self.evals = array.array("h")
+        self.keys = array.array("Q")
+        self.errors = []
+
+    def visit_board(self, board: chess.Board = None):
+        # the starting position, then the position after each mainline move
+        self.keys.append(position_key(board))
+
+    def visit_header(self, tagname: str = None, tagvalue: str = None):
+        self.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board: chess.Board = None, move: chess.Move = None):
+        self.moves.append(pack_move(move))
+        self.evals.append(NO_EVAL)
+
+    def visit_comment(self, comment: str = None):
+        match = chess.pgn.EVAL_REGEX.search(comment)
+        if match and self.moves:
+            if match.group("mate"):
+                mate = int(match.group("mate"))
+                self.evals[-1] = EVAL_CAP - mate if mate > 0 else -EVAL_CAP - mate
+            else:
+                self.evals[-1] = max(-EVAL_CAP, min(EVAL_CAP, round(float(match.group("cp")) * 100)))
+
+    def handle_error(self, error: Exception = None):
+        self.errors.append(error)
+
+    def result(self) -> tuple:
+        return self.headers, self.moves, self.evals, self.keys, self.errors
+
+
+def read_game_records(pgn_file = None):
+    """
+    Yields ``(headers, moves, evals, keys)`` for each game of a PGN file: packed mainline moves and evals,
+    and the Zobrist hashes of its positions. Unreadable games are skipped.
+    """
+    while True:
+        record = chess.pgn.read_game(pgn_file, Visitor=_game_record_visitor)
+        if record is None:
+            return
+        headers, moves, evals, keys, errors = record
+        if not errors:
+            yield headers, moves, evals, keys
+
+
+def _unpack_moves(fen: str = None, packed_moves: bytes = None, packed_evals: bytes = None) -> tuple:
+    moves = [unpack_move(packed) for packed in array.array("H", packed_moves)]
+    evals = [unpack_eval(packed) for packed in array.array("h", packed_evals)] if packed_evals else [None] * len(moves)
+    return chess.Board(fen) if fen else chess.Board(), moves, evals
+
+
+class user_game(object):
+    """
+    The local game database: a SQLite file under the data directory.
+
+    Each game is one row with its headers (players, ratings, event, date, result, ECO, ... indexed for
+    filtered queries), its mainline moves packed 16 bits per ply and its evaluations packed 16 bits per
+    ply. All writes go through a single writer thread, so :meth:`save_game` and :meth:`import_pgn`
+    return a :class:`concurrent.futures.Future` at once and never block the caller; bulk imports stream
+    the PGN file and commit in transactions of ``batch_size`` games. Reads use a connection per thread.
+
+    Every position of every game is indexed by its Zobrist hash: a posting list of the games (and plies)
+    reaching it, and per-move continuation statistics (games, White wins, draws, Black wins, eval sum)
+    that are aggregated per batch at write time, so :meth:`continuations` and :meth:`games_reaching`
+    are B-tree range lookups over memory-mapped pages, not scans.
+    """
+    def __init__(self, path = data_root_path / "games.sqlite3", batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._jobs = None
+        self._writer = None
+        with self._connect() as db:
+            index_version = db.execute("PRAGMA user_version").fetchone()[0]
+            for statement in SCHEMA:
+                db.execute(statement)
+        if index_version != INDEX_VERSION:
+            self.rebuild_position_index()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(str(self.path), check_same_thread=False)
+        db.execute("PRAGMA journal_mode = WAL") # readers are not blocked by the writer
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.execute("PRAGMA mmap_size = 1073741824")
+        return db
+
+    def _reader(self) -> sqlite3.Connection:
+        if getattr(self._local, "db", None) is None:
+            self._local.db = self._connect()
+        return self._local.db
+
+    def _submit(self, job) -> concurrent.futures.Future:
+        # runs job(db) on the writer thread
+        with self._lock:
+            if self._writer is None:
+                self._jobs = queue.Queue()
+                self._writer = threading.Thread(target=self._write_loop, name="chess4fun-game-writer", daemon=True)
+                self._writer.start()
+        future = concurrent.futures.Future()
+        self._jobs.put((job, future))
+        return future
+
+    def _write_loop(self) -> None:
+        db = self._connect()
+        while True:
+            job, future = self._jobs.get()
+            if job is None:
+                break
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(job(db))
+                except Exception as exc:
+                    db.rollback()
+                    future.set_exception(exc)
+        db.close()
+        future.set_result(None)
+
+    def save_game(self, game: chess.pgn.Game = None, evals: list = None) -> concurrent.futures.Future:
+        """
+        Stores the mainline of ``game`` in the background. ``evals`` (one PovScore or None per ply) default
+        to the game's ``[%eval]`` annotations. The future's result is the new game id.
+        """
+        moves = array.array("H", (pack_move(move) for move in game.mainline_moves()))
+        if evals is None:
+            evals = [node.eval() for node in game.mainline()]
+        record = (dict(game.headers), moves, array.array("h", (pack_eval(score) for score in evals)), _position_keys(game.board(), moves))
+        return self._submit(lambda db: self._insert_batch(db, [record]))
+
+    def import_pgn(self, path: str = None, progress = None, n_workers: int = None) -> concurrent.futures.Future:
+        """
+        Imports every game of a PGN file in the background, streaming it in transactions of ``batch_size``
+        games; ``progress(n_games)`` is called after each one. The games are parsed (and their positions
+        hashed) by ``n_workers`` processes, see :func:`read_games_parallel`. The future's result is the
+        number of games.
+        """
+        def import_all(db: sqlite3.Connection = None) -> int:
+            records = read_games_parallel(path, Visitor=_game_record_visitor, n_workers=n_workers)
+            return self._insert_records(db, (record[:4] for record in records if not record[4]), progress)
+        return self._submit(import_all)
+
+    def export_pgn(self, path: str = None, mode: str = "w", **filters) -> int:
+        """
+        Writes the games matching the filters (see :meth:`find`) to a PGN file in the order they were
+        stored, one at a time, with their ``[%eval]`` annotations. Returns the number of games.
+        """
+        where, params = self._where(**filters)
+        rows = self._reader().execute(f"SELECT {', '.join(HEADER_COLUMNS.values())}, headers, moves, evals FROM game{where} ORDER BY id", params)
+        with pgn_writer(path, mode=mode) as writer:
+            for row in rows:
+                writer.write(self._row_game(row))
+        return writer.n_games
+
+    def _insert_batch(self, db: sqlite3.Connection = None, records: list = None) -> int:
+        # on the writer thread: the games and their positions in one transaction; returns the first game id
+        with db:
+            first_id = db.execute("SELECT IFNULL(MAX(id), 0) + 1 FROM game").fetchone()[0]
+            db.executemany(INSERT_GAME, [(game_id,) + _game_row(headers, moves, evals)
+                                         for game_id, (headers, moves, evals, _) in enumerate(records, start=first_id)])
+            _index_positions(db, records, first_id)
+        return first_id
+
+    def _insert_records(self, db: sqlite3.Connection = None, records = None, progress = None) -> int:
+        # on the writer thread
+        n_games, batch = 0, []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self._insert_batch(db, batch)
+                n_games += len(batch)
+                batch = []
+                if progress is not None:
+                    progress(n_games)
+        if batch:
+            self._insert_batch(db, batch)
+            n_games += len(batch)
+            if progress is not None:
+                progress(n_games)
+        return n_games
+
+    def rebuild_position_index(self) -> concurrent.futures.Future:
+        """Re-indexes the positions of all stored games in the background (done on opening a database indexed by an older version)."""
+        def rebuild(db: sqlite3.Connection = None) -> int:
+            with db:
+                db.execute("DELETE FROM position_game")
+                db.execute("DELETE FROM position_move")
+            n_games, last_id = 0, 0
+            while True:
+                rows = db.execute("SELECT id, result, fen, moves, evals FROM game WHERE id > ? ORDER BY id LIMIT ?", (last_id, self.batch_size)).fetchall()
+                if not rows:
+                    break
+                with db:
+                    for game_id, result, fen, packed_moves, packed_evals in rows:
+                        moves = array.array("H", packed_moves)
+                        evals = array.array("h", packed_evals) if packed_evals else None
+                        _index_positions(db, [({"Result": result}, moves, evals, _position_keys(chess.Board(fen) if fen else chess.Board(), moves))], game_id)
+                n_games, last_id = n_games + len(rows), rows[-1][0]
+            db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            return n_games
+        return self._submit(rebuild)
+
+    def continuations(self, board: chess.Board = None) -> list:
+        """
+        The moves played from ``board`` in the stored games, most played first, as dicts with ``move``,
+        ``games``, ``white``, ``draws``, ``black`` (the outcome counts) and ``eval`` (the average eval after
+        the move, cp from White's point of view, or None if no game had one).
+        """
+        rows = self._reader().execute("SELECT move, games, white, draws, black, eval_sum, evals FROM position_move WHERE key = ? ORDER BY games DESC",
+                                      (position_key(board) - (1 << 63),)).fetchall()
+        return [{"move": unpack_move(move), "games": games, "white": white, "draws": draws, "black": black,
+                 "eval": eval_sum / evals if evals else None} for move, games, white, draws, black, eval_sum, evals in rows]
+
+    def games_reaching(self, board: chess.Board = None, limit: int = 50) -> list:
+        """The stored games that reached ``board`` (at any ply), most recent first; see :meth:`find`."""
+        columns = ["id"] + list(HEADER_COLUMNS.values()) + ["ply_count"]
+        rows = self._reader().execute(f"SELECT {', '.join('game.' + column for column in columns)} FROM game WHERE id IN "
+                                      "(SELECT game FROM position_game WHERE key = ?) ORDER BY date DESC, id DESC LIMIT ?",
+                                      (position_key(board) - (1 << 63), limit)).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _where(self, player: str = None, white: str = None, black: str = None, eco: str = None, result: str = None,
+               date_from: str = None, date_to: str = None) -> tuple:
+        clauses, params = [], []
+        if player is not None:
+            clauses.append("(white = ? OR black = ?)")
+            params += [player, player]
+        for column, value in (("white", white), ("black", black), ("result", result)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if eco is not None: # a code ("C60") or a prefix range ("C6", "C")
+            clauses.append("eco >= ? AND eco < ?")
+            params += [eco, eco + "\uffff"]
+        if date_from is not None:
+            clauses.append("date >= ?")
+            params.append(date_from)
+        if date_to is not None:
+            clauses.append("date <= ?")
+            params.append(date_to)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def find(self, limit: int = 100, offset: int = 0, **filters) -> list:
+        """
+        Returns the games matching the filters (``player`` (either color), ``white``, ``black``, ``eco``
+        (a code or code prefix), ``result``, ``date_from``, ``date_to`` as "YYYY.MM.DD"), most recent first,
+        as dicts of the indexed headers plus ``id`` and ``ply_count``.
+        """
+        where, params = self._where(**filters)
+        columns = ["id"] + list(HEADER_COLUMNS.values()) + ["ply_count"]
+        rows = self._reader().execute(f"SELECT {', '.join(columns)} FROM game{where} ORDER BY date DESC, id DESC LIMIT ? OFFSET ?",
+                                      params + [limit, offset]).fetchall()
+        return [dict(zip(columns, row)) for row in rows]
+
+    def count(self, **filters) -> int:
+        where, params = self._where(**filters)
+        return self._reader().execute(f"SELECT COUNT(*) FROM game{where}", params).fetchone()[0]
+
+    def get_moves(self, game_id: int = None) -> tuple:
+        """Returns ``(starting board, moves, evals)`` of a game, or None; evals are PovScores or None per ply."""
+        row = self._reader().execute("SELECT fen, moves, evals FROM game WHERE id = ?", (game_id,)).fetchone()
+        if row is None:
+            return None
+        return _unpack_moves(*row)
+
+    def get_game(self, game_id: int = None) -> chess.pgn.Game:
+        """Rebuilds a stored game (headers, mainline and ``[%eval]`` annotations), or returns None."""
+        row = self._reader().execute(f"SELECT {', '.join(HEADER_COLUMNS.values())}, headers, moves, evals FROM game WHERE id = ?", (game_id,)).fetchone()
+        return None if row is None else self._row_game(row)
+
+    def _row_game(self, row: tuple = None) -> chess.pgn.Game:
+        # row: the header columns, headers, moves, evals
+        *header_values, extra_headers, packed_moves, packed_evals = row
+        board, moves, evals = _unpack_moves(header_values[list(HEADER_COLUMNS).index("FEN")], packed_moves, packed_evals)
+        game = chess.pgn.Game.from_board(board)
+        for tag, value in zip(HEADER_COLUMNS, header_values):
+            if value is not None:
+                game.headers[tag] = str(value)
+        game.headers.update(json.loads(extra_headers) if extra_headers else {})
+        node = game
+        for move, score in zip(moves, evals):
+            node = node.add_variation(move)
+            if score is not None:
+                node.set_eval(score)
+        return game
+
+    def flush(self) -> None:
+        """Waits for pending writes."""
+        if self._writer is not None:
+            self._submit(lambda db: None).result()
+
+    def close(self) -> None:
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            done = concurrent.futures.Future()
+            self._jobs.put((None, done))
+            writer.join()
+        if getattr(self._local, "db", None) is not None:
+            self._local.db.close()
+            self._local.db = None
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import array
+
+import chess
+import chess.engine
+
+from ._data import pack_move, unpack_move, pack_eval, unpack_eval, NO_EVAL
+
+CHECKPOINT_INTERVAL = 16 # plies between two board checkpoints
+
+
+class game_navigator(object):
+    """
+    The main line of a game being played or reviewed, and the current ply in it, for stepping and
+    jumping through it in bounded time whatever the length of the game.
+
+    Moves are kept packed in 16 bits (see :func:`pack_move`) and the evaluation of each ply in a
+    parallel array (see :func:`pack_eval`), as the game store keeps them. A copy of the board is
+    checkpointed every ``checkpoint_interval`` plies, so going to any ply copies the checkpoint at or
+    before it and pushes fewer than ``checkpoint_interval`` moves. The moves were legal when
+    played, so they are pushed again without checking.
+
+    Plies count from ``board`` (the starting position by default): ply ``n`` is the position after
+    ``n`` moves, and its evaluation is :meth:`eval_at` ``(n)``.
+    """
+    def __init__(self, board: chess.Board = None, checkpoint_interval: int = CHECKPOINT_INTERVAL):
+        self.checkpoint_interval = checkpoint_interval
+        self.moves = array.array("H")
+        self.evals = array.array("h") # evals[n - 1]: ply n
+        self._checkpoints = [chess.Board() if board is None else board.copy()] # _checkpoints[k]: ply k * checkpoint_interval
+        self.board = self._checkpoints[0].copy()
+        self.ply = 0
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    def move_at(self, ply: int = None) -> chess.Move:
+        """The move leading to ``ply``."""
+        return unpack_move(self.moves[ply - 1])
+
+    def move_stack(self, ply: int = None) -> list:
+        """The moves up to ``ply`` (the current one by default)."""
+        return [unpack_move(packed) for packed in self.moves[:self.ply if ply is None else ply]]
+
+    def push(self, move: chess.Move = None) -> bool:
+        """
+        Plays ``move`` at the current ply. The rest of the line is kept if it goes on with ``move``,
+        and dropped otherwise. Returns whether the line has changed.
+        """
+        packed = pack_move(move)
+        if self.ply < len(self.moves) and self.moves[self.ply] == packed:
+            self.forward()
+            return False
+        self.truncate(self.ply)
+        self.moves.append(packed)
+        self.evals.append(NO_EVAL)
+        self.board.push(move)
+        self.ply += 1
+        if self.ply % self.checkpoint_interval == 0:
+            self._checkpoints.append(self.board.copy())
+        return True
+
+    def truncate(self, n_plies: int = None) -> None:
+        """Drops the moves (and evaluations) after ply ``n_plies``, going back to it if need be."""
+        if n_plies < self.ply:
+            self.go_to(n_plies)
+        del self.moves[n_plies:]
+        del self.evals[n_plies:]
+        del self._checkpoints[n_plies // self.checkpoint_interval + 1:]
+
+    def board_at(self, ply: int = None) -> chess.Board:
+        """A new board at ``ply``, with its move stack; the current ply is left alone."""
+        board = self._checkpoints[ply // self.checkpoint_interval].copy()
+        for packed in self.moves[ply - ply % self.checkpoint_interval:ply]:
+            board.push(unpack_move(packed))
+        return board
+
+    def go_to(self, ply: int = None) -> chess.Board:
+        """Makes ``ply`` (clamped to the line) the current one, and returns its board."""
+        ply = max(0, min(ply, len(self.moves)))
+        if ply == self.ply + 1:
+            self.board.push(unpack_move(self.moves[self.ply]))
+        elif ply == self.ply - 1:
+            self.board.pop()
+        elif ply != self.ply:
+            self.board = self.board_at(ply)
+        self.ply = ply
+        return self.board
+
+    def back(self) -> bool:
+        if self.ply == 0:
+            return False
+        self.go_to(self.ply - 1)
+        return True
+
+    def forward(self) -> bool:
+        if self.ply == len(self.moves):
+            return False
+        self.go_to(self.ply + 1)
+        return True
+
+    def set_eval(self, ply: int = None, score: chess.engine.PovScore = None) -> None:
+        self.evals[ply - 1] = pack_eval(score)
+
+    def eval_at(self, ply: int = None) -> chess.engine.PovScore:
+        """The evaluation of ``ply`` (from White's point of view), or None if not evaluated."""
+        return unpack_eval(self.evals[ply - 1])
+
+    def scores(self, ply: int = None) -> list:
+        """The evaluations up to ``ply`` (the current one by default), one PovScore or None per ply."""
+        return [unpack_eval(packed) for packed in self.evals[:self.ply if ply is None else ply]]
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import collections
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import re
+
+import chess
+import chess.pgn
+
+CHUNK_SIZE = 1 << 20 # bytes of PGN parsed per worker job
+_TAG_PAIR = re.compile(rb'\[[A-Za-z0-9_]+\s+"') # the first line of a game, when it follows a blank line
+
+
+class _mainline_builder(chess.pgn.GameBuilder):
+    # builds the mainline only: variations are skipped by the parser, not built and thrown away
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def end_variation(self):
+        pass # still called for a skipped variation, which was never pushed
+
+
+class _bare_mainline_builder(_mainline_builder):
+    # ... and without comments
+    def visit_comment(self, comment: str = None):
+        pass
+
+
+class _bare_game_builder(chess.pgn.GameBuilder):
+    def visit_comment(self, comment: str = None):
+        pass
+
+
+_BUILDERS = {(True, True): chess.pgn.GameBuilder, (True, False): _bare_game_builder,
+             (False, True): _mainline_builder, (False, False): _bare_mainline_builder} # by (variations, comments)
+
+def read_headers(pgn_file = None):
+    """Yields the headers of each game of an open PGN file; the movetext is skipped over, not parsed."""
+    while True:
+        headers = chess.pgn.read_headers(pgn_file)
+        if headers is None:
+            return
+        yield headers
+
+def read_games(pgn_file = None, variations: bool = True, comments: bool = True, where = None):
+    """
+    Yields the games of an open PGN file one at a time, so memory does not grow with the file.
+    Without ``variations`` (``comments``), they are skipped while parsing. With ``where``, the headers
+    of each game are read first and the games for which ``where(headers)`` is false are skipped
+    without parsing their moves.
+    """
+    Visitor = _BUILDERS[bool(variations), bool(comments)]
+    while True:
+        if where is not None:
+            offset = pgn_file.tell()
+            headers = chess.pgn.read_headers(pgn_file)
+            if headers is None:
+                return
+            if not where(headers):
+                continue
+            pgn_file.seek(offset)
+        game = chess.pgn.read_game(pgn_file, Visitor=Visitor)
+        if game is None:
+            return
+        yield game
+
+def _game_boundary(pgn_file = None, offset: int = None, size: int = None) -> int:
+    # the offset of the first game starting after offset (a tag pair line after a blank line), or size
+    if offset >= size:
+        return size
+    pgn_file.seek(offset)
+    pgn_file.readline() # the rest of the current line
+    blank = False
+    while True:
+        line_offset = pgn_file.tell()
+        line = pgn_file.readline()
+        if not line:
+            return size
+        if blank and _TAG_PAIR.match(line):
+            return line_offset
+        blank = not line.strip()
+
+def split_pgn(path: str = None, chunk_size: int = CHUNK_SIZE):
+    """Yields ``(start, stop)`` byte offsets cutting the PGN file at ``path`` into chunks of whole games, about ``chunk_size`` bytes each."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as pgn_file:
+        start = 0
+        while start < size:
+            stop = _game_boundary(pgn_file, start + chunk_size, size)
+            yield start, stop
+            start = stop
+
+def _read_results(pgn_file = None, Visitor = chess.pgn.GameBuilder):
+    while True:
+        result = chess.pgn.read_game(pgn_file, Visitor=Visitor)
+        if result is None:
+            return
+        yield result
+
+def read_chunk(path: str = None, start: int = 0, stop: int = None, Visitor = chess.pgn.GameBuilder) -> list:
+    """Returns ``chess.pgn.read_game(..., Visitor=Visitor)`` for each game between byte offsets ``start`` and ``stop`` of the PGN file at ``path``."""
+    with open(path, "rb") as pgn_file:
+        pgn_file.seek(start)
+        text = pgn_file.read(-1 if stop is None else stop - start).decode("utf-8-sig", errors="replace")
+    return list(_read_results(io.StringIO(text), Visitor))
+
+def read_games_parallel(path: str = None, Visitor = chess.pgn.GameBuilder, n_workers: int = None, chunk_size: int = CHUNK_SIZE,
+                        max_pending: int = None):
+    """
+    Yields ``chess.pgn.read_game(..., Visitor=Visitor)`` for each game of the PGN file at ``path``, in
+    file order. The file is split at game boundaries into chunks of about ``chunk_size`` bytes, parsed
+    by ``n_workers`` processes (default: number of CPUs). At most ``max_pending`` chunks (default:
+    twice the number of workers) are in flight, so memory stays flat however large the file.
+    ``Visitor`` must be picklable (a module-level class) and so must its results. With one worker,
+    the file is simply streamed in this process.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    if n_workers == 1:
+        with open(path, encoding="utf-8-sig", errors="replace") as pgn_file:
+            yield from _read_results(pgn_file, Visitor)
+        return
+    chunks = split_pgn(path, chunk_size)
+    max_pending = max_pending or 2 * n_workers
+    # spawned, not forked: this is called from background threads of the app
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"))
+    pending = collections.deque()
+    try:
+        for start, stop in chunks:
+            pending.append(executor.submit(read_chunk, path, start, stop, Visitor))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class pgn_writer(object):
+    """
+    Writes games to a PGN file as they come (appending by default), flushing after each one, so
+    nothing is held in memory and an interrupted run keeps every game written so far. Games are
+    :class:`chess.pgn.Game` objects, exported with or without ``variations`` and ``comments`` (which
+    carry the ``[%eval]`` annotations), or PGN strings written as they are.
+    """
+    def __init__(self, path: str = None, mode: str = "a", variations: bool = True, comments: bool = True):
+        self.path = path
+        self.variations = variations
+        self.comments = comments
+        self.n_games = 0
+        self._file = open(path, mode, encoding="utf-8")
+
+    def write(self, game = None) -> None:
+        if isinstance(game, str):
+            self._file.write(game.strip() + "\n\n")
+        else:
+            game.accept(chess.pgn.FileExporter(self._file, variations=self.variations, comments=self.comments))
+        self._file.flush()
+        self.n_games += 1
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "pgn_writer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+from ._syzygy import syzygy_tablebase, default_tablebase, probe_position, tablebase_move
+
+__all__ = ["syzygy_tablebase", "default_tablebase", "probe_position", "tablebase_move",]
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import os
+import threading
+
+import chess
+import chess.engine
+import chess.syzygy
+
+from .._preferences import preferences
+
+TB_SCORE = 20000 # cp for a tablebase win, less the distance to zeroing (as engines report it)
+
+def _tb_score(wdl: int = None, dtz: int = None) -> int:
+    # from the point of view of the side to move; cursed wins and blessed losses are draws under the 50-move rule
+    if wdl == 2:
+        return TB_SCORE - abs(dtz)
+    if wdl == -2:
+        return -TB_SCORE + abs(dtz)
+    return 0
+
+
+class syzygy_tablebase(object):
+    """
+    Local Syzygy endgame tablebases (WDL ``.rtbw`` and DTZ ``.rtbz`` files) in ``path``, which may list
+    several directories separated by ``os.pathsep``, as for the engines' SyzygyPath option.
+
+    Tables are opened lazily on first probe and at most ``max_fds`` of them are kept open, the least
+    recently used being closed first. Positions with castling rights, or with more pieces than the
+    largest table found, are not covered; their probes return None without touching the files.
+    """
+    def __init__(self, path: str = None, max_fds: int = 128):
+        self.path = path
+        self._lock = threading.Lock() # probes read from shared file handles
+        self._tablebase = chess.syzygy.Tablebase(max_fds=max_fds)
+        for directory in path.split(os.pathsep):
+            if directory:
+                self._tablebase.add_directory(directory)
+        self.max_pieces = max((len(name) - 1 for name in self._tablebase.wdl), default=0)
+
+    def covers(self, board: chess.Board = None) -> bool:
+        return chess.popcount(board.occupied) <= self.max_pieces and not board.castling_rights
+
+    def probe(self, board: chess.Board = None) -> tuple:
+        """Returns ``(wdl, dtz)`` for the side to move, or None if the position is not covered."""
+        if not self.covers(board):
+            return None
+        try:
+            with self._lock:
+                return self._tablebase.probe_wdl(board), self._tablebase.probe_dtz(board)
+        except KeyError: # a missing table
+            return None
+
+    def best_moves(self, board: chess.Board = None) -> list:
+        """
+        Returns ``(move, score)`` for every legal move, best first, with the score (cp) from the
+        mover's point of view; or None if the position is not covered. Wins are ranked by mate, then
+        zeroing moves, then the shortest distance to zeroing; losses by the longest; draws are equal.
+        """
+        if not self.covers(board) or board.is_game_over():
+            return None
+        ranked = []
+        board = board.copy(stack=False)
+        for move in list(board.legal_moves):
+            zeroing = board.is_zeroing(move)
+            board.push(move)
+            probed = self.probe(board)
+            checkmate = board.is_checkmate()
+            board.pop()
+            if probed is None:
+                return None
+            wdl, dtz = -probed[0], -probed[1]
+            if wdl > 0:
+                rank = (wdl, checkmate, zeroing, -abs(dtz))
+            elif wdl < 0:
+                rank = (wdl, not zeroing, abs(dtz))
+            else:
+                rank = (0,)
+            ranked.append((rank, move, -_tb_score(*probed)))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        return [(move, score) for _, move, score in ranked]
+
+    def infos(self, board: chess.Board = None, multipv: int = None):
+        """
+        The tablebase result as the engine's info dict (``string`` is "tablebase"), or with ``multipv``
+        a list of info dicts for the best moves; None if the position is not covered.
+        """
+        moves = self.best_moves(board)
+        if moves is None:
+            return None
+        infos = [{"score": chess.engine.PovScore(chess.engine.Cp(score), board.turn), "pv": [move], "depth": 0, "tbhits": 1,
+                  "multipv": rank, "string": "tablebase"} for rank, (move, score) in enumerate(moves[:multipv or 1], start=1)]
+        return infos if multipv is not None else infos[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._tablebase.close()
+
+
+_default_tablebase = None
+
+def default_tablebase() -> syzygy_tablebase:
+    """The tablebase of the ``syzygy_path`` preference (None if unset), reopened when the preference changes."""
+    global _default_tablebase
+    path = preferences['syzygy_path']
+    if _default_tablebase is not None and _default_tablebase.path != path:
+        _default_tablebase.close()
+        _default_tablebase = None
+    if _default_tablebase is None and path:
+        _default_tablebase = syzygy_tablebase(path)
+    return _default_tablebase
+
+def probe_position(board: chess.Board = None, multipv: int = None):
+    """Returns the tablebase info (see :meth:`syzygy_tablebase.infos`) from the default tablebase, or None."""
+    tablebase = default_tablebase()
+    return None if tablebase is None else tablebase.infos(board, multipv=multipv)
+
+def tablebase_move(board: chess.Board = None) -> chess.engine.PlayResult:
+    """Returns the best move from the default tablebase, or None if the position is not covered."""
+    info = probe_position(board)
+    if info is None:
+        return None
+    return chess.engine.PlayResult(info["pv"][0], None, info=info)
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import pathlib
+import sys
+
+from ._search import search_engine, evaluate
+from ._uci import uci_protocol, uci_main
+
+# the command running the built-in engine as a UCI engine, usable wherever an engine executable is
+BUILTIN_ENGINE = [sys.executable, str(pathlib.Path(__file__).parent.absolute() / "__main__.py")]
+
+__all__ = ["search_engine", "evaluate", "uci_protocol", "uci_main", "BUILTIN_ENGINE",]
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import os
+import sys
+
+if __package__ in (None, ""): # run as a script (see BUILTIN_ENGINE): the package may not be on the path
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    from chess4fun.engine import uci_main
+else:
+    from . import uci_main
+
+sys.exit(uci_main())
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import array
+import threading
+import time
+
+import numpy as np
+
+import chess
+
+from ..data import position_key
+
+MATE_SCORE = 30000
+MATE_BOUND = MATE_SCORE - 1000 # scores beyond are mates, MATE_SCORE - plies to mate
+INFINITE_SCORE = 32000
+MAX_PLY = 64
+
+PIECE_VALUES = (0, 100, 320, 330, 500, 900, 0) # cp, by piece type
+PHASE_WEIGHTS = (0, 0, 1, 1, 2, 4, 0) # by piece type; 24 with all the pieces on the board (the middlegame)
+MAX_PHASE = 24
+
+# piece-square tables (cp, from White's side), as seen from White: the 8th rank first
+_TABLES = {
+    chess.PAWN: (
+          0,   0,   0,   0,   0,   0,   0,   0,
+         50,  50,  50,  50,  50,  50,  50,  50,
+         10,  10,  20,  30,  30,  20,  10,  10,
+          5,   5,  10,  25,  25,  10,   5,   5,
+          0,   0,   0,  20,  20,   0,   0,   0,
+          5,  -5, -10,   0,   0, -10,  -5,   5,
+          5,  10,  10, -20, -20,  10,  10,   5,
+          0,   0,   0,   0,   0,   0,   0,   0),
+    chess.KNIGHT: (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20,   0,   0,   0,   0, -20, -40,
+        -30,   0,  10,  15,  15,  10,   0, -30,
+        -30,   5,  15,  20,  20,  15,   5, -30,
+        -30,   0,  15,  20,  20,  15,   0, -30,
+        -30,   5,  10,  15,  15,  10,   5, -30,
+        -40, -20,   0,   5,   5,   0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50),
+    chess.BISHOP: (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10,   0,   0,   0,   0,   0,   0, -10,
+        -10,   0,   5,  10,  10,   5,   0, -10,
+        -10,   5,   5,  10,  10,   5,   5, -10,
+        -10,   0,  10,  10,  10,  10,   0, -10,
+        -10,  10,  10,  10,  10,  10,  10, -10,
+        -10,   5,   0,   0,   0,   0,   5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20),
+    chess.ROOK: (
+          0,   0,   0,   0,   0,   0,   0,   0,
+          5,  10,  10,  10,  10,  10,  10,   5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+          0,   0,   0,   5,   5,   0,   0,   0),
+    chess.QUEEN: (
+        -20, -10, -10,  -5,  -5, -10, -10, -20,
+        -10,   0,   0,   0,   0,   0,   0, -10,
+        -10,   0,   5,   5,   5,   5,   0, -10,
+         -5,   0,   5,   5,   5,   5,   0,  -5,
+          0,   0,   5,   5,   5,   5,   0,  -5,
+        -10,   5,   5,   5,   5,   5,   0, -10,
+        -10,   0,   5,   0,   0,   0,   0, -10,
+        -20, -10, -10,  -5,  -5, -10, -10, -20),
+    chess.KING: (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+         20,  20,   0,   0,   0,   0,  20,  20,
+         20,  30,  10,   0,   0,  10,  30,  20),
+}
+_KING_ENDGAME_TABLE = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50)
+
+def _weights() -> np.ndarray:
+    # (768, 3): for each (piece type, color, square) bit of the stacked bitboards, its middlegame
+    # and endgame value (cp, from White's side) and its phase weight
+    weights = np.zeros((6, 2, 64, 3), dtype=np.int32)
+    for piece_type in chess.PIECE_TYPES:
+        for square in chess.SQUARES:
+            table_index = chess.square_mirror(square) # the tables are written 8th rank first
+            middlegame = PIECE_VALUES[piece_type] + _TABLES[piece_type][table_index]
+            endgame = PIECE_VALUES[piece_type] + (_KING_ENDGAME_TABLE if piece_type == chess.KING else _TABLES[piece_type])[table_index]
+            weights[piece_type - 1, 0, square] = (middlegame, endgame, PHASE_WEIGHTS[piece_type])
+            # a black piece counts against White, from the mirrored square
+            mirrored = chess.square_mirror(square)
+            weights[piece_type - 1, 1, mirrored] = (-middlegame, -endgame, PHASE_WEIGHTS[piece_type])
+    return weights.reshape(768, 3)
+
+_WEIGHTS = _weights()
+
+def _bitboards(board: chess.Board = None) -> tuple:
+    white, black = board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]
+    return (board.pawns & white, board.pawns & black, board.knights & white, board.knights & black, board.bishops & white, board.bishops & black,
+            board.rooks & white, board.rooks & black, board.queens & white, board.queens & black, board.kings & white, board.kings & black)
+
+def _taper(middlegame: int = None, endgame: int = None, phase: int = None) -> int:
+    phase = min(phase, MAX_PHASE)
+    return (middlegame * phase + endgame * (MAX_PHASE - phase)) // MAX_PHASE
+
+def evaluate(board: chess.Board = None) -> int:
+    """
+    Static evaluation (cp, from the side to move): material and piece-square tables, tapered from
+    the middlegame to the endgame by the material left. The 12 bitboards are unpacked to 768 bits
+    and weighted in one matrix product.
+    """
+    bits = np.unpackbits(np.array(_bitboards(board), dtype="<u8").view(np.uint8), bitorder="little")
+    middlegame, endgame, phase = (bits @ _WEIGHTS).tolist()
+    score = _taper(middlegame, endgame, phase)
+    return score if board.turn == chess.WHITE else -score
+
+# transposition table entries: the key, and the data packed into one int64
+_EXACT, _LOWER, _UPPER = 0, 1, 2
+_ENTRY_BYTES = 16
+
+def _pack_move(move: chess.Move = None) -> int:
+    return (move.from_square << 9) | (move.to_square << 3) | (move.promotion or 0) if move else 0
+
+
+class _search_stopped(Exception):
+    pass
+
+
+class search_engine(object):
+    """
+    A small alpha-beta engine, for when no external UCI engine is available.
+
+    Iterative deepening of a principal variation search with null move pruning, late move
+    reductions and a quiescence search of the captures; moves are ordered by the transposition
+    table move, captures by MVV-LVA, two killer moves per ply, then the history heuristic. The
+    transposition table is two fixed-size arrays (keys and packed entries) of ``hash_size`` MB,
+    indexed by the low bits of the position's Zobrist key. Positions are evaluated by
+    :func:`evaluate`. It searches a few tens of thousands of nodes per second: enough for a usable
+    evaluation and a sound move, not for strength.
+    """
+    def __init__(self, hash_size: int = 16):
+        self.resize(hash_size)
+        self.nodes = 0
+        self.seldepth = 0
+        self.stop_event = threading.Event()
+
+    def resize(self, hash_size: int = None) -> None:
+        """(Re)allocates the transposition table, with the largest power of two of entries in ``hash_size`` MB."""
+        self._tt_mask = (1 << max(10, ((hash_size << 20) // _ENTRY_BYTES).bit_length() - 1)) - 1
+        self.clear()
+
+    def clear(self) -> None:
+        """Forgets everything learned (a new game)."""
+        self._tt_keys = array.array("Q", bytes(8 * (self._tt_mask + 1)))
+        self._tt_data = array.array("q", bytes(8 * (self._tt_mask + 1)))
+        self._history = [0] * (2 * 64 * 64)
+        self._killers = [[None, None] for _ in range(MAX_PLY + 1)]
+
+    def hashfull(self) -> int:
+        """Permille of the transposition table in use (sampled)."""
+        sample = self._tt_keys[:1000]
+        return 1000 * sum(1 for key in sample if key) // len(sample)
+
+    def _store(self, key: int = None, depth: int = None, flag: int = None, score: int = None, move: chess.Move = None, ply: int = None) -> None:
+        if score > MATE_BOUND: # mate scores are stored relative to this node
+            score += ply
+        elif score < -MATE_BOUND:
+            score -= ply
+        index = key & self._tt_mask
+        self._tt_keys[index] = key
+        self._tt_data[index] = ((score + INFINITE_SCORE) << 32) | ((depth + 1) << 24) | (flag << 16) | _pack_move(move)
+
+    def _probe(self, key: int = None, ply: int = None) -> tuple:
+        # (depth, flag, score, move code), or None
+        index = key & self._tt_mask
+        if self._tt_keys[index] != key:
+            return None
+        data = self._tt_data[index]
+        score = (data >> 32) - INFINITE_SCORE
+        if score > MATE_BOUND:
+            score -= ply
+        elif score < -MATE_BOUND:
+            score += ply
+        return (data >> 24 & 255) - 1, data >> 16 & 255, score, data & 0xFFFF
+
+    def _check_limits(self) -> None:
+        if self._can_stop and (self.stop_event.is_set() or time.perf_counter() >= self._deadline or self.nodes >= self._max_nodes):
+            raise _search_stopped()
+
+    def _ordered_moves(self, board: chess.Board = None, moves = None, tt_move: int = None, ply: int = None) -> list:
+        killers = self._killers[ply] if ply <= MAX_PLY else (None, None)
+        history, side = self._history, 4096 * board.turn
+        them = board.occupied_co[not board.turn]
+        scored = []
+        for move in moves:
+            if _pack_move(move) == tt_move:
+                order = 1 << 30
+            elif them & chess.BB_SQUARES[move.to_square] or board.is_en_passant(move):
+                victim = board.piece_type_at(move.to_square) or chess.PAWN
+                order = (1 << 28) + 10 * PIECE_VALUES[victim] - PIECE_VALUES[board.piece_type_at(move.from_square)]
+            elif move.promotion:
+                order = (1 << 27) + PIECE_VALUES[move.promotion]
+            elif move == killers[0]:
+                order = (1 << 26) + 1
+            elif move == killers[1]:
+                order = 1 << 26
+            else:
+                order = history[side + (move.from_square << 6) + move.to_square]
+            scored.append((order, move))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [move for _, move in scored]
+
+    def _is_draw(self, board: chess.Board = None, key: int = None) -> bool:
+        # the fifty-move rule, or a repetition since the last irreversible move
+        if board.halfmove_clock >= 100:
+            return True
+        path = self._path
+        for i in range(len(path) - 2, max(len(path) - board.halfmove_clock, 0) - 1, -2):
+            if path[i] == key:
+                return True
+        return False
+
+    def _quiescence(self, board: chess.Board = None, alpha: int = None, beta: int = None, ply: int = None) -> int:
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self._check_limits()
+        if ply > self.seldepth:
+            self.seldepth = ply
+        self._pv[ply] = []
+        stand_pat = evaluate(board)
+        if ply >= MAX_PLY:
+            return stand_pat
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        for move in self._ordered_moves(board, board.generate_legal_captures(), 0, MAX_PLY + 1):
+            victim = board.piece_type_at(move.to_square) or chess.PAWN
+            if stand_pat + PIECE_VALUES[victim] + 200 < alpha and not move.promotion: # delta pruning: hopeless even if it wins the piece
+                continue
+            board.push(move)
+            score = -self._quiescence(board, -beta, -alpha, ply + 1)
+            board.pop()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+                self._pv[ply] = [move] + self._pv[ply + 1]
+        return alpha
+
+    def _negamax(self, board: chess.Board = None, depth: int = None, alpha: int = None, beta: int = None, ply: int = None, allow_null: bool = True) -> int:
+        self._pv[ply] = []
+        key = position_key(board)
+        if self._is_draw(board, key):
+            return 0
+        in_check = board.is_check()
+        if in_check:
+            depth += 1 # check extension
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiescence(board, alpha, beta, ply)
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self._check_limits()
+        entry = self._probe(key, ply)
+        tt_move = 0
+        if entry is not None:
+            tt_depth, flag, score, tt_move = entry
+            if tt_depth >= depth and beta - alpha == 1: # cutoffs off the principal variation only, which keeps it whole
+                if flag == _EXACT or (flag == _LOWER and score >= beta) or (flag == _UPPER and score <= alpha):
+                    return score
+        if allow_null and not in_check and depth >= 3 and beta - alpha == 1 and abs(beta) < MATE_BOUND \
+                and board.occupied_co[board.turn] & ~(board.pawns | board.kings):
+            board.push(chess.Move.null())
+            self._path.append(key)
+            score = -self._negamax(board, depth - 3, -beta, -beta + 1, ply + 1, False)
+            self._path.pop()
+            board.pop()
+            if score >= beta:
+                return beta
+        moves = self._ordered_moves(board, board.generate_legal_moves(), tt_move, ply)
+        if not moves:
+            return -MATE_SCORE + ply if in_check else 0
+        best_score, best_move, original_alpha = -INFINITE_SCORE, None, alpha
+        them = board.occupied_co[not board.turn]
+        self._path.append(key)
+        try:
+            for i, move in enumerate(moves):
+                quiet = not (them & chess.BB_SQUARES[move.to_square] or move.promotion or board.is_en_passant(move))
+                board.push(move)
+                if i == 0:
+                    score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+                else:
+                    # late quiet moves are searched shallower first, and all but the first with a null window
+                    reduction = 1 if i >= 3 and depth >= 3 and quiet and not in_check and not board.is_check() else 0
+                    score = -self._negamax(board, depth - 1 - reduction, -alpha - 1, -alpha, ply + 1)
+                    if alpha < score and (reduction or score < beta):
+                        score = -self._negamax(board, depth - 1, -beta, -alpha, ply + 1)
+                board.pop()
+                if score > best_score:
+                    best_score, best_move = score, move
+                    if score > alpha:
+                        alpha = score
+                        self._pv[ply] = [move] + self._pv[ply + 1]
+                        if score >= beta:
+                            if quiet:
+                                killers = self._killers[ply]
+                                if killers[0] != move:
+                                    killers[0], killers[1] = move, killers[0]
+                                self._history[4096 * board.turn + (move.from_square << 6) + move.to_square] += depth * depth
+                            break
+        finally:
+            self._path.pop()
+        flag = _UPPER if best_score <= original_alpha else _LOWER if best_score >= beta else _EXACT
+        self._store(key, depth, flag, best_score, best_move, ply)
+        return best_score
+
+    def _search_root(self, board: chess.Board = None, depth: int = None, moves: list = None) -> tuple:
+        # (score, pv) of the best of the root moves
+        alpha, beta = -INFINITE_SCORE, INFINITE_SCORE
+        best_score, best_pv = -INFINITE_SCORE, []
+        self._path.append(position_key(board))
+        try:
+            for i, move in enumerate(moves):
+                board.push(move)
+                if i == 0:
+                    score = -self._negamax(board, depth - 1, -beta, -alpha, 1)
+                else:
+                    score = -self._negamax(board, depth - 1, -alpha - 1, -alpha, 1)
+                    if score > alpha:
+                        score = -self._negamax(board, depth - 1, -beta, -alpha, 1)
+                board.pop()
+                if score > best_score:
+                    best_score, best_pv = score, [move] + self._pv[1]
+                    alpha = max(alpha, score)
+        finally:
+            self._path.pop()
+        return best_score, best_pv
+
+    def search(self, board: chess.Board = None, depth: int = None, time_limit: float = None, nodes: int = None, multipv: int = 1,
+               info = None) -> list:
+        """
+        Searches ``board`` until ``depth`` (plies), ``time_limit`` (sec) or ``nodes`` is reached, or
+        :attr:`stop_event` is set; without any limit, until the maximum depth. Returns the lines of the
+        last completed depth, best first: ``multipv`` dicts with "depth", "seldepth", "score" (cp from
+        the side to move, ``MATE_SCORE - plies`` for a mate), "pv", "nodes", "time" and "nps". ``info``
+        is called with each line as it completes. Depth 1 is always completed, so there is a move.
+        """
+        start = time.perf_counter()
+        self._deadline = start + time_limit if time_limit is not None else float("inf")
+        self._max_nodes = nodes if nodes is not None else float("inf")
+        self._can_stop = False
+        self.nodes = self.seldepth = 0
+        self._pv = [[] for _ in range(MAX_PLY + 2)]
+        # the positions played before, for the repetitions
+        history = board.copy()
+        self._path = []
+        while history.move_stack and len(self._path) < board.halfmove_clock:
+            history.pop()
+            self._path.insert(0, position_key(history))
+        root = board.copy(stack=False)
+        root_moves = self._ordered_moves(root, root.generate_legal_moves(), 0, 0)
+        if not root_moves:
+            return []
+        multipv = max(1, min(multipv, len(root_moves)))
+        lines = []
+        for iteration in range(1, (depth or MAX_PLY) + 1):
+            try:
+                completed = []
+                remaining = list(root_moves)
+                for rank in range(multipv):
+                    score, pv = self._search_root(root, iteration, remaining)
+                    remaining.remove(pv[0])
+                    elapsed = time.perf_counter() - start
+                    completed.append({"depth": iteration, "seldepth": max(self.seldepth, iteration), "multipv": rank + 1, "score": score,
+                                      "pv": pv, "nodes": self.nodes, "time": elapsed, "nps": int(self.nodes / elapsed) if elapsed > 0 else 0})
+                    if info is not None:
+                        info(completed[-1])
+            except _search_stopped:
+                break
+            lines = completed
+            self._can_stop = True
+            # the best lines of this depth first in the next one
+            best = [line["pv"][0] for line in lines]
+            root_moves = best + [move for move in root_moves if move not in best]
+            elapsed = time.perf_counter() - start
+            if not root_moves or abs(lines[0]["score"]) > MATE_BOUND and MATE_SCORE - abs(lines[0]["score"]) < iteration:
+                break # a mate found is a mate
+            if time_limit is not None and elapsed > time_limit / 2:
+                break # the next depth would not complete in time
+            if self.stop_event.is_set() or self.nodes >= self._max_nodes:
+                break
+        return lines
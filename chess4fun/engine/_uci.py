@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import sys
+import threading
+
+import chess
+
+from ._search import search_engine, MATE_SCORE, MATE_BOUND
+
+ENGINE_NAME = "chess4fun built-in"
+MAX_HASH = 1024 # MB
+MAX_MULTIPV = 64
+MOVE_OVERHEAD = 0.05 # sec kept back from each move's time, for the communication
+DEFAULT_MOVES_TO_GO = 30
+
+def _uci_score(score: int = None) -> str:
+    if score > MATE_BOUND:
+        return f"mate {(MATE_SCORE - score + 1) // 2}"
+    if score < -MATE_BOUND:
+        return f"mate {-((MATE_SCORE + score) // 2)}"
+    return f"cp {score}"
+
+def _time_limit(board: chess.Board = None, params: dict = None) -> float:
+    # sec for this move: the fixed move time, or a share of the clock; None for no time limit
+    if "movetime" in params:
+        return max(0.01, params["movetime"] / 1000 - MOVE_OVERHEAD)
+    remaining = params.get("wtime" if board.turn == chess.WHITE else "btime")
+    if remaining is None:
+        return None
+    increment = params.get("winc" if board.turn == chess.WHITE else "binc", 0)
+    share = remaining / params.get("movestogo", DEFAULT_MOVES_TO_GO) + 0.75 * increment
+    return max(0.01, min(share, remaining / 2) / 1000 - MOVE_OVERHEAD)
+
+
+class uci_protocol(object):
+    """
+    The UCI protocol for :class:`search_engine`, over ``input`` and ``output`` (stdin and stdout by
+    default). Searches run in a thread of their own, so that "stop" and "isready" are answered
+    while searching. Options: Hash (MB), MultiPV, and Threads (accepted, always 1).
+    """
+    def __init__(self, input = None, output = None):
+        self.input = input or sys.stdin
+        self.output = output or sys.stdout
+        self.engine = search_engine()
+        self.board = chess.Board()
+        self.multipv = 1
+        self._output_lock = threading.Lock()
+        self._search_thread = None
+
+    def send(self, line: str = None) -> None:
+        with self._output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def run(self) -> None:
+        for line in self.input:
+            tokens = line.split()
+            if not tokens:
+                continue
+            command = tokens[0]
+            if command == "uci":
+                self.send(f"id name {ENGINE_NAME}")
+                self.send("id author Tank Overlord")
+                self.send(f"option name Hash type spin default 16 min 1 max {MAX_HASH}")
+                self.send("option name Threads type spin default 1 min 1 max 1")
+                self.send(f"option name MultiPV type spin default 1 min 1 max {MAX_MULTIPV}")
+                self.send("uciok")
+            elif command == "isready":
+                self.send("readyok")
+            elif command == "setoption":
+                self._set_option(tokens)
+            elif command == "ucinewgame":
+                self._stop()
+                self.engine.clear()
+            elif command == "position":
+                self._stop()
+                self._set_position(tokens)
+            elif command == "go":
+                self._stop()
+                self._go(tokens)
+            elif command == "stop":
+                self._stop()
+            elif command == "quit":
+                break
+        self._stop()
+
+    def _set_option(self, tokens: list = None) -> None:
+        # setoption name <name> [value <value>]
+        if "name" not in tokens:
+            return
+        value_index = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[tokens.index("name") + 1:value_index]).lower()
+        value = " ".join(tokens[value_index + 1:])
+        if name == "hash":
+            self._stop()
+            self.engine.resize(max(1, min(int(value), MAX_HASH)))
+        elif name == "multipv":
+            self.multipv = max(1, min(int(value), MAX_MULTIPV))
+
+    def _set_position(self, tokens: list = None) -> None:
+        # position (startpos | fen <fen>) [moves <move> ...]
+        moves_index = tokens.index("moves") if "moves" in tokens else len(tokens)
+        board = chess.Board() if tokens[1] == "startpos" else chess.Board(" ".join(tokens[2:moves_index]))
+        for uci in tokens[moves_index + 1:]:
+            board.push_uci(uci)
+        self.board = board
+
+    def _go(self, tokens: list = None) -> None:
+        params, i = {}, 1
+        while i < len(tokens):
+            if tokens[i] in ("infinite", "ponder"):
+                params[tokens[i]] = True
+                i += 1
+            elif tokens[i] in ("wtime", "btime", "winc", "binc", "movestogo", "depth", "nodes", "movetime", "mate") and i + 1 < len(tokens):
+                params[tokens[i]] = int(tokens[i + 1])
+                i += 2
+            else:
+                i += 1 # searchmoves and the like are not supported
+        self.engine.stop_event.clear()
+        self._search_thread = threading.Thread(target=self._search, args=(self.board.copy(), params), name="chess4fun-search", daemon=True)
+        self._search_thread.start()
+
+    def _search(self, board: chess.Board = None, params: dict = None) -> None:
+        def info(line: dict = None) -> None:
+            self.send(f"info depth {line['depth']} seldepth {line['seldepth']} multipv {line['multipv']} score {_uci_score(line['score'])} "
+                      f"nodes {line['nodes']} nps {line['nps']} hashfull {self.engine.hashfull()} time {int(line['time'] * 1000)} "
+                      f"pv {' '.join(move.uci() for move in line['pv'])}")
+        depth = params.get("depth")
+        if "mate" in params:
+            depth = min(depth or 2 * params["mate"], 2 * params["mate"])
+        lines = self.engine.search(board, depth=depth, time_limit=_time_limit(board, params), nodes=params.get("nodes"),
+                                   multipv=self.multipv, info=info)
+        if params.get("infinite") or params.get("ponder"):
+            self.engine.stop_event.wait() # no bestmove before "stop"
+        if not lines:
+            self.send(f"info depth 0 score {'mate 0' if board.is_checkmate() else 'cp 0'}")
+            self.send("bestmove (none)")
+        elif len(lines[0]["pv"]) > 1:
+            self.send(f"bestmove {lines[0]['pv'][0].uci()} ponder {lines[0]['pv'][1].uci()}")
+        else:
+            self.send(f"bestmove {lines[0]['pv'][0].uci()}")
+
+    def _stop(self) -> None:
+        if self._search_thread is not None:
+            self.engine.stop_event.set()
+            self._search_thread.join()
+            self._search_thread = None
+
+
+def uci_main() -> int:
+    """Runs the built-in engine as a UCI engine on stdin/stdout."""
+    uci_protocol().run()
+    return 0
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import array
+import math
+
+from PySide2.QtWidgets import QWidget
+from PySide2.QtCore import Qt, QPointF, QRectF, QSize, Signal
+from PySide2.QtGui import QColor, QPainter, QPen, QPixmap
+
+from .._telemetry import telemetry
+
+
+class score_graph(QWidget):
+    """
+    Score history chart (pawns, from White's viewpoint, one point per ply), drawn natively.
+
+    Scores are kept in a flat array (NaN for plies not evaluated yet). Every point but the last is
+    baked into a cached pixmap, so appending a ply only draws one more segment onto it and the
+    latest point (which progressive evaluation updates many times) is drawn live. The x range
+    starts at ``min_plies`` and doubles when the game outgrows it; the pixmap is only redrawn
+    from scratch then, on resize, or when earlier plies change. Clicking the chart emits
+    ``ply_clicked`` with the nearest ply.
+    """
+    ply_clicked = Signal(int)
+
+    margin_left, margin_right, margin_top, margin_bottom = 50, 20, 30, 35
+
+    def __init__(self, parent=None, score_cap: float = 50, min_plies: int = 50, *args, **kwargs):
+        super().__init__(parent=parent, *args, **kwargs)
+        self.score_cap = score_cap
+        self.min_plies = min_plies
+        self.n_plies = min_plies
+        self.current_ply = None
+        self._scores = array.array("d", [0.0]) # ply 0: the initial position
+        self._base = None # pixmap with the axes and the points before _baked
+        self._baked = 0
+        self.setMinimumSize(300, 200)
+
+    def sizeHint(self):
+        return QSize(800, 600)
+
+    def clear(self) -> None:
+        del self._scores[1:]
+        self.n_plies = self.min_plies
+        self.current_ply = None
+        self._invalidate()
+
+    def truncate(self, n_plies: int = None) -> None:
+        """Drops the scores after ply ``n_plies``."""
+        if n_plies + 1 < len(self._scores):
+            del self._scores[n_plies + 1:]
+            self.n_plies = self.min_plies
+            while n_plies > self.n_plies:
+                self.n_plies *= 2
+            self._invalidate()
+
+    def set_score(self, ply: int = None, score: float = None) -> None:
+        """Sets (or updates) the score of ``ply``, in pawns; plies skipped over stay empty."""
+        score = max(-self.score_cap, min(self.score_cap, score))
+        if ply >= len(self._scores):
+            self._scores.extend([math.nan] * (ply + 1 - len(self._scores)))
+        if ply < self._baked:
+            self._invalidate()
+        self._scores[ply] = score
+        if ply > self.n_plies:
+            while ply > self.n_plies:
+                self.n_plies *= 2
+            self._invalidate()
+        self.update()
+
+    def set_current_ply(self, ply: int = None) -> None:
+        self.current_ply = ply
+        self.update()
+
+    def _invalidate(self) -> None:
+        self._base = None
+        self._baked = 0
+        self.update()
+
+    def _plot_rect(self) -> QRectF:
+        return QRectF(self.margin_left, self.margin_top, max(1, self.width() - self.margin_left - self.margin_right),
+                      max(1, self.height() - self.margin_top - self.margin_bottom))
+
+    def _point(self, ply: int = None) -> QPointF:
+        rect = self._plot_rect()
+        return QPointF(rect.left() + ply / self.n_plies * rect.width(),
+                       rect.center().y() - self._scores[ply] / self.score_cap * rect.height() / 2)
+
+    def _draw_axes(self, painter: QPainter = None) -> None:
+        rect = self._plot_rect()
+        painter.fillRect(self.rect(), Qt.white)
+        painter.setPen(QPen(QColor("#dddddd"), 1))
+        x_step = max(1, self.n_plies // 10)
+        for ply in range(0, self.n_plies + 1, x_step):
+            x = rect.left() + ply / self.n_plies * rect.width()
+            painter.drawLine(QPointF(x, rect.top()), QPointF(x, rect.bottom()))
+        for i in range(-4, 5):
+            y = rect.center().y() - i / 4 * rect.height() / 2
+            painter.drawLine(QPointF(rect.left(), y), QPointF(rect.right(), y))
+        painter.setPen(QPen(Qt.black, 1))
+        painter.drawRect(rect)
+        for ply in range(0, self.n_plies + 1, x_step):
+            x = rect.left() + ply / self.n_plies * rect.width()
+            painter.drawText(QRectF(x - 20, rect.bottom() + 2, 40, 15), Qt.AlignCenter, str(ply))
+        for i in range(-4, 5):
+            y = rect.center().y() - i / 4 * rect.height() / 2
+            painter.drawText(QRectF(0, y - 8, self.margin_left - 5, 16), Qt.AlignRight | Qt.AlignVCenter, f"{i / 4 * self.score_cap:g}")
+        painter.drawText(QRectF(rect.left(), rect.bottom() + 17, rect.width(), 15), Qt.AlignCenter, "Plies")
+        painter.drawText(QRectF(rect.left(), 5, rect.width(), 20), Qt.AlignCenter, "Score History (from White's Viewpoint)")
+
+    def _draw_points(self, painter: QPainter = None, start: int = None, stop: int = None) -> None:
+        # the segments ending at plies start..stop-1, and their markers
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QPen(QColor("#1f77b4"), 2))
+        painter.setBrush(QColor("#1f77b4"))
+        for ply in range(start, stop):
+            if math.isnan(self._scores[ply]):
+                continue
+            point = self._point(ply)
+            if ply > 0 and not math.isnan(self._scores[ply - 1]):
+                painter.drawLine(self._point(ply - 1), point)
+            painter.drawEllipse(point, 3, 3)
+
+    @telemetry.timed("plot.paint")
+    def paintEvent(self, event):
+        ratio = self.devicePixelRatioF()
+        if self._base is None or self._base.size() != self.size() * ratio:
+            self._base = QPixmap(self.size() * ratio)
+            self._base.setDevicePixelRatio(ratio)
+            painter = QPainter(self._base)
+            self._draw_axes(painter)
+            painter.end()
+            self._baked = 0
+        last = len(self._scores) - 1
+        if self._baked < last:
+            painter = QPainter(self._base)
+            self._draw_points(painter, self._baked, last)
+            painter.end()
+            self._baked = last
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self._base)
+        self._draw_points(painter, last, last + 1)
+        if self.current_ply is not None and self.current_ply <= self.n_plies:
+            rect = self._plot_rect()
+            x = rect.left() + self.current_ply / self.n_plies * rect.width()
+            painter.setPen(QPen(QColor("#d62728"), 1, Qt.DashLine))
+            painter.drawLine(QPointF(x, rect.top()), QPointF(x, rect.bottom()))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        rect = self._plot_rect()
+        ply = round((event.pos().x() - rect.left()) / rect.width() * self.n_plies)
+        if 0 <= ply < len(self._scores):
+            self.ply_clicked.emit(ply)
@@ -6,69 +6,42 @@
 
 import sys
 
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MaxNLocator
-import io, base64, urllib
 
 import PySide2
-from PySide2.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout, QDialog, QPushButton, QTextBrowser, QAction, QLabel, QFileDialog, QLineEdit, QCheckBox
-from PySide2.QtSvg import QSvgWidget
-from PySide2.QtCore import QThread, Signal
+from PySide2.QtWidgets import QApplication, QMainWindow, QWidget, QGridLayout, QDialog, QPushButton, QTextBrowser, QAction, QLabel, QFileDialog, QLineEdit, QCheckBox, QSpinBox
+from PySide2.QtGui import QPainter
+from PySide2.QtCore import QObject, QSize, QThread, QTimer, Signal
 
 import asyncio
 import chess
 import chess.svg
 import chess.engine
+import chess.pgn
 
 asyncio.set_event_loop_policy(chess.engine.EventLoopPolicy()) # https://python-chess.readthedocs.io/en/latest/engine.html
 
-from ..opening import find_opening
-from ..analysis import evaluate_position, advise_move
-
+from .._preferences import preferences
+from .._telemetry import telemetry
+from ..opening import opening_tracker
+from ._render import board_renderer
+from ._graph import score_graph
+from ._sound import sounds
+from ..data import data_root_path, user_game, game_navigator, position_key
+from ..analysis import evaluate_position, evaluate_position_stream, advise_move, book_move, analyse_game, default_engine_session, speculative_analysis, likely_positions
+
+import concurrent.futures
+import html
 import pathlib
-import os
-
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-import pygame
-pygame.mixer.init()
-
-# sound
-sound_dir = pathlib.Path(__file__).parent.absolute() / 'sound'
-
-# https://freesound.org/people/Splashdust/sounds/67454/
-# https://creativecommons.org/publicdomain/zero/1.0/
-illegal_move_sound = pygame.mixer.Sound(sound_dir / "illegal_move.wav")
-
-# https://freesound.org/people/mh2o/sounds/351518/
-# https://creativecommons.org/publicdomain/zero/1.0/
-piece_move_sound = pygame.mixer.Sound(sound_dir / "piece_move.wav")
-
-check_sound = pygame.mixer.Sound(sound_dir / "check.wav")
-check_mate_sound = pygame.mixer.Sound(sound_dir / "check_mate.wav")
-stalemate_sound = pygame.mixer.Sound(sound_dir / "stalemate.wav")
-insufficient_material_sound = pygame.mixer.Sound(sound_dir / "insufficient_material.wav")
-gameover_sound = pygame.mixer.Sound(sound_dir / "gameover.wav")
-
-illegal_move_sound.set_volume(1.0)
-piece_move_sound.set_volume(1.0)
-check_sound.set_volume(1.0)
-check_mate_sound.set_volume(1.0)
-stalemate_sound.set_volume(1.0)
-insufficient_material_sound.set_volume(1.0)
-gameover_sound.set_volume(1.0)
-
-# preference settings (default)
-preferences = {'chess_engine_exe_path': '/usr/local/bin/stockfish',
-               'chess_engine_hash_size': 4096, # MB
-               'chess_engine_search_time': 5.0,
-               'play_sound': True,
-               'evaluate_position': True}
+import threading
+import time
 
 # global
 self_play_thread_run = False
-evaluation_history = []
 MATE_SCORE = 100000
+candidate_arrow_colors = ['#15781B', '#0050C8', '#C88C00', '#909090'] # best candidate first
+
+def score_str(score: chess.engine.Score = None) -> str:
+    return f"#{score.mate()}" if score.is_mate() else f"{score.score() / 100:+.2f}"
 
 class PreferencesDialog(QDialog):
     def __init__(self, parent=None, *args, **kwargs):
@@ -77,12 +50,14 @@ class PreferencesDialog(QDialog):
         self.setWindowTitle("Preference Settings")
         self.app_window = parent
         #
-        if not pathlib.Path(preferences['chess_engine_exe_path']).is_file():
+        if not pathlib.Path(preferences['chess_engine_exe_path'] or "").is_file():
             preferences['chess_engine_exe_path'] = None
-            self.app_window.UI.advise_next_pushbutton.setEnabled(False)
-            self.app_window.UI.self_play_pushbutton.setEnabled(False)
+            if not preferences['builtin_engine']:
+                self.app_window.main_UI.analyze_prev_pushbutton.setEnabled(False)
+                self.app_window.main_UI.advise_next_pushbutton.setEnabled(False)
+                self.app_window.main_UI.self_play_pushbutton.setEnabled(False)
         self.chess_engine_exe_path_label = QLabel('- Chess engine (stockfish) executable path:', parent=self)
-        self.chess_engine_exe_path_pushbutton = QPushButton(f"{preferences['chess_engine_exe_path']}", parent=self)
+        self.chess_engine_exe_path_pushbutton = QPushButton(f"{preferences['chess_engine_exe_path'] or ('Built-in engine' if preferences['builtin_engine'] else None)}", parent=self)
         self.chess_engine_exe_path_pushbutton.clicked.connect(self._change_chess_engine_path)
         #
         self.chess_engine_hash_size_MB_label = QLabel('- Chess engine hash size (MB):', parent=self)
@@ -95,6 +70,11 @@ class PreferencesDialog(QDialog):
         self.chess_engine_search_time_lineedit.setText(f"{preferences['chess_engine_search_time']}")
         self.chess_engine_search_time_lineedit.textChanged.connect(self._change_chess_engine_search_time)
         #
+        self.multipv_label = QLabel('- Candidate moves to advise (MultiPV):', parent=self)
+        self.multipv_lineedit = QLineEdit(parent=self)
+        self.multipv_lineedit.setText(f"{preferences['multipv']}")
+        self.multipv_lineedit.textChanged.connect(self._change_multipv)
+        #
         self.evaluate_position_label = QLabel('- Evaluation positions?', parent = self)
         self.evaluate_position_checkbox = QCheckBox('Yes', parent=self)
         self.evaluate_position_checkbox.setChecked(preferences['evaluate_position'])
@@ -112,10 +92,12 @@ class PreferencesDialog(QDialog):
         self.layout.addWidget(self.chess_engine_hash_size_MB_lineedit, 1, 1)
         self.layout.addWidget(self.chess_engine_search_time_label, 2, 0)
         self.layout.addWidget(self.chess_engine_search_time_lineedit, 2, 1)
-        self.layout.addWidget(self.evaluate_position_label, 3, 0)
-        self.layout.addWidget(self.evaluate_position_checkbox, 3, 1)
-        self.layout.addWidget(self.play_sound_label, 4, 0)
-        self.layout.addWidget(self.play_sound_checkbox, 4, 1)
+        self.layout.addWidget(self.multipv_label, 3, 0)
+        self.layout.addWidget(self.multipv_lineedit, 3, 1)
+        self.layout.addWidget(self.evaluate_position_label, 4, 0)
+        self.layout.addWidget(self.evaluate_position_checkbox, 4, 1)
+        self.layout.addWidget(self.play_sound_label, 5, 0)
+        self.layout.addWidget(self.play_sound_checkbox, 5, 1)
         self.setLayout(self.layout)
         #
         self.chess_engine_exe_path_filedialog = QFileDialog(parent=self)
@@ -132,8 +114,14 @@ class PreferencesDialog(QDialog):
             except:
                 raise RuntimeError('Error')
             self.chess_engine_exe_path_pushbutton.setText(f"{preferences['chess_engine_exe_path']}")
-            self.app_window.UI.advise_next_pushbutton.setEnabled(True)
-            self.app_window.UI.self_play_pushbutton.setEnabled(True)
+            self.app_window.main_UI.analyze_prev_pushbutton.setEnabled(True)
+            self.app_window.main_UI.advise_next_pushbutton.setEnabled(True)
+            self.app_window.main_UI.self_play_pushbutton.setEnabled(True)
+            self._engine_settings_changed()
+
+    def _engine_settings_changed(self):
+        # the speculative results came from the old engine or search limit
+        self.app_window.main_UI.chessboard_widget.engine_worker.speculation.clear()
 
     def _change_chess_engine_hash_size(self, new_text):
         global preferences
@@ -141,13 +129,22 @@ class PreferencesDialog(QDialog):
             preferences['chess_engine_hash_size'] = int(new_text)
         except:
             raise RuntimeError('Error')
-        
+        self._engine_settings_changed()
+
     def _change_chess_engine_search_time(self, new_text):
         global preferences
         try:
             preferences['chess_engine_search_time'] = float(new_text)
         except:
             raise RuntimeError('Error')
+        self._engine_settings_changed()
+
+    def _change_multipv(self, new_text):
+        global preferences
+        try:
+            preferences['multipv'] = int(new_text)
+        except:
+            raise RuntimeError('Error')
 
     def _play_sound_checkbox_state_changed(self, state: int):
         global preferences
@@ -165,9 +162,14 @@ class PreferencesDialog(QDialog):
 
 
 class app_window(QMainWindow):
+    store_message = Signal(str) # from the game store's writer thread
+    store_changed = Signal()
     def __init__(self, app=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.app = app
+        self.game_store_path = data_root_path / "games.sqlite3"
+        self._game_store = None
+        self._game_store_lock = threading.Lock() # the explorer opens it off the GUI thread
         # screen
         screen = self.app.primaryScreen()
         self.dpi = 72/screen.devicePixelRatio()
@@ -181,22 +183,148 @@ class app_window(QMainWindow):
         #print(self.geometry())
         #self.resize(self.width, self.height)
         self.preferences_dialog = PreferencesDialog(parent=self)
+        self.stats_dialog = None
         # preferences
         prefAct = QAction('&Preferences...', parent=self)
         prefAct.setShortcut('Ctrl+,')
         prefAct.setStatusTip('Preference settings')
         prefAct.triggered.connect(self.preferences_dialog.exec_)
+        # statistics
+        statsAct = QAction('&Statistics...', parent=self)
+        statsAct.setStatusTip('Timing and engine statistics')
+        statsAct.triggered.connect(self._show_stats)
+        self.profileAct = QAction('Start &Profiling', parent=self)
+        self.profileAct.setShortcut('Ctrl+Shift+P')
+        self.profileAct.setStatusTip('Profile the next interaction(s), until profiling is stopped')
+        self.profileAct.triggered.connect(self._toggle_profile)
         # exit
         exitAct = QAction('&Exit', parent=self)
         exitAct.setShortcut('Ctrl+Q')
         exitAct.setStatusTip('Exit app')
         exitAct.triggered.connect(self.app.quit)
+        # game database
+        saveAct = QAction('&Save Game', parent=self)
+        saveAct.setShortcut('Ctrl+S')
+        saveAct.setStatusTip('Save the game to the local game database')
+        saveAct.triggered.connect(self._save_game)
+        importAct = QAction('&Import PGN...', parent=self)
+        importAct.setStatusTip('Import the games of a PGN file into the local game database')
+        importAct.triggered.connect(self._import_pgn)
+        self.store_message.connect(lambda message: self.statusBar().showMessage(message, 5000))
+        self.store_changed.connect(self.main_UI.chessboard_widget.update_explorer)
         # menubar
         self.menubar = self.menuBar()
         self.menubar.setNativeMenuBar(False)
         self.AppMenu = self.menubar.addMenu('&App')
         self.AppMenu.addAction(prefAct)
+        self.AppMenu.addAction(statsAct)
+        self.AppMenu.addAction(self.profileAct)
         self.AppMenu.addAction(exitAct)
+        self.GameMenu = self.menubar.addMenu('&Game')
+        self.GameMenu.addAction(saveAct)
+        self.GameMenu.addAction(importAct)
+
+    def _show_stats(self):
+        if self.stats_dialog is None:
+            self.stats_dialog = StatsDialog(parent=self)
+        self.stats_dialog.refresh()
+        self.stats_dialog.show()
+
+    def _toggle_profile(self):
+        if not telemetry.is_profiling:
+            telemetry.start_profile()
+            self.profileAct.setText('Stop &Profiling')
+            self.statusBar().showMessage("Profiling...")
+            return
+        path, summary = telemetry.stop_profile()
+        self.profileAct.setText('Start &Profiling')
+        self.statusBar().showMessage(f"Profile saved to {path}", 5000)
+        self._show_stats()
+        self.stats_dialog.show_profile(path, summary)
+
+    def game_store(self, create: bool = True) -> user_game:
+        """The local game database, opened on first use; without ``create``, None as long as there is none on disk."""
+        with self._game_store_lock:
+            if self._game_store is None:
+                if not create and not self.game_store_path.exists():
+                    return None
+                self._game_store = user_game(path=self.game_store_path)
+                self.app.aboutToQuit.connect(self._game_store.close)
+            return self._game_store
+
+    def _store_done(self, future = None, message: str = None, failure: str = None):
+        # called on the game store's writer thread
+        if future.exception():
+            self.store_message.emit(f"{failure}: {future.exception()}")
+        else:
+            self.store_message.emit(message.format(future.result()))
+            self.store_changed.emit()
+
+    def _save_game(self):
+        # written in the background; the board is never blocked
+        game = self.main_UI.chessboard_widget.current_game()
+        future = self.game_store().save_game(game, evals=self.main_UI.chessboard_widget.navigator.scores())
+        future.add_done_callback(lambda f: self._store_done(f, "Game saved (#{})", "Save failed"))
+
+    def _import_pgn(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import PGN", "", "PGN files (*.pgn);;All files (*.*)")
+        if not path:
+            return
+        self.statusBar().showMessage(f"Importing {path}...")
+        future = self.game_store().import_pgn(path, progress=lambda n_games: self.store_message.emit(f"Importing {path}: {n_games} games..."))
+        future.add_done_callback(lambda f: self._store_done(f, "{} games imported", "Import failed"))
+
+
+class StatsDialog(QDialog):
+    def __init__(self, parent=None, *args, **kwargs):
+        super().__init__(parent=parent, *args, **kwargs)
+        self.resize(700, 600)
+        self.setWindowTitle("Statistics")
+        self.enabled_checkbox = QCheckBox('Collect timing and engine statistics', parent=self)
+        self.enabled_checkbox.setChecked(telemetry.enabled)
+        self.enabled_checkbox.stateChanged.connect(self._enabled_checkbox_state_changed)
+        self.text_browser = QTextBrowser(parent=self)
+        self.refresh_pushbutton = QPushButton('Refresh', parent=self)
+        self.reset_pushbutton = QPushButton('Reset', parent=self)
+        self.save_pushbutton = QPushButton('Save Log', parent=self)
+        self.layout = QGridLayout()
+        self.layout.addWidget(self.enabled_checkbox,   0, 0, 1, 3)
+        self.layout.addWidget(self.text_browser,       1, 0, 1, 3)
+        self.layout.addWidget(self.refresh_pushbutton, 2, 0)
+        self.layout.addWidget(self.reset_pushbutton,   2, 1)
+        self.layout.addWidget(self.save_pushbutton,    2, 2)
+        self.setLayout(self.layout)
+        self.refresh_pushbutton.clicked.connect(self.refresh)
+        self.reset_pushbutton.clicked.connect(self._reset)
+        self.save_pushbutton.clicked.connect(self._save)
+
+    def _enabled_checkbox_state_changed(self, state: int):
+        global preferences
+        preferences['telemetry'] = telemetry.enabled = self.enabled_checkbox.isChecked()
+
+    def refresh(self):
+        histograms = telemetry.snapshot()['histograms']
+        if not histograms:
+            self.text_browser.setHtml("No statistics yet" + ("" if telemetry.enabled else " (collection is off)"))
+            return
+        rows = ["<tr><th align='left'>Span / statistic</th><th align='right'>Count</th><th align='right'>Mean</th>"
+                "<th align='right'>Max</th><th align='right'>Total</th></tr>"]
+        for name, stats in histograms.items():
+            unit = "" if name.startswith("info.") else " ms" # engine-reported statistics, or spans
+            rows.append(f"<tr><td>{name}</td><td align='right'>{stats['count']}</td><td align='right'>{stats['mean']:.4g}{unit}</td>"
+                        f"<td align='right'>{stats['max']:.4g}{unit}</td><td align='right'>{stats['total']:.4g}{unit}</td></tr>")
+        self.text_browser.setHtml(f"<table cellspacing='4'>{''.join(rows)}</table>")
+
+    def show_profile(self, path: str = None, summary: str = None):
+        self.text_browser.setHtml(f"Profile saved to {path}<pre>{html.escape(summary)}</pre>")
+
+    def _reset(self):
+        telemetry.reset()
+        self.refresh()
+
+    def _save(self):
+        path = telemetry.save()
+        self.parent().statusBar().showMessage(f"Statistics appended to {path}", 5000)
 
 
 class EvaluationDialog(QDialog):
@@ -204,41 +332,17 @@ class EvaluationDialog(QDialog):
         super().__init__(parent=parent, *args, **kwargs)
         self.resize(850,650)
         self.setWindowTitle("Evaluation")
-        self.text_browser = QTextBrowser(parent=self)
+        self.score_graph = score_graph(parent=self)
         self.layout = QGridLayout()
-        self.layout.addWidget(self.text_browser, 0, 0)
+        self.layout.addWidget(self.score_graph, 0, 0)
         self.setLayout(self.layout)
-    
-    def update_plot(self):
-        #print(evaluation_history)
-        score_cap = 50
-        score_history = [0,]
-        for this_evaluation_result in evaluation_history:
-            this_score = this_evaluation_result['score'].pov(color = chess.WHITE).score(mate_score=MATE_SCORE) / 100
-            if abs(this_score) > score_cap:
-                this_score = this_score / abs(this_score) * score_cap
-            score_history.append(this_score)
-        fig, ax = plt.subplots(1,1,figsize=(8,6))
-        ax.set_ylim(bottom=-score_cap, top=score_cap)
-        ax.set_xlim(left=0, right=50)
-        ax.xaxis.set_major_locator(MaxNLocator(integer=True))
-        plt.plot(range(0,len(score_history)),score_history,'-o')
-        ax.set_ylabel("Score")
-        ax.set_xlabel('Moves')
-        ax.set_title("Score History (from White's Viewpoint)")
-        ax.grid(True)
-        #fig = plt.gcf() # get current figure
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png')
-        buf.seek(0)
-        string = base64.b64encode(buf.read())
-        base64_dict = {}
-        base64_dict['score_history'] = f"<img src=\"data:image/png;base64,{urllib.parse.quote(string)}\"/>"
-        plt.close(fig)
-        #
-        output_html_str = f"{base64_dict['score_history']}"
-        self.text_browser.setHtml(output_html_str)
-        self.repaint()         
+
+    @telemetry.timed("plot.update")
+    def update_plot(self, ply: int = None, score: chess.engine.PovScore = None):
+        """Plots (or updates) ``score``, the evaluation of ``ply``."""
+        score_cap = self.score_graph.score_cap
+        this_score = score.pov(color = chess.WHITE).score(mate_score=MATE_SCORE) / 100
+        self.score_graph.set_score(ply, max(-score_cap, min(score_cap, this_score)))
 
 
 class PromotionDialog(QDialog):
@@ -290,79 +394,301 @@ class self_play_thread(QThread):
         while not self.board.is_game_over():
             if not self_play_thread_run:
                 break
-            result = asyncio.run(advise_move(self.board))
+            result = asyncio.run(advise_move(self.board, book_random=True))
+            if result is None:
+                break
             self._signal.emit(result.move)
             self.board.push(result.move)
         self_play_thread_run = False
         self.main_UI.self_play_pushbutton.setText('Self Play')
 
 
-class chess_board_widget(QSvgWidget):
+class engine_worker(QObject):
+    """
+    Runs analysis jobs on the engine's own event loop thread, so the GUI never waits on the
+    engine, and delivers the results back to the GUI thread through Qt signals.
+    Submitting a job cancels the previous job of the same kind, which has become stale.
+    Evaluations are progressive: intermediate results are delivered as the search deepens,
+    at most every ``progress_interval`` seconds.
+    Between jobs, the positions likely to come next (the expected move and reply) are analyzed
+    speculatively, so that the evaluation after the move is played is ready, or well under way.
+    """
+    evaluation_ready = Signal(object, object) # (ply, position key), info
+    advice_ready = Signal(str, object)     # fen, PlayResult
+    engine_error = Signal(str)             # message
+    def __init__(self, parent=None, progress_interval: float = 0.25, *args, **kwargs):
+        super().__init__(parent, *args, **kwargs)
+        self.progress_interval = progress_interval
+        self.speculation = speculative_analysis()
+        self._jobs = {}
+        self._claimed = None # the evaluation served by the speculation, if any
+
+    def _submit(self, kind: str = None, coro = None, signal = None, tag = None):
+        self.cancel(kind)
+        self.speculation.preempt()
+        future = default_engine_session.submit(coro)
+        self._jobs[kind] = future
+        future.add_done_callback(lambda future: self._deliver(future, signal, tag))
+
+    def _deliver(self, future = None, signal = None, tag = None):
+        # on the engine loop thread; the signal is queued to the GUI thread
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.engine_error.emit(f"Engine error: {future.exception()}")
+            return
+        signal.emit(tag, future.result())
+
+    def evaluate(self, board: chess.Board = None, ply: int = None):
+        # the results are tagged with the position, not just the ply: the line may have changed by the time they come
+        board, tag = board.copy(), (ply, position_key(board))
+        if preferences['speculative_analysis']:
+            self.cancel("evaluate")
+            future = self.speculation.claim(board, self._claim_listener(board, tag))
+            if future is not None:
+                self._jobs["evaluate"] = self._claimed = future
+                return
+        self._submit("evaluate", self._evaluate_progressively(board, tag), self.evaluation_ready, tag)
+
+    async def _evaluate_progressively(self, board: chess.Board = None, tag: tuple = None):
+        # on the engine loop thread; the final info is delivered by _deliver()
+        last_emitted, info = time.monotonic(), None
+        async for info in evaluate_position_stream(board):
+            if time.monotonic() - last_emitted >= self.progress_interval:
+                self.evaluation_ready.emit(tag, info)
+                last_emitted = time.monotonic()
+        self._speculate(board, info)
+        return info
+
+    def _claim_listener(self, board: chess.Board = None, tag: tuple = None):
+        # delivers a speculative evaluation the way _evaluate_progressively() would
+        last_emitted = [time.monotonic()]
+        def listener(info: dict = None, done: bool = None):
+            if done:
+                self.evaluation_ready.emit(tag, info)
+                self._speculate(board, info)
+            elif time.monotonic() - last_emitted[0] >= self.progress_interval:
+                self.evaluation_ready.emit(tag, info)
+                last_emitted[0] = time.monotonic()
+        return listener
+
+    def _speculate(self, board: chess.Board = None, result = None):
+        # self-play keeps the engine busy on its own
+        if preferences['speculative_analysis'] and not self_play_thread_run:
+            self.speculation.speculate(likely_positions(board, result))
+
+    def advise(self, board: chess.Board = None):
+        self._submit("advise", self._advise(board.copy()), self.advice_ready, board.fen())
+
+    async def _advise(self, board: chess.Board = None):
+        # out of book, several candidates (a list of infos) come from one MultiPV search
+        if preferences['multipv'] > 1 and book_move(board) is None:
+            result = await evaluate_position(board, multipv=preferences['multipv'])
+        else:
+            result = await advise_move(board)
+        self._speculate(board, result)
+        return result
+
+    def cancel(self, kind: str = None):
+        for this_kind in ([kind] if kind is not None else list(self._jobs)):
+            future = self._jobs.pop(this_kind, None)
+            if future is not None:
+                if future is self._claimed and not future.done(): # the speculation's own search, still on the claimed position
+                    self.speculation.cancel()
+                future.cancel()
+        if kind is None:
+            self.speculation.cancel()
+
+
+class analyze_prev_thread(QThread):
+    _signal = Signal(object)
+    def __init__(self, move_stack: list = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.move_stack = list(move_stack)
+    def run(self):
+        async def _run():
+            async for ply_result in analyse_game(self.move_stack):
+                self._signal.emit(ply_result)
+        asyncio.run(_run())
+
+
+class chess_board_widget(QWidget):
+    explorer_ready = Signal(str, object) # fen, future of the continuations
     def __init__(self, parent=None, *args, **kwargs):
         super().__init__(parent=parent, *args, **kwargs)
         self.main_UI = parent
         self.board_size = 600
         self.setGeometry(0, 0, self.board_size, self.board_size)
+        self.renderer = board_renderer()
+        self._render_state = {}
+        self._explorer_pending = False
+        self._explorer_future = None
+        self._explorer_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="chess4fun-explorer")
+        self.explorer_ready.connect(self._show_explorer)
         self.promotion_dialog = PromotionDialog(parent=self)
-        self.new_game()
-        self.move_stack = []
-        self.turn_dict = {chess.WHITE: 'White', chess.BLACK: 'Black'}
+        self.engine_worker = engine_worker(parent=self)
         # evaluation dialog
         global preferences
         self.evaluation_dialog = EvaluationDialog(parent=self)
+        self.evaluation_dialog.score_graph.ply_clicked.connect(self.go_to_ply)
         if preferences['evaluate_position']:
             self.evaluation_dialog.show()
+        self.new_game()
+        self.turn_dict = {chess.WHITE: 'White', chess.BLACK: 'Black'}
+        self.nag_dict = {chess.pgn.NAG_DUBIOUS_MOVE: ('?!', 'inaccuracy'), chess.pgn.NAG_MISTAKE: ('?', 'mistake'), chess.pgn.NAG_BLUNDER: ('??', 'blunder')}
+        # engine jobs run off the GUI thread
+        self.engine_worker.evaluation_ready.connect(self._show_evaluation)
+        self.engine_worker.advice_ready.connect(self._show_advice)
+        self.engine_worker.engine_error.connect(lambda message: self.main_UI.app_window.statusBar().showMessage(message, 5000))
+
+    def sizeHint(self):
+        return QSize(self.board_size, self.board_size)
+
+    @property
+    def board(self) -> chess.Board:
+        return self.navigator.board
+
+    @property
+    def last_legal_move_ply_index(self) -> int:
+        return self.navigator.ply
+
+    def render_board(self, lastmove: chess.Move = None, check: chess.Square = None, arrows: list = ()):
+        """Shows the current position with the given highlights and arrows (drawn on the next paint)."""
+        self._render_state = {'lastmove': lastmove, 'check': check, 'arrows': list(arrows)}
+        self.evaluation_dialog.score_graph.set_current_ply(self.last_legal_move_ply_index)
+        self.main_UI.ply_spinbox.blockSignals(True) # showing the ply is not going to it
+        self.main_UI.ply_spinbox.setMaximum(len(self.navigator))
+        self.main_UI.ply_spinbox.setValue(self.last_legal_move_ply_index)
+        self.main_UI.ply_spinbox.blockSignals(False)
+        if not self._explorer_pending: # once per event loop pass, however many times the board is rendered
+            self._explorer_pending = True
+            QTimer.singleShot(0, self.update_explorer)
+        self.update()
+
+    @telemetry.timed("render.paint")
+    def paintEvent(self, event):
+        frame = self.renderer.frame(self.board, width=self.width(), height=self.height(), ratio=self.devicePixelRatioF(), **self._render_state)
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, frame)
+        painter.end()
 
     def update_text_browser(self):
-        opening = find_opening(self.move_stack[:self.last_legal_move_ply_index])
-        san = chess.Board().variation_san(self.move_stack[:self.last_legal_move_ply_index])
+        # the tracker follows the whole line; the text shows it up to the current ply
+        opening = self.opening_tracker.opening_at(self.last_legal_move_ply_index)
+        san = self.opening_tracker.variation_san(self.last_legal_move_ply_index)
         if opening is None:
             self.main_UI.text_browser.setHtml(f"{san}")
         else:
             self.main_UI.text_browser.setHtml(f"[ECO \"{opening['ECO']}\"]<br/>[Variation \"{opening['Variation']}\"]<br/><br/>{san}")
 
+    def update_explorer(self):
+        """Shows the moves played from the current position in the stored games, and how they scored."""
+        # looked up off the GUI thread; a lookup not started yet is superseded by this one
+        self._explorer_pending = False
+        if self._explorer_future is not None:
+            self._explorer_future.cancel()
+        board = self.board.copy(stack=False)
+        self._explorer_future = self._explorer_executor.submit(self._continuations, board)
+        self._explorer_future.add_done_callback(lambda future: self.explorer_ready.emit(board.fen(), future))
+
+    def _continuations(self, board: chess.Board = None) -> list:
+        # on the explorer thread; the game store is not opened (nor created) just to find it empty
+        store = self.main_UI.app_window.game_store(create=False)
+        return [] if store is None else store.continuations(board)
+
+    def _show_explorer(self, fen: str = None, future: concurrent.futures.Future = None):
+        if future.cancelled() or fen != self.board.fen(): # the position has changed meanwhile
+            return
+        if future.exception() is not None:
+            self.main_UI.explorer_browser.setHtml(f"Explorer unavailable: {html.escape(str(future.exception()))}")
+            return
+        continuations = future.result()
+        if not continuations:
+            self.main_UI.explorer_browser.setHtml("No stored games reach this position")
+            return
+        rows = ["<tr><th align='left'>Move</th><th align='right'>Games</th><th align='right'>White / Draw / Black</th><th align='right'>Eval</th></tr>"]
+        for stats in continuations:
+            decided = stats['white'] + stats['draws'] + stats['black']
+            outcomes = " / ".join(f"{100 * stats[key] / decided:.0f}%" for key in ('white', 'draws', 'black')) if decided else "-"
+            evaluation = "-" if stats['eval'] is None else f"{stats['eval'] / 100:+.2f}"
+            rows.append(f"<tr><td><a href='{stats['move'].uci()}'>{self.board.san(stats['move'])}</a></td><td align='right'>{stats['games']}</td>"
+                        f"<td align='right'>{outcomes}</td><td align='right'>{evaluation}</td></tr>")
+        self.main_UI.explorer_browser.setHtml(f"<table cellspacing='4'>{''.join(rows)}</table>")
+
+    def _explorer_move(self, url = None):
+        move = chess.Move.from_uci(url.toString())
+        if move in self.board.legal_moves:
+            self.make_this_move(move)
+
     def new_game(self):
-        global evaluation_history
-        self.board = chess.Board()
-        self.load(chess.svg.board(self.board, coordinates=False, size=self.board_size).encode("UTF-8"))
+        self.engine_worker.cancel()
+        self.navigator = game_navigator()
+        self.opening_tracker = opening_tracker()
         self._square_selected = False
-        #self.move_stack = []
-        evaluation_history = []
-        self.last_legal_move_ply_index = 0
+        self.evaluation_dialog.score_graph.clear()
+        self.render_board()
         self.promotion_dialog.promotion = chess.QUEEN
         self.main_UI.text_browser.setHtml("")
         self.repaint()
 
     def move_back(self):
-        if self.last_legal_move_ply_index > 0:
-            self.last_legal_move_ply_index -= 1
-            self.board.pop()
-            self.load(chess.svg.board(self.board, coordinates=False, size=self.board_size).encode("UTF-8"))
+        if self.navigator.back():
+            self.engine_worker.cancel("advise")
+            self.render_board()
             self.update_text_browser()
             self.repaint()
 
     def move_forward(self):
-        if self.last_legal_move_ply_index < len(self.move_stack):
-            next_move = self.move_stack[self.last_legal_move_ply_index]
-            if next_move in self.board.legal_moves:
-                self.board.push(next_move)
-                self.load(chess.svg.board(self.board, coordinates=False, size=self.board_size).encode("UTF-8"))
-                self.last_legal_move_ply_index += 1
-                self.update_text_browser()
-                self.repaint()
+        if self.navigator.forward():
+            self.engine_worker.cancel("advise")
+            self.render_board()
+            self.update_text_browser()
+            self.repaint()
+
+    def current_game(self) -> chess.pgn.Game:
+        """The game up to the current ply, for saving."""
+        game = chess.pgn.Game.from_board(self.board)
+        game.headers["Event"] = "chess4fun"
+        game.headers["Date"] = time.strftime("%Y.%m.%d")
+        return game
+
+    def go_to_ply(self, ply: int = None):
+        """Jumps to ``ply`` of the game (as far as the moves played go), in bounded time (see :class:`game_navigator`)."""
+        self.engine_worker.cancel("advise")
+        self.navigator.go_to(ply)
+        self.render_board()
+        self.update_text_browser()
 
     def analyze_prev(self):
-        self.main_UI.text_browser.setHtml(f"Coming Soon!")
+        if self.last_legal_move_ply_index == 0:
+            return
+        self.analysis_html_lines = []
+        self.main_UI.text_browser.setHtml("Analyzing...")
+        self.main_UI.analyze_prev_pushbutton.setEnabled(False)
+        self.analyzeprev_thread = analyze_prev_thread(move_stack = self.navigator.move_stack())
+        self.analyzeprev_thread._signal.connect(self._show_analyzed_ply)
+        self.analyzeprev_thread.finished.connect(lambda: self.main_UI.analyze_prev_pushbutton.setEnabled(True))
+        self.analyzeprev_thread.start()
+        self.repaint()
+
+    def _show_analyzed_ply(self, ply_result: dict = None):
+        move_number = f"{(ply_result['ply'] + 1) // 2}{'.' if ply_result['ply'] % 2 == 1 else '...'}"
+        html_str = f"{move_number} {ply_result['san']}{self.nag_dict.get(ply_result['nag'], ('', ''))[0]} ({score_str(ply_result['score'])})"
+        if ply_result['nag'] is not None:
+            html_str = f"<b>{html_str} -- {self.nag_dict[ply_result['nag']][1]}</b>"
+        self.analysis_html_lines.append(html_str)
+        self.main_UI.text_browser.setHtml("<br/>".join(self.analysis_html_lines))
         self.repaint()
 
     def self_play(self):
         global self_play_thread_run
         if self.board.is_game_over():
-            gameover_sound.play()
+            sounds.play('gameover')
         elif self.main_UI.self_play_pushbutton.text() == 'Self Play':
             self.selfplay_thread = self_play_thread(board = self.board, main_UI = self.main_UI)
             self.selfplay_thread._signal.connect(self.make_this_move)
             self_play_thread_run = True
+            self.engine_worker.speculation.cancel()
             self.selfplay_thread.start()
             self.main_UI.self_play_pushbutton.setText('Stop')
             self.repaint()
@@ -375,64 +701,95 @@ class chess_board_widget(QSvgWidget):
         global preferences
         if this_move not in self.board.legal_moves:
             raise RuntimeError(f"this_move {this_move} is illegal in the current position FEN: [{self.board.fen()}]")
-        if self.last_legal_move_ply_index < len(self.move_stack):
-            self.move_stack[self.last_legal_move_ply_index] = this_move
-        else:
-            self.move_stack.append(this_move)
-        self.last_legal_move_ply_index += 1
+        # the rest of the line (and its evaluations) is kept if the move follows it
+        line_changed = self.navigator.push(this_move)
+        if line_changed:
+            self.opening_tracker.truncate(self.last_legal_move_ply_index - 1)
+            self.opening_tracker.push(this_move)
+        self.engine_worker.cancel("advise")
         self.update_text_browser()
-        self.board.push(this_move)
-        self.load(chess.svg.board(self.board, coordinates=False, size=self.board_size, lastmove=this_move).encode("UTF-8"))
+        self.render_board(lastmove=this_move, check=self.board.king(self.board.turn) if self.board.is_check() else None)
         if preferences['play_sound']:
-            piece_move_sound.play()
+            sounds.play('piece_move')
         if self.board.is_game_over():
             if self.board.is_insufficient_material():
                 if preferences['play_sound']:
-                    insufficient_material_sound.play()
+                    sounds.play('insufficient_material')
             elif self.board.is_checkmate():
-                self.load(chess.svg.board(self.board, coordinates=False, size=self.board_size, check=self.board.king(self.board.turn), lastmove=this_move).encode("UTF-8"))
                 if preferences['play_sound']:
-                    check_mate_sound.play()
+                    sounds.play('check_mate')
             elif self.board.is_stalemate():
                 if preferences['play_sound']:
-                    stalemate_sound.play()
+                    sounds.play('stalemate')
             else:
                 if preferences['play_sound']:
-                    gameover_sound.play()
+                    sounds.play('gameover')
         elif self.board.is_check():
-            self.load(chess.svg.board(self.board, coordinates=False, size=self.board_size, check=self.board.king(self.board.turn), lastmove=this_move).encode("UTF-8"))
             if preferences['play_sound']:
-                check_sound.play()
-        # evaluate position
+                sounds.play('check')
+        # evaluate position (in the background; the plot is updated when the result arrives)
+        if line_changed:
+            self.evaluation_dialog.score_graph.truncate(self.last_legal_move_ply_index - 1)
         if preferences['evaluate_position']:
-            evaluation_results = asyncio.run(evaluate_position(self.board))
-            evaluation_history.append(evaluation_results)
-            self.evaluation_dialog.update_plot()
-            
+            self.engine_worker.evaluate(self.board, ply=self.last_legal_move_ply_index)
+
+    def _show_evaluation(self, tag: tuple = None, evaluation_results: dict = None):
+        # kept if the evaluated position is still at its ply of the line, wherever the user has gone meanwhile
+        ply, key = tag
+        if evaluation_results is None or ply > len(self.navigator) or position_key(self.navigator.board_at(ply)) != key:
+            return
+        self.navigator.set_eval(ply, evaluation_results['score'])
+        self.evaluation_dialog.update_plot(ply, evaluation_results['score'])
+
     def advise_next(self):
         if self.board.is_game_over():
-            html_str = "game over"
+            self.main_UI.text_browser.setHtml("game over")
         else:
-            result = asyncio.run(advise_move(self.board))
-            if result is not None:
-                if result.draw_offered:
-                    html_str = f"{self.turn_dict[self.board.turn]} to offer draw"
-                elif result.resigned:
-                    html_str = f"{self.turn_dict[self.board.turn]} to resign"
-                else:
-                    self.load(chess.svg.board(self.board, coordinates=False, size=self.board_size, arrows=[(result.move.from_square, result.move.to_square)]).encode("UTF-8"))
-                    html_str = f"{self.turn_dict[self.board.turn]} to move {chess.piece_name(self.board.piece_type_at(result.move.from_square))} from {chess.square_name(result.move.from_square)} to {chess.square_name(result.move.to_square)}"
-                    if result.move.promotion is not None:
-                        html_str += f" and promote it to {chess.piece_name(result.move.promotion)}"
-                    if result.ponder is not None:
-                        html_str += f"<br/>Ponder: {self.turn_dict[not self.board.turn]} to move {chess.piece_name(self.board.piece_type_at(result.ponder.from_square))} from {chess.square_name(result.ponder.from_square)} to {chess.square_name(result.ponder.to_square)}"
-                        if result.ponder.promotion is not None:
-                            html_str += f" and promote it to {chess.piece_name(result.ponder.promotion)}"
+            self.main_UI.text_browser.setHtml("Thinking...")
+            self.engine_worker.advise(self.board)
+        self.repaint()
+
+    def _show_advice(self, fen: str = None, result: chess.engine.PlayResult = None):
+        if fen != self.board.fen(): # the position has changed meanwhile
+            return
+        if isinstance(result, list):
+            self._show_candidates(result)
+            return
+        if result is not None:
+            if result.draw_offered:
+                html_str = f"{self.turn_dict[self.board.turn]} to offer draw"
+            elif result.resigned:
+                html_str = f"{self.turn_dict[self.board.turn]} to resign"
             else:
-                html_str = ""
+                self.render_board(arrows=[(result.move.from_square, result.move.to_square)])
+                html_str = f"{self.turn_dict[self.board.turn]} to move {chess.piece_name(self.board.piece_type_at(result.move.from_square))} from {chess.square_name(result.move.from_square)} to {chess.square_name(result.move.to_square)}"
+                if result.move.promotion is not None:
+                    html_str += f" and promote it to {chess.piece_name(result.move.promotion)}"
+                if result.info.get("string") == "book":
+                    html_str += " (book move)"
+                elif result.info.get("string") == "only move":
+                    html_str += " (only move)"
+                if result.ponder is not None:
+                    html_str += f"<br/>Ponder: {self.turn_dict[not self.board.turn]} to move {chess.piece_name(self.board.piece_type_at(result.ponder.from_square))} from {chess.square_name(result.ponder.from_square)} to {chess.square_name(result.ponder.to_square)}"
+                    if result.ponder.promotion is not None:
+                        html_str += f" and promote it to {chess.piece_name(result.ponder.promotion)}"
+        else:
+            html_str = ""
         self.main_UI.text_browser.setHtml(html_str)
         self.repaint()
 
+    def _show_candidates(self, infos: list = None):
+        arrows, html_lines = [], []
+        for rank, info in enumerate(infos):
+            if not info.get('pv'):
+                continue
+            move = info['pv'][0]
+            arrows.append(chess.svg.Arrow(move.from_square, move.to_square, color=candidate_arrow_colors[min(rank, len(candidate_arrow_colors) - 1)]))
+            html_lines.append(f"<font color=\"{candidate_arrow_colors[min(rank, len(candidate_arrow_colors) - 1)]}\">{rank + 1}. {self.board.san(move)}</font> ({score_str(info['score'].white())}): {self.board.variation_san(info['pv'])}")
+        self.render_board(arrows=arrows[::-1]) # best arrow on top
+        self.main_UI.text_browser.setHtml(f"{self.turn_dict[self.board.turn]} to move, candidates (from White's viewpoint):<br/>" + "<br/>".join(html_lines))
+        self.repaint()
+
     def mouseMoveEvent(self, event):
         #print(f"move: {event.pos()}")
         super().mouseMoveEvent(event)
@@ -443,7 +800,7 @@ class chess_board_widget(QSvgWidget):
         _square = chess.square(_file_idx, _rank_idx)
         #print(f"press: {event.pos()}")
         #print(f"{chess.square_name(_square)}")
-        self.load(chess.svg.board(self.board, coordinates=False, size=self.board_size, arrows=[(_square, _square)]).encode("UTF-8"))
+        self.render_board(arrows=[(_square, _square)])
         self._square_selected = True
         self._from_square = _square
         super().mousePressEvent(event)
@@ -466,9 +823,9 @@ class chess_board_widget(QSvgWidget):
                 if this_move in self.board.legal_moves:
                     self.make_this_move(this_move)
                 else:
-                    self.load(chess.svg.board(self.board, coordinates=False, size=self.board_size, ).encode("UTF-8"))
+                    self.render_board()
                     if preferences['play_sound']:
-                        illegal_move_sound.play()
+                        sounds.play('illegal_move')
                 self._square_selected = False
         #print(f"released: {event.pos()}")
         super().mouseReleaseEvent(event)
@@ -479,6 +836,11 @@ class main_UI(QWidget):
         super().__init__(parent=app_window, *args, **kwargs)
         self.app_window = app_window
         self.text_browser = QTextBrowser(parent=self)
+        self.explorer_browser = QTextBrowser(parent=self) # moves played from here in the stored games
+        self.explorer_browser.setOpenLinks(False)
+        self.ply_label = QLabel('Go to ply', parent=self)
+        self.ply_spinbox = QSpinBox(parent=self)
+        self.ply_spinbox.setKeyboardTracking(False) # typed plies are gone to once entered
         self.chessboard_widget  = chess_board_widget(parent=self)
         self.new_pushbutton     = QPushButton('New',parent=self)
         self.back_pushbutton    = QPushButton('Back',parent=self)
@@ -494,7 +856,10 @@ class main_UI(QWidget):
         self.layout.addWidget(self.analyze_prev_pushbutton, 1, 3, 1, 1)
         self.layout.addWidget(self.advise_next_pushbutton,  1, 4, 1, 1)
         self.layout.addWidget(self.self_play_pushbutton,    2, 0, 1, 1)
-        self.layout.addWidget(self.text_browser,            3, 0, 1, 5)
+        self.layout.addWidget(self.ply_label,               2, 3, 1, 1)
+        self.layout.addWidget(self.ply_spinbox,             2, 4, 1, 1)
+        self.layout.addWidget(self.text_browser,            3, 0, 1, 3)
+        self.layout.addWidget(self.explorer_browser,        3, 3, 1, 2)
         self.setLayout(self.layout)
         self.new_pushbutton.clicked.connect(self.chessboard_widget.new_game)
         self.back_pushbutton.clicked.connect(self.chessboard_widget.move_back)
@@ -502,13 +867,16 @@ class main_UI(QWidget):
         self.analyze_prev_pushbutton.clicked.connect(self.chessboard_widget.analyze_prev)
         self.advise_next_pushbutton.clicked.connect(self.chessboard_widget.advise_next)
         self.self_play_pushbutton.clicked.connect(self.chessboard_widget.self_play)
-        #
-        self.analyze_prev_pushbutton.setEnabled(False)
+        self.ply_spinbox.valueChanged.connect(self.chessboard_widget.go_to_ply)
+        self.explorer_browser.anchorClicked.connect(self.chessboard_widget._explorer_move)
 
 
 def main():
     app = QApplication(sys.argv)
     window = app_window(app=app)
     window.show()
+    sounds.load_in_background() # the window is up first; sounds play once loaded
+    app.aboutToQuit.connect(default_engine_session.close)
+    app.aboutToQuit.connect(lambda: telemetry.save() if telemetry.enabled else None)
     app.exec_()
 
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import collections
+import math
+
+from PySide2.QtCore import Qt, QByteArray, QPointF, QRectF
+from PySide2.QtGui import QBrush, QColor, QImage, QPainter, QPen, QPixmap, QPolygonF, QRadialGradient
+from PySide2.QtSvg import QSvgRenderer
+
+import chess
+import chess.svg
+
+from .._telemetry import telemetry
+
+
+def _qcolor(color: str = None) -> QColor:
+    # "#rrggbb", "#rrggbbaa" (as in chess.svg), or a chess.svg arrow color name
+    color = chess.svg.DEFAULT_COLORS.get(f"arrow {color}", color)
+    qcolor = QColor(color[:7])
+    if len(color) == 9:
+        qcolor.setAlpha(int(color[7:], 16))
+    return qcolor
+
+
+class board_renderer(object):
+    """
+    Draws the board as chess.svg does, without generating and parsing an SVG document per event.
+
+    The square colors and the piece sprites (rasterized from chess.svg once per square size and
+    device pixel ratio) are cached, and a frame is composited from them with QPainter: squares,
+    last-move and check highlights, pieces, then arrows. Finished frames are memoized by
+    (position, lastmove, check, arrows, size) in an LRU of ``max_frames``, so stepping back and
+    forth through a game re-uses frames instead of drawing them again. A new frame starts from the
+    last one drawn (without its arrows) and only the squares that have changed are drawn again:
+    after a move, the two to four squares it touches and the highlights it moves.
+    """
+    def __init__(self, max_frames: int = 128):
+        self.max_frames = max_frames
+        self._frames = collections.OrderedDict()
+        self._sprites = {}
+        self._sprite_size = None
+        self._base = None # (size, square states, pixmap): the last frame drawn, without arrows
+
+    def _sprite(self, piece: chess.Piece = None, square_width: float = None, square_height: float = None, ratio: float = None) -> QPixmap:
+        if self._sprite_size != (square_width, square_height, ratio):
+            self._sprites, self._sprite_size = {}, (square_width, square_height, ratio)
+        symbol = piece.symbol()
+        if symbol not in self._sprites:
+            image = QImage(math.ceil(square_width * ratio), math.ceil(square_height * ratio), QImage.Format_ARGB32_Premultiplied)
+            image.fill(Qt.transparent)
+            painter = QPainter(image)
+            QSvgRenderer(QByteArray(chess.svg.piece(piece).encode("UTF-8"))).render(painter)
+            painter.end()
+            pixmap = QPixmap.fromImage(image)
+            pixmap.setDevicePixelRatio(ratio)
+            self._sprites[symbol] = pixmap
+        return self._sprites[symbol]
+
+    @telemetry.timed("render.frame")
+    def frame(self, board: chess.BaseBoard = None, width: int = 600, height: int = 600, ratio: float = 1.0,
+              lastmove: chess.Move = None, check: chess.Square = None, arrows: list = ()) -> QPixmap:
+        arrows = tuple(arrow if isinstance(arrow, chess.svg.Arrow) else chess.svg.Arrow(*arrow) for arrow in arrows)
+        key = (board.board_fen(), lastmove, check, tuple((arrow.tail, arrow.head, arrow.color) for arrow in arrows), width, height, ratio)
+        if key in self._frames:
+            self._frames.move_to_end(key)
+            return self._frames[key]
+        size, states = (width, height, ratio), self._square_states(board, lastmove, check)
+        with telemetry.span("render.draw"): # frame cache misses only
+            if self._base is None or self._base[0] != size:
+                base = QPixmap(math.ceil(width * ratio), math.ceil(height * ratio))
+                base.setDevicePixelRatio(ratio)
+                changed = chess.SQUARES
+            else:
+                base = self._base[2]
+                changed = [square for square in chess.SQUARES if states[square] != self._base[1][square]]
+            if changed:
+                painter = QPainter(base)
+                painter.setRenderHint(QPainter.Antialiasing)
+                for square in changed:
+                    self._draw_square(painter, square, states[square], width / 8, height / 8, ratio)
+                painter.end()
+            self._base = (size, states, base)
+            pixmap = base.copy() # the base is drawn over again by the next miss
+            if arrows:
+                painter = QPainter(pixmap)
+                painter.setRenderHint(QPainter.Antialiasing)
+                for arrow in arrows:
+                    self._draw_arrow(painter, arrow, width / 8, height / 8)
+                painter.end()
+        self._frames[key] = pixmap
+        while len(self._frames) > self.max_frames:
+            self._frames.popitem(last=False)
+        return pixmap
+
+    @staticmethod
+    def _square_states(board: chess.BaseBoard = None, lastmove: chess.Move = None, check: chess.Square = None) -> list:
+        # what each square shows: (piece, last-move highlight, check)
+        highlighted = {lastmove.from_square, lastmove.to_square} if lastmove else set()
+        return [(board.piece_at(square), square in highlighted, square == check) for square in chess.SQUARES]
+
+    def _draw_square(self, painter: QPainter = None, square: chess.Square = None, state: tuple = None,
+                     square_width: float = None, square_height: float = None, ratio: float = None) -> None:
+        piece, highlighted, check = state
+        rect = QRectF(chess.square_file(square) * square_width, (7 - chess.square_rank(square)) * square_height, square_width, square_height)
+        shade = "light" if chess.BB_SQUARES[square] & chess.BB_LIGHT_SQUARES else "dark"
+        painter.fillRect(rect, QColor(chess.svg.DEFAULT_COLORS[f"square {shade} lastmove" if highlighted else f"square {shade}"]))
+        if check:
+            gradient = QRadialGradient(rect.center(), min(square_width, square_height) / 2 * 1.2)
+            gradient.setColorAt(0.0, QColor("#ff0000"))
+            gradient.setColorAt(0.5, QColor("#e70000"))
+            gradient.setColorAt(1.0, QColor(158, 0, 0, 0))
+            painter.fillRect(rect, QBrush(gradient))
+        if piece is not None:
+            painter.drawPixmap(rect.topLeft(), self._sprite(piece, square_width, square_height, ratio))
+
+    def _draw_arrow(self, painter: QPainter = None, arrow: chess.svg.Arrow = None, square_width: float = None, square_height: float = None) -> None:
+        # geometry as in chess.svg.board()
+        size = min(square_width, square_height)
+        color = _qcolor(arrow.color)
+        center = lambda square: QPointF((chess.square_file(square) + 0.5) * square_width, (7.5 - chess.square_rank(square)) * square_height)
+        tail, head = center(arrow.tail), center(arrow.head)
+        if arrow.tail == arrow.head:
+            painter.setPen(QPen(color, size * 0.1))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawEllipse(tail, size * 0.45, size * 0.45)
+            return
+        dx, dy = head.x() - tail.x(), head.y() - tail.y()
+        length = math.hypot(dx, dy)
+        ux, uy = dx / length, dy / length
+        marker_size, marker_margin = 0.75 * size, 0.1 * size
+        shaft_end = QPointF(head.x() - ux * (marker_size + marker_margin), head.y() - uy * (marker_size + marker_margin))
+        tip = QPointF(head.x() - ux * marker_margin, head.y() - uy * marker_margin)
+        painter.setPen(QPen(color, size * 0.2, Qt.SolidLine, Qt.FlatCap))
+        painter.drawLine(tail, shaft_end)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(color)
+        painter.drawPolygon(QPolygonF([tip,
+                                       QPointF(shaft_end.x() + uy * marker_size / 2, shaft_end.y() - ux * marker_size / 2),
+                                       QPointF(shaft_end.x() - uy * marker_size / 2, shaft_end.y() + ux * marker_size / 2)]))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import os
+import pathlib
+import threading
+
+sound_dir = pathlib.Path(__file__).parent.absolute() / 'sound'
+
+SOUND_FILES = {
+    # https://freesound.org/people/Splashdust/sounds/67454/
+    # https://creativecommons.org/publicdomain/zero/1.0/
+    'illegal_move': "illegal_move.wav",
+    # https://freesound.org/people/mh2o/sounds/351518/
+    # https://creativecommons.org/publicdomain/zero/1.0/
+    'piece_move': "piece_move.wav",
+    'check': "check.wav",
+    'check_mate': "check_mate.wav",
+    'stalemate': "stalemate.wav",
+    'insufficient_material': "insufficient_material.wav",
+    'gameover': "gameover.wav",
+}
+
+
+class sound_effects(object):
+    """
+    The game sounds, loaded off the startup path.
+
+    pygame is imported, the mixer initialized and the WAV files decoded by :meth:`load`, which
+    :meth:`load_in_background` runs in a daemon thread once the window is up. Until the sounds
+    are ready (or if there is no audio device), :meth:`play` is a no-op.
+    """
+    def __init__(self, volume: float = 1.0):
+        self.volume = volume
+        self._sounds = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return len(self._sounds) == len(SOUND_FILES)
+
+    def load(self) -> None:
+        with self._lock:
+            if self.is_loaded:
+                return
+            os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+            try:
+                import pygame
+                pygame.mixer.init()
+            except Exception: # no pygame or no audio device: play silently
+                return
+            sounds = {}
+            for name, file_name in SOUND_FILES.items():
+                sounds[name] = pygame.mixer.Sound(sound_dir / file_name)
+                sounds[name].set_volume(self.volume)
+            self._sounds = sounds
+
+    def load_in_background(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.load, name="chess4fun-sound", daemon=True)
+            self._thread.start()
+
+    def play(self, name: str = None) -> None:
+        sound = self._sounds.get(name)
+        if sound is not None:
+            sound.play()
+
+
+sounds = sound_effects()
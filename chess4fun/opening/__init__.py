@@ -4,6 +4,6 @@
 #
 # License: LGPL-3.0
 
-from ._opening import find_opening
+from ._opening import find_opening, opening_tracker, book_moves, choose_book_move
 
-__all__ = ["find_opening",]
\ No newline at end of file
+__all__ = ["find_opening", "opening_tracker", "book_moves", "choose_book_move",]
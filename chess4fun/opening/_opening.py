@@ -4,10 +4,24 @@
 #
 # License: LGPL-3.0
 
-import chess, chess.pgn, pathlib, pickle
+import bisect, chess, chess.pgn, chess.polyglot, collections, mmap, pathlib, pickle, struct
+
+from ..data import read_games
+from .._telemetry import telemetry
 
 curr_dir = pathlib.Path(__file__).parent.absolute()
 opening_book_filename = 'scideco_opening.pkl'
+compiled_opening_book_filename = 'scideco_opening.bin'
+ECO_move_book_filename = 'scideco_moves.bin' # polyglot format
+
+# compiled book layout (little-endian):
+#   header:  magic (8 bytes), number of positions (u32), number of strings (u32)
+#   keys:    sorted Zobrist hashes of the final position of each ECO line (u64 each)
+#   values:  ECO string index, Variation string index (u32, u32) for each key
+#   strings: offsets (u32 each, number of strings + 1) followed by the utf-8 string blob
+BOOK_MAGIC = b'C4FECO01'
+BOOK_HEADER = struct.Struct('<8sII')
+BOOK_VALUE = struct.Struct('<II')
 
 def preprocess_ECO_book():
     """
@@ -18,21 +32,228 @@ def preprocess_ECO_book():
     """
     opening_book_dict = {}
     pgn = open(curr_dir / "scideco.pgn") 
-    while True:
-        game = chess.pgn.read_game(pgn)
-        if game is None:
-            break
+    for game in read_games(pgn, variations=False, comments=False):
         Mainline_moves_str = game.accept(chess.pgn.StringExporter(headers=False,variations=False,comments=False)).replace('\n', ' ')
         opening_book_dict[Mainline_moves_str] = {'ECO': game.headers.get('ECO', '?'),'Variation': game.headers.get('Variation', '?')}
     with open(curr_dir / opening_book_filename, 'wb') as opening_book_file:
         pickle.dump(opening_book_dict, opening_book_file)
+    compile_ECO_book(opening_book_dict)
+    compile_ECO_move_book(opening_book_dict)
+
+def load_ECO_book_dict() -> dict:
+    with open(curr_dir / opening_book_filename, 'rb') as opening_book_file:
+        return pickle.load(opening_book_file)
+
+def iter_ECO_lines(opening_book_dict: dict = None):
+    """
+    Yields ``(board, sans, opening)`` for each line of the book, in sorted order. The lines are
+    replayed as a trie, so shared prefixes are only pushed once; ``board`` is reused between lines.
+    """
+    board, prev_sans = chess.Board(), []
+    for line in sorted(opening_book_dict):
+        sans = [token for token in line.split() if not token.endswith('.') and token != '*']
+        n_common = 0
+        while n_common < min(len(prev_sans), len(sans)) and prev_sans[n_common] == sans[n_common]:
+            n_common += 1
+        for _ in range(len(prev_sans) - n_common):
+            board.pop()
+        for san in sans[n_common:]:
+            board.push_san(san)
+        prev_sans = sans
+        yield board, sans, opening_book_dict[line]
+
+def compile_ECO_book(opening_book_dict: dict = None) -> None:
+    """
+    Compiles the ECO book into ``scideco_opening.bin``: the book indexed by the Zobrist hash of the
+    final position of each line (so that transpositions into a known opening are recognized),
+    with ECO codes and variation names interned in a shared string table.
+    """
+    if opening_book_dict is None:
+        opening_book_dict = load_ECO_book_dict()
+    index = {}
+    for board, sans, opening in iter_ECO_lines(opening_book_dict):
+        if sans:
+            index.setdefault(chess.polyglot.zobrist_hash(board), opening)
+    strings = {}
+    for opening in index.values():
+        for name in (opening['ECO'], opening['Variation']):
+            strings.setdefault(name, len(strings))
+    encoded = [name.encode('utf-8') for name in strings]
+    offsets = [0]
+    for name in encoded:
+        offsets.append(offsets[-1] + len(name))
+    keys = sorted(index)
+    with open(curr_dir / compiled_opening_book_filename, 'wb') as book_file:
+        book_file.write(BOOK_HEADER.pack(BOOK_MAGIC, len(keys), len(encoded)))
+        book_file.write(struct.pack(f'<{len(keys)}Q', *keys))
+        for key in keys:
+            book_file.write(BOOK_VALUE.pack(strings[index[key]['ECO']], strings[index[key]['Variation']]))
+        book_file.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        book_file.write(b''.join(encoded))
+
+
+def _polyglot_move(board: chess.Board = None, move: chess.Move = None) -> int:
+    # polyglot encodes castling as "king captures own rook"
+    to_square = move.to_square
+    if board.is_kingside_castling(move):
+        to_square = chess.square(7, chess.square_rank(move.from_square))
+    elif board.is_queenside_castling(move):
+        to_square = chess.square(0, chess.square_rank(move.from_square))
+    return to_square | (move.from_square << 6) | (((move.promotion or 1) - 1) << 12)
+
+def compile_ECO_move_book(opening_book_dict: dict = None) -> None:
+    """
+    Compiles the ECO book into a Polyglot opening book, ``scideco_moves.bin``: every move of every
+    ECO line, weighted by the number of lines going through it, so it can be probed like any other
+    Polyglot book for candidate continuations.
+    """
+    if opening_book_dict is None:
+        opening_book_dict = load_ECO_book_dict()
+    weights, prefix_keys = collections.Counter(), {}
+    for board, sans, opening in iter_ECO_lines(opening_book_dict):
+        replay = chess.Board()
+        for ply, move in enumerate(board.move_stack):
+            prefix = tuple(sans[:ply])
+            if prefix not in prefix_keys:
+                prefix_keys[prefix] = chess.polyglot.zobrist_hash(replay)
+            weights[(prefix_keys[prefix], _polyglot_move(replay, move))] += 1
+            replay.push(move)
+    entries = sorted(weights.items(), key=lambda item: (item[0][0], -item[1]))
+    with open(curr_dir / ECO_move_book_filename, 'wb') as book_file:
+        for (key, raw_move), weight in entries:
+            book_file.write(chess.polyglot.ENTRY_STRUCT.pack(key, raw_move, min(weight, 0xffff), 0))
+
+
+class _sorted_keys(object):
+    # a sequence view over the u64 keys of a compiled book, for bisect
+    def __init__(self, buffer = None, offset: int = None, n_keys: int = None):
+        self.buffer, self.offset, self.n_keys = buffer, offset, n_keys
+
+    def __len__(self) -> int:
+        return self.n_keys
+
+    def __getitem__(self, i: int) -> int:
+        return struct.unpack_from('<Q', self.buffer, self.offset + 8 * i)[0]
+
+
+class opening_book(object):
+    """
+    A compiled ECO book (see :func:`compile_ECO_book`), memory-mapped read-only and looked up
+    by binary search. Nothing is decoded up front, and the pages are shared by all the
+    processes that open the same file.
+    """
+    def __init__(self, path = curr_dir / compiled_opening_book_filename):
+        with open(path, 'rb') as book_file:
+            self._mm = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_keys, self.n_strings = BOOK_HEADER.unpack_from(self._mm, 0)
+        if magic != BOOK_MAGIC:
+            raise IOError(f"not a compiled opening book: {path}")
+        self._keys = _sorted_keys(self._mm, BOOK_HEADER.size, self.n_keys)
+        self._values_offset = BOOK_HEADER.size + 8 * self.n_keys
+        self._string_offsets_offset = self._values_offset + BOOK_VALUE.size * self.n_keys
+        self._strings_offset = self._string_offsets_offset + 4 * (self.n_strings + 1)
+
+    def __len__(self) -> int:
+        return self.n_keys
+
+    def _string(self, i: int = None) -> str:
+        start, end = struct.unpack_from('<II', self._mm, self._string_offsets_offset + 4 * i)
+        return self._mm[self._strings_offset + start:self._strings_offset + end].decode('utf-8')
+
+    def get(self, key: int = None, default = None) -> dict:
+        i = bisect.bisect_left(self._keys, key)
+        if i == self.n_keys or self._keys[i] != key:
+            return default
+        eco, variation = BOOK_VALUE.unpack_from(self._mm, self._values_offset + BOOK_VALUE.size * i)
+        return {'ECO': self._string(eco), 'Variation': self._string(variation)}
+
+    def __contains__(self, key: int = None) -> bool:
+        return self.get(key) is not None
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+opening_index = None
+
+def load_opening_index() -> opening_book:
+    """Opens the compiled ECO book on first use."""
+    global opening_index
+    if opening_index is None:
+        opening_index = opening_book()
+    return opening_index
+
+
+_book_readers = {}
+
+def _book_reader(path = None) -> chess.polyglot.MemoryMappedReader:
+    path = str(path or curr_dir / ECO_move_book_filename)
+    if path not in _book_readers:
+        _book_readers[path] = chess.polyglot.open_reader(path)
+    return _book_readers[path]
+
+def book_moves(board: chess.Board = None, path = None) -> list:
+    """
+    Returns the book continuations of ``board`` as :class:`chess.polyglot.Entry` (with ``move``
+    and ``weight``), highest weight first. ``path`` is an external Polyglot ``.bin`` book;
+    by default the built-in book compiled from the ECO lines is probed. Books are memory-mapped.
+    """
+    return sorted(_book_reader(path).find_all(board), key=lambda entry: -entry.weight)
+
+def choose_book_move(board: chess.Board = None, path = None, random: bool = False) -> chess.Move:
+    """Returns the most played book move (or a weighted random one), or None when out of book."""
+    reader = _book_reader(path)
+    try:
+        entry = reader.weighted_choice(board) if random else reader.find(board)
+    except IndexError:
+        return None
+    return entry.move
+
+
+class opening_tracker(object):
+    """
+    Tracks the deepest known opening of a game as moves are pushed and popped,
+    at a constant cost per move regardless of the game length.
+    Also keeps the SAN of the moves played, for display. The opening and the
+    moves at any earlier ply stay available (see :meth:`opening_at`), so the
+    tracker can follow a whole line while the game is reviewed anywhere in it.
+    """
+    def __init__(self):
+        self.board = chess.Board()
+        self.sans = []
+        self._openings = [None]
+
+    @property
+    def opening(self) -> dict:
+        return self._openings[-1]
+
+    @telemetry.timed("opening.push")
+    def push(self, move: chess.Move = None) -> None:
+        self.sans.append(self.board.san(move))
+        self.board.push(move)
+        self._openings.append(load_opening_index().get(chess.polyglot.zobrist_hash(self.board), self._openings[-1]))
+
+    def pop(self) -> chess.Move:
+        self.sans.pop()
+        self._openings.pop()
+        return self.board.pop()
+
+    def truncate(self, n_plies: int = None) -> None:
+        """Pops the moves after ply ``n_plies``."""
+        while len(self.sans) > n_plies:
+            self.pop()
+
+    def opening_at(self, ply: int = None) -> dict:
+        return self._openings[ply]
+
+    def variation_san(self, n_plies: int = None) -> str:
+        """The moves (up to ply ``n_plies``, all by default) in SAN, numbered."""
+        return " ".join(f"{ply // 2 + 1}. {san}" if ply % 2 == 0 else san for ply, san in enumerate(self.sans[:n_plies]))
 
-with open(curr_dir / opening_book_filename, 'rb') as opening_book_file:
-    opening_book_dict = pickle.load(opening_book_file)
 
+@telemetry.timed("opening.find_opening")
 def find_opening(move_stack: list = None):
-    n_plys = len(move_stack)
-    for n_ply_back in range(n_plys):
-        san = chess.Board().variation_san(move_stack[:(n_plys-n_ply_back)]) + " *"
-        if san in opening_book_dict.keys():
-            return opening_book_dict[san]
\ No newline at end of file
+    tracker = opening_tracker()
+    for move in move_stack:
+        tracker.push(move)
+    return tracker.opening
\ No newline at end of file
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+from ._tournament import time_control, engine_player, adjudication_rules, sample_openings, play_game, run_tournament
+
+__all__ = ["time_control", "engine_player", "adjudication_rules", "sample_openings", "play_game", "run_tournament",]
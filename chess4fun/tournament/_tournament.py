@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+# Author: Tank Overlord <TankOverLord88@gmail.com>
+#
+# License: LGPL-3.0
+
+import asyncio
+import concurrent.futures
+import datetime
+import itertools
+import os
+import random
+import time
+
+import chess
+import chess.engine
+import chess.pgn
+
+from ..analysis import engine_session
+from ..data import pgn_writer
+from ..opening._opening import load_ECO_book_dict, iter_ECO_lines
+
+CLOCK_MARGIN = 0.1 # sec; process and thread hand-over time not charged to the engine
+HANG_TIMEOUT = 30.0 # sec beyond its budget after which a silent engine counts as crashed
+MAX_MOVE_TIME = 120.0 # sec a depth or nodes search may take before its engine counts as hung
+
+class time_control(object):
+    """
+    A per-move search budget: a clock (``base`` seconds plus ``increment`` per move), or a fixed
+    ``movetime``, ``depth`` or ``nodes`` per move. :meth:`parse` reads ``"60+0.6"``, ``"60"``,
+    ``"movetime=0.5"``, ``"depth=12"`` and ``"nodes=100000"``. A ``depth`` or ``nodes`` search has no
+    time budget: an engine still searching after ``max_move_time`` seconds counts as hung.
+    """
+    def __init__(self, base: float = None, increment: float = 0.0, movetime: float = None, depth: int = None, nodes: int = None,
+                 max_move_time: float = MAX_MOVE_TIME):
+        self.base = base
+        self.increment = increment
+        self.movetime = movetime
+        self.depth = depth
+        self.nodes = nodes
+        self.max_move_time = max_move_time
+
+    @classmethod
+    def parse(cls, text: str = None, max_move_time: float = MAX_MOVE_TIME) -> "time_control":
+        if "=" in text:
+            key, value = text.split("=", 1)
+            if key == "movetime":
+                return cls(movetime=float(value), max_move_time=max_move_time)
+            if key in ("depth", "nodes"):
+                return cls(**{key: int(value)}, max_move_time=max_move_time)
+            raise ValueError(f"unknown time control: {text}")
+        base, _, increment = text.partition("+")
+        return cls(base=float(base), increment=float(increment or 0.0), max_move_time=max_move_time)
+
+    def __str__(self) -> str:
+        if self.base is not None:
+            return f"{self.base:g}+{self.increment:g}"
+        if self.movetime is not None:
+            return f"movetime={self.movetime:g}"
+        return f"depth={self.depth}" if self.depth is not None else f"nodes={self.nodes}"
+
+DEFAULT_TIME_CONTROL = time_control(movetime=0.1)
+
+
+class engine_player(object):
+    """A tournament participant: an engine executable with its UCI options and time control."""
+    def __init__(self, name: str = None, command: str = None, options: dict = None, time_control: time_control = None):
+        self.name = name or os.path.basename(command)
+        self.command = command
+        self.options = options or {}
+        self.time_control = time_control or DEFAULT_TIME_CONTROL
+
+
+class adjudication_rules(object):
+    """
+    When to end a game early. A side resigns when, for ``resign_moves`` moves in a row, its engine
+    scores the position at ``-resign_score`` cp or worse and the opponent's engine agrees. A draw is
+    adjudicated from ply ``draw_min_ply`` on, once both engines have scored within ``draw_score`` cp
+    of 0 for ``draw_moves`` moves each. Games longer than ``max_plies`` are drawn. None disables a rule.
+    """
+    def __init__(self, resign_score: int = 700, resign_moves: int = 3, draw_score: int = 10, draw_moves: int = 8,
+                 draw_min_ply: int = 80, max_plies: int = 500):
+        self.resign_score = resign_score
+        self.resign_moves = resign_moves
+        self.draw_score = draw_score
+        self.draw_moves = draw_moves
+        self.draw_min_ply = draw_min_ply
+        self.max_plies = max_plies
+
+
+def sample_openings(n_openings: int = None, min_plies: int = 6, seed: int = None) -> list:
+    """Returns ``n_openings`` distinct ECO lines of at least ``min_plies`` plies, as ``(sans, opening)`` pairs, drawn at random."""
+    lines = [(list(sans), opening) for _, sans, opening in iter_ECO_lines(load_ECO_book_dict()) if len(sans) >= min_plies]
+    return random.Random(seed).sample(lines, min(n_openings, len(lines)))
+
+# the engines of a worker process, kept alive from one game to the next
+_worker_sessions = {}
+
+def _session(player: engine_player = None) -> engine_session:
+    key = (player.command, tuple(sorted(player.options.items())))
+    if key not in _worker_sessions:
+        _worker_sessions[key] = engine_session(name=f"chess4fun-{player.name}", command=player.command, options=player.options)
+    return _worker_sessions[key]
+
+def _drop_session(player: engine_player = None) -> None:
+    session = _worker_sessions.pop((player.command, tuple(sorted(player.options.items()))), None)
+    if session is not None:
+        session.close()
+
+def _limit(players: dict = None, turn: chess.Color = None, clocks: dict = None) -> tuple:
+    # returns (limit, timeout) for the side to move
+    tc = players[turn].time_control
+    if tc.base is not None:
+        limit = chess.engine.Limit(white_clock=clocks[chess.WHITE], black_clock=clocks[chess.BLACK],
+                                   white_inc=players[chess.WHITE].time_control.increment, black_inc=players[chess.BLACK].time_control.increment)
+        return limit, clocks[turn] + HANG_TIMEOUT
+    if tc.movetime is not None:
+        return chess.engine.Limit(time=tc.movetime), tc.movetime + HANG_TIMEOUT
+    return chess.engine.Limit(depth=tc.depth, nodes=tc.nodes), tc.max_move_time
+
+async def _play(players: dict = None, board: chess.Board = None, adjudication: adjudication_rules = None) -> tuple:
+    """Plays ``board`` out; returns ``(result, termination)``. Engine failures propagate."""
+    clocks = {color: players[color].time_control.base for color in chess.COLORS}
+    losing = {color: 0 for color in chess.COLORS}
+    winning = {color: 0 for color in chess.COLORS}
+    drawish = 0
+    game = object() # one engine "game" per game: ucinewgame is sent once
+    while True:
+        outcome = board.outcome(claim_draw=True)
+        if outcome is not None:
+            return outcome.result(), "normal"
+        if adjudication.max_plies is not None and board.ply() >= adjudication.max_plies:
+            return "1/2-1/2", "adjudication"
+        turn = board.turn
+        limit, timeout = _limit(players, turn, clocks)
+        start = time.perf_counter()
+        result = await asyncio.wait_for(_session(players[turn]).play(board, limit, info=chess.engine.INFO_SCORE, game=game), timeout)
+        if clocks[turn] is not None:
+            clocks[turn] -= time.perf_counter() - start
+            if clocks[turn] < -CLOCK_MARGIN:
+                return ("0-1" if turn == chess.WHITE else "1-0"), "time forfeit"
+            clocks[turn] += players[turn].time_control.increment
+        if result.move is None:
+            raise chess.engine.EngineError(f"{players[turn].name} returned no move")
+        board.push(result.move)
+        if "score" not in result.info:
+            continue
+        cp = result.info["score"].pov(turn).score(mate_score=100000)
+        if adjudication.resign_score is not None:
+            losing[turn] = losing[turn] + 1 if cp <= -adjudication.resign_score else 0
+            winning[turn] = winning[turn] + 1 if cp >= adjudication.resign_score else 0
+            if losing[turn] >= adjudication.resign_moves and winning[not turn] >= adjudication.resign_moves:
+                return ("0-1" if turn == chess.WHITE else "1-0"), "adjudication"
+        if adjudication.draw_score is not None and board.ply() >= adjudication.draw_min_ply:
+            drawish = drawish + 1 if abs(cp) <= adjudication.draw_score else 0
+            if drawish >= 2 * adjudication.draw_moves:
+                return "1/2-1/2", "adjudication"
+
+def play_game(white: engine_player = None, black: engine_player = None, opening: tuple = None, adjudication: adjudication_rules = None,
+              max_retries: int = 2, headers: dict = None) -> str:
+    """
+    Plays one game from an opening line ``(sans, opening)`` (or the initial position) and returns its PGN.
+    If an engine crashes, hangs or misbehaves, it is restarted and the game replayed, up to ``max_retries``
+    times; after that the game is recorded unfinished (``*``).
+    """
+    adjudication = adjudication or adjudication_rules()
+    players = {chess.WHITE: white, chess.BLACK: black}
+    sans, eco = opening or ([], None)
+    for attempt in range(max_retries + 1):
+        board = chess.Board()
+        for san in sans:
+            board.push_san(san)
+        try:
+            result, termination = asyncio.run(_play(players, board, adjudication))
+            break
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError, OSError) as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            for player in players.values():
+                _drop_session(player)
+    else:
+        result, termination = "*", f"abandoned ({error})"
+    game = chess.pgn.Game.from_board(board)
+    game.headers.update({"Event": "chess4fun tournament", "Site": "?", "Date": datetime.date.today().strftime("%Y.%m.%d"),
+                         "White": white.name, "Black": black.name, "Result": result, "Termination": termination,
+                         "WhiteTimeControl": str(white.time_control), "BlackTimeControl": str(black.time_control)})
+    if eco is not None:
+        game.headers.update({"ECO": eco["ECO"], "Opening": eco["Variation"]})
+    game.headers.update(headers or {})
+    return str(game)
+
+def _job_result(job: dict = None, pgn: str = None) -> dict:
+    return {"round": job["round"], "white": job["white"].name, "black": job["black"].name, "pgn": pgn,
+            "result": pgn.split('[Result "', 1)[1].split('"', 1)[0]}
+
+def _play_job(job: dict = None) -> dict:
+    # runs in a worker process
+    return _job_result(job, play_game(job["white"], job["black"], opening=job["opening"], adjudication=job["adjudication"],
+                                      max_retries=job["max_retries"], headers={"Round": str(job["round"])}))
+
+def _abandoned_job(job: dict = None, reason: str = None) -> dict:
+    game = chess.pgn.Game()
+    game.headers.update({"Event": "chess4fun tournament", "Round": str(job["round"]), "White": job["white"].name, "Black": job["black"].name,
+                         "Result": "*", "Termination": f"abandoned ({reason})"})
+    return _job_result(job, str(game))
+
+def _finished_job(future: concurrent.futures.Future = None, job: dict = None) -> dict:
+    # the result of a game, or the game abandoned if its worker failed to play it
+    try:
+        return future.result()
+    except Exception as exc:
+        return _abandoned_job(job, f"{type(exc).__name__}: {exc}")
+
+def _schedule(players: list = None, n_games: int = None, openings: list = None, adjudication: adjudication_rules = None, max_retries: int = 2):
+    # every pair plays n_games; each opening is played twice, with colors swapped
+    n_round = 0
+    for first, second in itertools.combinations(players, 2):
+        for i in range(n_games):
+            white, black = (first, second) if i % 2 == 0 else (second, first)
+            n_round += 1
+            yield {"round": n_round, "white": white, "black": black, "opening": openings[(i // 2) % len(openings)] if openings else None,
+                   "adjudication": adjudication, "max_retries": max_retries}
+
+def run_tournament(players: list = None, n_games: int = 2, output_path: str = None, openings: list = None, adjudication: adjudication_rules = None,
+                   n_workers: int = None, max_retries: int = 2, max_pending: int = None, callback = None) -> dict:
+    """
+    Plays a round robin of ``n_games`` games per pair of ``players`` over a pool of ``n_workers``
+    processes (default: one per CPU), each process keeping its engines alive from game to game.
+    Games are appended to ``output_path`` as they finish, and ``callback(job_result)`` (if given) is
+    called for each. At most ``max_pending`` games (default: twice the number of workers) are queued
+    at a time. If a worker process dies, the whole pool goes with it: the pool is restarted and
+    every game in flight replayed, each up to ``max_retries`` times before it is recorded unfinished.
+    A game its worker fails to play for any other reason is recorded unfinished at once, with the error.
+    Returns the standings: ``{name: {"wins", "draws", "losses", "unfinished"}}``.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * n_workers
+    standings = {player.name: {"wins": 0, "draws": 0, "losses": 0, "unfinished": 0} for player in players}
+    jobs = _schedule(players, n_games, openings, adjudication or adjudication_rules(), max_retries)
+    pending, crashes = {}, {}
+
+    def record(result: dict = None) -> None:
+        writer.write(result["pgn"])
+        if result["result"] == "1/2-1/2":
+            standings[result["white"]]["draws"] += 1
+            standings[result["black"]]["draws"] += 1
+        elif result["result"] in ("1-0", "0-1"):
+            winner, loser = (result["white"], result["black"]) if result["result"] == "1-0" else (result["black"], result["white"])
+            standings[winner]["wins"] += 1
+            standings[loser]["losses"] += 1
+        else:
+            standings[result["white"]]["unfinished"] += 1
+            standings[result["black"]]["unfinished"] += 1
+        if callback is not None:
+            callback(result)
+
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_workers)
+    try:
+        with pgn_writer(output_path) as writer:
+            while True:
+                while len(pending) < max_pending:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    pending[executor.submit(_play_job, job)] = job
+                if not pending:
+                    break
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    if isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool):
+                        broken = True
+                    else:
+                        record(_finished_job(future, pending.pop(future)))
+                if not broken:
+                    continue
+                # a worker process died, and the pool with it: every other future of the pool fails (or has
+                # finished) too; the games in flight are replayed on a fresh pool, or abandoned past max_retries
+                concurrent.futures.wait(pending)
+                replay = []
+                for future, job in pending.items():
+                    if not isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool):
+                        record(_finished_job(future, job))
+                        continue
+                    crashes[job["round"]] = crashes.get(job["round"], 0) + 1
+                    if crashes[job["round"]] <= max_retries:
+                        replay.append(job)
+                    else:
+                        record(_abandoned_job(job, "worker process died"))
+                executor.shutdown(wait=False)
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_workers)
+                pending = {executor.submit(_play_job, job): job for job in replay}
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+    return standings
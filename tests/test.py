@@ -5,3 +5,858 @@
 # License: LGPL-3.0
 
 import chess4fun
+
+def test_engine_session():
+    import asyncio, pathlib, sys
+    import chess, chess.engine
+    from chess4fun.analysis import engine_session
+    stub_engine = [sys.executable, str(pathlib.Path(__file__).parent.parent / "benchmarks" / "stub_uci.py")]
+    session, limit = engine_session(command=stub_engine, options={"Hash": 16}), chess.engine.Limit(depth=1)
+    try:
+        asyncio.run(session.analyse(chess.Board(), limit))
+        engine, configured = session._engine, []
+        configure = engine.configure
+        async def counting_configure(options: dict = None):
+            configured.append(dict(options))
+            await configure(options)
+        engine.configure = counting_configure
+        # the engine lives on across asyncio.run() calls; options already applied are not sent again
+        for _ in range(3):
+            asyncio.run(session.analyse(chess.Board(), limit))
+        assert session._engine is engine and configured == []
+        asyncio.run(session.analyse(chess.Board(), limit, options={"Hash": 32, "Threads": 1}))
+        assert session._engine is engine and configured == [{"Hash": 32, "Threads": 1}]
+        asyncio.run(session.analyse(chess.Board(), limit, options={"Hash": 32, "Threads": 1}))
+        assert len(configured) == 1
+        # an option left out is set back to the engine's default
+        asyncio.run(session.analyse(chess.Board(), limit, options={"Hash": 32, "Threads": 1, "SyzygyPath": "/tmp"}))
+        asyncio.run(session.analyse(chess.Board(), limit, options={"Hash": 32}))
+        assert configured[1:] == [{"SyzygyPath": "/tmp"}, {"Threads": 1, "SyzygyPath": "<empty>"}]
+        asyncio.run(session.analyse(chess.Board(), limit, options={"Hash": 32, "SyzygyPath": "/tmp"}))
+        assert configured[-1] == {"SyzygyPath": "/tmp"} and session._applied_options == {"Hash": 32, "SyzygyPath": "/tmp"}
+    finally:
+        session.close()
+    assert not session.is_running
+
+def test_evaluate_positions():
+    import asyncio, pathlib, sys
+    import chess, chess.engine
+    from chess4fun._preferences import preferences
+    from chess4fun.analysis import engine_pool, evaluate_positions
+    board = chess.Board()
+    boards = [board.copy()]
+    for move in ("e2e4", "e7e5", "g1f3", "b8c6", "f1b5", "a7a6", "b5a4"):
+        board.push_uci(move)
+        boards.append(board.copy())
+    limit = chess.engine.Limit(depth=1)
+    async def evaluate(boards = None, pool = None, **kwargs):
+        return [(index, info) async for index, info in evaluate_positions(boards, limit=limit, pool=pool, **kwargs)]
+    saved = {key: preferences[key] for key in ('evaluation_cache', 'syzygy_path')}
+    preferences.update(evaluation_cache=False, syzygy_path=None)
+    # against the stub engine of the benchmarks: the hash budget is split among the workers
+    pool = engine_pool(command=[sys.executable, str(pathlib.Path(__file__).parent.parent / "benchmarks" / "stub_uci.py")], n_workers=2, hash_size=64)
+    try:
+        assert len(pool.sessions) == 2 and all(session.options["Hash"] == 32 for session in pool.sessions)
+        results = asyncio.run(evaluate(boards, pool))
+        assert [index for index, _ in results] == list(range(len(boards))) and all(info["score"] is not None for _, info in results)
+        assert all(session.is_running for session in pool.sessions) # both workers took positions
+    finally:
+        pool.close()
+    class scripted_session(object):
+        # the earlier in the game, the slower the search
+        command = "scripted"
+        async def analyse(self, board = None, limit = None, **kwargs):
+            await asyncio.sleep(0.01 * (len(boards) - board.ply()))
+            return {"depth": 1, "ply": board.ply()}
+    pool = engine_pool(command="scripted", n_workers=3)
+    pool.sessions = [scripted_session() for _ in range(3)]
+    try:
+        # in input order, whatever the completion order; otherwise as they complete
+        results = asyncio.run(evaluate(boards, pool, ordered=True))
+        assert [index for index, _ in results] == list(range(len(boards))) and all(info["ply"] == index for index, info in results)
+        results = asyncio.run(evaluate(boards, pool, ordered=False))
+        assert sorted(index for index, _ in results) == list(range(len(boards))) and [index for index, _ in results] != list(range(len(boards)))
+        # an endless input is read no further ahead of the consumer than max_pending
+        pulled = []
+        def endless():
+            while True:
+                pulled.append(None)
+                yield boards[len(pulled) % len(boards)]
+        async def consume(n: int = None, max_pending: int = None):
+            seen = 0
+            async for index, info in evaluate_positions(endless(), limit=limit, pool=pool, max_pending=max_pending):
+                assert len(pulled) <= index + max_pending
+                seen += 1
+                if seen == n:
+                    break
+        asyncio.run(consume(20, max_pending=4))
+        assert 20 <= len(pulled) <= 24
+    finally:
+        preferences.update(saved)
+
+def test_evaluation_cache():
+    import pathlib, tempfile
+    import chess, chess.engine, chess.polyglot
+    from chess4fun.analysis import evaluation_cache
+    board = chess.Board()
+    board.push_san("e4")
+    info = {"score": chess.engine.PovScore(chess.engine.Cp(-30), chess.BLACK), "depth": 20, "nodes": 10**6, "time": 1.0,
+            "pv": [chess.Move.from_uci("c7c5"), chess.Move.from_uci("g1f3")]}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = evaluation_cache(path=pathlib.Path(tmp_dir) / "cache.sqlite3")
+        cache.put(board, "engine", info)
+        assert cache.get(board, chess.engine.Limit(depth=25), "engine") is None
+        assert cache.get(board, chess.engine.Limit(depth=18), "other engine") is None
+        cache.close()
+        cache = evaluation_cache(path=pathlib.Path(tmp_dir) / "cache.sqlite3")
+        cached = cache.get(board, chess.engine.Limit(depth=18), "engine")
+        assert cached["score"] == info["score"] and cached["pv"] == info["pv"]
+        # a shallower result never replaces a deeper one, in memory or on disk
+        cache.max_entries = 1
+        cache.put(chess.Board(), "engine", {**info, "depth": 30})
+        cache.put(board, "engine", {**info, "depth": 5})
+        cache.close()
+        cache = evaluation_cache(path=pathlib.Path(tmp_dir) / "cache.sqlite3")
+        assert cache.get(board, chess.engine.Limit(depth=20), "engine")["depth"] == 20
+        # a shallower MultiPV result is kept next to a deeper single line, until a deeper one with as many lines comes
+        lines = [{**info, "depth": 12}, {**info, "depth": 12, "score": chess.engine.PovScore(chess.engine.Cp(-50), chess.BLACK)}]
+        cache.put(board, "engine", lines)
+        cache.close()
+        cache = evaluation_cache(path=pathlib.Path(tmp_dir) / "cache.sqlite3")
+        assert [cached["score"] for cached in cache.get(board, chess.engine.Limit(depth=10), "engine", multipv=2)] == [line["score"] for line in lines]
+        assert cache.get(board, chess.engine.Limit(depth=20), "engine", multipv=2) is None
+        assert cache.get(board, chess.engine.Limit(depth=10), "engine")["depth"] == 20
+        cache.put(board, "engine", [{**line, "depth": 22} for line in lines])
+        assert cache.get(board, chess.engine.Limit(depth=10), "engine")["depth"] == 22 and len(cache._lookup("engine", chess.polyglot.zobrist_hash(board))) == 1
+        cache.close()
+
+def test_evaluation_cache_command_line():
+    import asyncio, pathlib, sys, tempfile
+    import chess, chess.engine
+    from chess4fun.analysis import evaluation_cache, engine_session, evaluate_position
+    from chess4fun.analysis._cache import engine_identity
+    stub_engine = [sys.executable, str(pathlib.Path(__file__).parent.parent / "benchmarks" / "stub_uci.py")]
+    assert stub_engine[1] + "@" in engine_identity(stub_engine) # each file of the command line with its modification time
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = evaluation_cache(path=pathlib.Path(tmp_dir) / "cache.sqlite3")
+        session = engine_session(command=stub_engine) # an engine started by a command line, not an executable path
+        try:
+            limit = chess.engine.Limit(depth=1)
+            info = asyncio.run(evaluate_position(chess.Board(), session=session, limit=limit, cache=cache))
+            assert cache.get(chess.Board(), limit, engine_identity(stub_engine))["pv"] == info["pv"]
+        finally:
+            session.close()
+            cache.close()
+
+def test_find_opening():
+    import chess
+    from chess4fun.opening import find_opening, opening_tracker
+    ruy_lopez, transposed = chess.Board(), chess.Board()
+    for san in ["e4", "e5", "Nf3", "Nc6", "Bb5"]:
+        ruy_lopez.push_san(san)
+    for san in ["Nf3", "Nc6", "e4", "e5", "Bb5"]:
+        transposed.push_san(san)
+    assert find_opening(ruy_lopez.move_stack)["ECO"] == "C60a"
+    assert find_opening(transposed.move_stack)["ECO"] == "C60a"
+    tracker = opening_tracker()
+    for move in ruy_lopez.move_stack:
+        tracker.push(move)
+    tracker.pop()
+    assert tracker.opening == find_opening(ruy_lopez.move_stack[:-1])
+    assert tracker.variation_san() == chess.Board().variation_san(ruy_lopez.move_stack[:-1])
+    assert tracker.opening_at(2) == find_opening(ruy_lopez.move_stack[:2]) and tracker.variation_san(2) == "1. e4 e5"
+
+def test_compiled_opening_book():
+    import chess, chess.polyglot
+    from chess4fun.opening._opening import load_ECO_book_dict, iter_ECO_lines, load_opening_index
+    # the memory-mapped book holds what the pickled ECO lines say, position by position
+    expected = {}
+    for board, sans, opening in iter_ECO_lines(load_ECO_book_dict()):
+        if sans:
+            expected.setdefault(chess.polyglot.zobrist_hash(board), opening)
+    book = load_opening_index()
+    assert len(book) == len(expected)
+    assert all(book.get(key) == opening for key, opening in expected.items())
+    assert book.get(chess.polyglot.zobrist_hash(chess.Board())) is None and chess.polyglot.zobrist_hash(chess.Board()) not in book
+    assert book.get(max(expected) + 1, "missing") == "missing" and book.get(min(expected) - 1) is None
+
+def test_book_moves():
+    import chess
+    from chess4fun.opening import book_moves, choose_book_move
+    board = chess.Board()
+    for san in ["e4", "e5", "Nf3", "Nc6", "Bb5", "Nf6"]:
+        board.push_san(san)
+    entries = book_moves(board)
+    assert entries[0].move == chess.Move.from_uci("e1g1") # castling is decoded from polyglot
+    assert choose_book_move(board) == entries[0].move
+    assert choose_book_move(chess.Board("8/8/4k3/8/8/4K3/8/8 w - - 0 1")) is None
+
+def test_headless_imports():
+    import subprocess, sys
+    code = "import sys, chess4fun.analysis, chess4fun.opening; print(sorted({m.split('.')[0] for m in sys.modules} & {'PySide2', 'pygame', 'matplotlib'}))"
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip() == "[]"
+
+def test_time_control():
+    from chess4fun.tournament import time_control
+    tc = time_control.parse("60+0.6")
+    assert (tc.base, tc.increment) == (60.0, 0.6) and str(tc) == "60+0.6"
+    assert time_control.parse("movetime=0.5").movetime == 0.5
+    assert time_control.parse("depth=12").depth == 12
+    assert str(time_control.parse("nodes=1000")) == "nodes=1000"
+    # a depth or nodes search has no budget, but a hung engine is still given up on
+    from chess4fun.tournament._tournament import engine_player, _limit
+    import chess
+    players = {color: engine_player(name="stub", command="stub", time_control=time_control.parse("depth=12", max_move_time=5.0)) for color in chess.COLORS}
+    limit, timeout = _limit(players, chess.WHITE, {chess.WHITE: None, chess.BLACK: None})
+    assert limit.depth == 12 and timeout == 5.0
+
+def test_tournament_worker_crash():
+    import pathlib, stat, sys, tempfile
+    from chess4fun.tournament import engine_player, run_tournament
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # an "engine" killing the worker process that starts it
+        crasher = pathlib.Path(tmp_dir) / "crasher.py"
+        crasher.write_text(f"#!{sys.executable}\nimport os, signal\nos.kill(os.getppid(), signal.SIGKILL)\n")
+        crasher.chmod(crasher.stat().st_mode | stat.S_IEXEC)
+        players = [engine_player(name=name, command=str(crasher)) for name in ("a", "b")]
+        output_path = pathlib.Path(tmp_dir) / "games.pgn"
+        for max_retries in (0, 1):
+            results = []
+            standings = run_tournament(players, n_games=4, output_path=str(output_path), n_workers=2, max_retries=max_retries, callback=results.append)
+            assert sorted(result["round"] for result in results) == [1, 2, 3, 4]
+            assert all(result["result"] == "*" for result in results) and standings["a"]["unfinished"] == 4
+        assert output_path.read_text().count("[Termination \"abandoned (worker process died)\"]") == 8
+
+def test_tournament_worker_error():
+    import pathlib, tempfile
+    from chess4fun.tournament import engine_player, run_tournament
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = pathlib.Path(tmp_dir) / "games.pgn"
+        # options the worker cannot use (unhashable), or that cannot even be sent to it
+        for options, errors in (({"Hash": [16]}, ("TypeError",)), ({"Hash": lambda: 16}, ("PicklingError", "AttributeError"))):
+            players = [engine_player(name=name, command="engine", options=options) for name in ("a", "b")]
+            results = []
+            standings = run_tournament(players, n_games=3, output_path=str(output_path), n_workers=2, callback=results.append)
+            assert sorted(result["round"] for result in results) == [1, 2, 3] and standings["b"]["unfinished"] == 3
+            assert all(any(f'[Termination "abandoned ({error}: ' in result["pgn"] for error in errors) for result in results)
+
+def test_search_budget():
+    import chess
+    from chess4fun.analysis import search_budget
+    board = chess.Board()
+    assert search_budget(time=5.0).allocate(board) == 5.0
+    assert search_budget(time=5.0, increment=1.0).allocate(board, remaining=60.0) < 5.0 # a share of the clock
+    assert search_budget(moves_to_go=1).allocate(board, remaining=10.0) <= 4.0 # never most of the clock
+    assert search_budget(depth=12).limit(board).depth == 12
+
+def test_search_move_resolution():
+    import asyncio
+    import chess, chess.engine
+    from chess4fun.analysis import search_budget
+    from chess4fun.analysis._analysis import search_move
+    board = chess.Board("r1bq1rk1/pp2bppp/2n1pn2/2pp4/3P4/2PBPN2/PP1N1PPP/R1BQ1RK1 w - - 0 8")
+    e3e4, d1e2 = chess.Move.from_uci("e3e4"), chess.Move.from_uci("d1e2")
+    class scripted_session(object):
+        # replays info lines, counting those read
+        command = "scripted"
+        def __init__(self, infos: list = None):
+            self.infos, self.n_read = infos, 0
+        async def analysis(self, board = None, limit = None, **kwargs):
+            for info in self.infos:
+                self.n_read += 1
+                yield info
+    def info(depth: int = None, score = None, move: chess.Move = None, **bound):
+        return {"depth": depth, "score": chess.engine.PovScore(score, chess.WHITE), "pv": [move], **bound}
+    budget = search_budget(depth=10, stable_depth=50)
+    # a mate bound from an aspiration window does not end the search; an exact mate ends it once its depth is done
+    session = scripted_session([info(1, chess.engine.Cp(30), e3e4), info(2, chess.engine.Mate(3), d1e2, lowerbound=True),
+                                info(2, chess.engine.Cp(25), e3e4), info(3, chess.engine.Mate(3), d1e2), info(3, chess.engine.Mate(2), d1e2),
+                                info(4, chess.engine.Mate(2), d1e2), info(5, chess.engine.Cp(0), e3e4)])
+    result = asyncio.run(search_move(board, session=session, budget=budget))
+    assert result.move == d1e2 and result.info["score"].white() == chess.engine.Mate(2) and session.n_read == 6
+
+def test_stream_early_stop_cached():
+    import asyncio, pathlib, tempfile
+    import chess, chess.engine
+    from chess4fun.analysis import evaluation_cache, evaluate_position_stream
+    board, move = chess.Board(), chess.Move.from_uci("e2e4")
+    class scripted_session(object):
+        # an engine as stable as can be, 50 ms per depth
+        command = "scripted"
+        n_searches = 0
+        async def analysis(self, board = None, limit = None, **kwargs):
+            self.n_searches += 1
+            for depth in range(1, 30):
+                yield {"depth": depth, "score": chess.engine.PovScore(chess.engine.Cp(20), chess.WHITE), "pv": [move], "time": 0.05 * depth, "nodes": 1000 * depth}
+    async def evaluate(session = None, cache = None):
+        return [info async for info in evaluate_position_stream(board, session=session, limit=chess.engine.Limit(time=5.0), cache=cache)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache, session = evaluation_cache(path=pathlib.Path(tmp_dir) / "cache.sqlite3"), scripted_session()
+        try:
+            assert asyncio.run(evaluate(session, cache))[-1]["depth"] < 29 # stopped early, well within the 5 s
+            assert len(asyncio.run(evaluate(session, cache))) == 1 and session.n_searches == 1 # then served from the cache
+        finally:
+            cache.close()
+
+def test_time_limited_evaluation_cached():
+    import asyncio, pathlib, tempfile
+    import chess, chess.engine
+    from chess4fun.analysis import evaluation_cache, evaluate_position
+    board = chess.Board()
+    class scripted_session(object):
+        # stops a little short of its movetime, as engines do
+        command = "scripted"
+        n_searches = 0
+        async def analyse(self, board = None, limit = None, **kwargs):
+            self.n_searches += 1
+            return {"depth": 9, "score": chess.engine.PovScore(chess.engine.Cp(20), chess.WHITE), "pv": [chess.Move.from_uci("e2e4")],
+                    "time": 0.9 * limit.time, "nodes": 1000}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache, session = evaluation_cache(path=pathlib.Path(tmp_dir) / "cache.sqlite3"), scripted_session()
+        try:
+            first = asyncio.run(evaluate_position(board, session=session, limit=chess.engine.Limit(time=1.0), cache=cache))
+            second = asyncio.run(evaluate_position(board, session=session, limit=chess.engine.Limit(time=1.0), cache=cache))
+            assert second["score"] == first["score"] and second["time"] == first["time"] == 0.9 and session.n_searches == 1
+            asyncio.run(evaluate_position(board, session=session, limit=chess.engine.Limit(time=2.0), cache=cache))
+            assert session.n_searches == 2 # a longer search is not served by a shorter one
+        finally:
+            cache.close()
+
+def test_multipv():
+    import asyncio, pathlib, sys, tempfile
+    import chess, chess.engine
+    from chess4fun.analysis import engine_session, evaluation_cache, evaluate_position
+    stub = pathlib.Path(__file__).parent.parent / "benchmarks" / "stub_uci.py"
+    board = chess.Board("7k/8/8/8/8/8/6PP/7K w - - 0 1") # 5 legal moves
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the stub engine, logging the commands it is sent
+        log, wrapper = pathlib.Path(tmp_dir) / "commands.log", pathlib.Path(tmp_dir) / "engine.py"
+        wrapper.write_text("import runpy, sys\n"
+                           f"log = open({str(log)!r}, 'a')\n"
+                           "def commands():\n"
+                           "    for line in sys.__stdin__:\n"
+                           "        log.write(line)\n"
+                           "        log.flush()\n"
+                           "        yield line\n"
+                           "sys.stdin = commands()\n"
+                           f"runpy.run_path({str(stub)!r}, run_name='__main__')\n")
+        session, limit = engine_session(command=[sys.executable, str(wrapper)]), chess.engine.Limit(depth=1)
+        cache = evaluation_cache(path=pathlib.Path(tmp_dir) / "cache.sqlite3")
+        def evaluate(multipv: int = None, board: chess.Board = board):
+            return asyncio.run(evaluate_position(board, session=session, limit=limit, multipv=multipv, cache=cache))
+        def sent(command: str = None) -> list:
+            return [line.strip() for line in log.read_text().splitlines() if line.startswith(command)]
+        try:
+            infos = evaluate(3)
+            assert len(infos) == 3 and [info["multipv"] for info in infos] == [1, 2, 3]
+            assert [info["score"].white() for info in infos] == [chess.engine.Cp(20), chess.engine.Cp(10), chess.engine.Cp(0)] # best first
+            assert len({info["pv"][0] for info in infos}) == 3 and sent("setoption name MultiPV") == ["setoption name MultiPV value 3"]
+            # a single line afterwards: the option is set back for that search
+            assert isinstance(evaluate(None, chess.Board()), dict) and sent("setoption name MultiPV")[-1] == "setoption name MultiPV value 1"
+            n_searches = len(sent("go"))
+            # served from the cache for as many lines or fewer, searched again for more (at most as many as legal moves)
+            assert [info["pv"] for info in evaluate(2)] == [info["pv"] for info in infos[:2]] and len(sent("go")) == n_searches
+            assert len(evaluate(9)) == 5 and len(sent("go")) == n_searches + 1 and sent("setoption name MultiPV")[-1] == "setoption name MultiPV value 5"
+            assert len(evaluate(4)) == 4 and len(sent("go")) == n_searches + 1
+        finally:
+            session.close()
+            cache.close()
+
+def test_syzygy_tablebase():
+    import tempfile
+    import chess
+    from chess4fun.endgame import syzygy_tablebase
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tablebase = syzygy_tablebase(tmp_dir) # no tables: nothing is covered
+        board = chess.Board("8/8/4k3/8/8/4K3/4Q3/8 w - - 0 1")
+        assert not tablebase.covers(board)
+        assert tablebase.probe(board) is None and tablebase.infos(board) is None
+        tablebase.close()
+
+def test_syzygy_ranking():
+    import asyncio, pathlib, tempfile
+    import chess, chess.engine
+    from chess4fun._preferences import preferences
+    from chess4fun.analysis import evaluate_position
+    from chess4fun.endgame import default_tablebase, probe_position, tablebase_move
+    from chess4fun.endgame._syzygy import TB_SCORE
+    board = chess.Board("7k/8/5K2/8/8/8/P7/6Q1 w - - 0 1")
+    class scripted_tables(object):
+        # Black to move after each White move: mated, stalemated, or lost in a number of plies to zeroing
+        wdl = {"KQPvK": None}
+        def probe_wdl(self, board = None):
+            return self.probe_dtz(board) and -2
+        def probe_dtz(self, board = None):
+            if board.is_checkmate():
+                return -1
+            if board.is_stalemate():
+                return 0
+            if not board.pawns & chess.BB_RANK_2: # the pawn has moved
+                return -30
+            return -5 if board.queens & chess.BB_H2 else -12
+        def close(self):
+            pass
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in ("KQPvK.rtbw", "KQPvK.rtbz"):
+            (pathlib.Path(tmp_dir) / name).write_bytes(b"")
+        saved = preferences['syzygy_path']
+        preferences['syzygy_path'] = tmp_dir
+        try:
+            tablebase = default_tablebase()
+            tablebase._tablebase = scripted_tables()
+            assert tablebase.max_pieces == 4 and not tablebase.covers(chess.Board())
+            # wins first: the mate, then zeroing moves, then the shortest distance to zeroing; draws last
+            moves = tablebase.best_moves(board)
+            assert [move.uci() for move, _ in moves[:4]] == ["g1g7", "a2a3", "a2a4", "g1h2"]
+            assert [score for _, score in moves[:4]] == [TB_SCORE - 1, TB_SCORE - 30, TB_SCORE - 30, TB_SCORE - 5]
+            assert moves[-1] == (chess.Move.from_uci("g1g6"), 0) and len(moves) == board.legal_moves.count() # stalemate
+            assert tablebase_move(board).move == chess.Move.from_uci("g1g7")
+            infos = probe_position(board, multipv=3)
+            assert [info["pv"][0] for info in infos] == [move for move, _ in moves[:3]] and all(info["string"] == "tablebase" for info in infos)
+            info = asyncio.run(evaluate_position(board)) # answered without any engine
+            assert info["string"] == "tablebase" and info["score"].white() == chess.engine.Cp(TB_SCORE - 1)
+        finally:
+            preferences['syzygy_path'] = saved
+            default_tablebase()
+
+def test_syzygy_open_tables():
+    import pathlib, tempfile
+    import chess, chess.syzygy
+    from chess4fun.endgame import syzygy_tablebase
+    # the tables are empty files: their probes are scripted, but opened and closed by python-chess's own LRU
+    wdl_probe, dtz_probe, close = chess.syzygy.WdlTable.probe_wdl_table, chess.syzygy.DtzTable.probe_dtz_table, chess.syzygy.Table.close
+    closed = []
+    chess.syzygy.WdlTable.probe_wdl_table = lambda table, board: 2 if board.turn == chess.WHITE else -2
+    chess.syzygy.DtzTable.probe_dtz_table = lambda table, board, wdl: (7, 1)
+    chess.syzygy.Table.close = lambda table: (closed.append(table.key), close(table))
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ("KQvK", "KRvK", "KBNvK"):
+                for extension in ("rtbw", "rtbz"):
+                    (pathlib.Path(tmp_dir) / f"{name}.{extension}").write_bytes(b"")
+            tablebase = syzygy_tablebase(tmp_dir, max_fds=2)
+            assert tablebase.max_pieces == 4
+            for fen in ("8/8/4k3/8/8/4K3/4Q3/8 w - - 0 1", "8/8/4k3/8/8/4K3/4R3/8 w - - 0 1", "8/8/4k3/8/8/4K3/3BN3/8 w - - 0 1"):
+                assert tablebase.probe(chess.Board(fen)) == (2, 8)
+                assert len(tablebase._tablebase.lru) <= 2 # the least recently used tables are closed
+            assert closed == ["KQvK", "KQvK", "KRvK", "KRvK"]
+            tablebase.close()
+    finally:
+        chess.syzygy.WdlTable.probe_wdl_table, chess.syzygy.DtzTable.probe_dtz_table, chess.syzygy.Table.close = wdl_probe, dtz_probe, close
+
+def test_user_game():
+    import io, pathlib, tempfile
+    import chess.pgn
+    from chess4fun.data import user_game
+    pgn = io.StringIO('[White "A"]\n[Black "B"]\n[Date "2021.02.14"]\n[Result "1-0"]\n[ECO "C60"]\n\n1. e4 { [%eval 0.3] } e5 2. Nf3 Nc6 3. Bb5 1-0\n')
+    game = chess.pgn.read_game(pgn)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = user_game(pathlib.Path(tmp_dir) / "games.sqlite3")
+        game_id = store.save_game(game).result()
+        assert store.find(player="B", eco="C")[0]["id"] == game_id
+        assert store.count(result="0-1") == 0
+        stored = store.get_game(game_id)
+        assert list(stored.mainline_moves()) == list(game.mainline_moves())
+        assert stored.next().eval() == game.next().eval()
+        store.close()
+
+def test_position_index():
+    import pathlib, tempfile
+    import chess, chess.polyglot
+    from chess4fun.data import user_game, position_key
+    board = chess.Board("r3k2r/pp3ppp/8/3pP3/8/8/PPP2PPP/R3K2R w KQkq d6 0 1")
+    assert position_key(board) == chess.polyglot.zobrist_hash(board)
+    pgn = '[Result "1-0"]\n\n1. e4 e5 2. Nf3 1-0\n\n[Result "0-1"]\n\n1. Nf3 e5 2. e4 0-1\n\n[Result "1/2-1/2"]\n\n1. e4 { [%eval 0.5] } c5 1/2-1/2\n'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        (pathlib.Path(tmp_dir) / "games.pgn").write_text(pgn)
+        store = user_game(pathlib.Path(tmp_dir) / "games.sqlite3")
+        assert store.import_pgn(pathlib.Path(tmp_dir) / "games.pgn").result() == 3
+        first = {stats["move"].uci(): stats for stats in store.continuations(chess.Board())}
+        assert (first["e2e4"]["games"], first["e2e4"]["white"], first["e2e4"]["draws"], first["e2e4"]["eval"]) == (2, 1, 1, 50)
+        board = chess.Board("rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2") # reached by both move orders
+        assert len(store.games_reaching(board)) == 2
+        store.close()
+
+def test_pgn_stream():
+    import pathlib, tempfile
+    import chess.pgn
+    from chess4fun.data import read_games, read_headers, split_pgn, read_chunk, pgn_writer
+    game = chess.pgn.Game()
+    game.add_line([chess.Move.from_uci(uci) for uci in ("e2e4", "e7e5", "g1f3")]).comment = "end"
+    game.next().add_variation(chess.Move.from_uci("c7c5"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = pathlib.Path(tmp_dir) / "games.pgn"
+        with pgn_writer(path) as writer:
+            for i in range(50):
+                game.headers["Round"] = str(i)
+                writer.write(game)
+        with open(path) as pgn_file:
+            assert [headers["Round"] for headers in read_headers(pgn_file)] == [str(i) for i in range(50)]
+        with open(path) as pgn_file:
+            games = list(read_games(pgn_file, variations=False, comments=False, where=lambda headers: int(headers["Round"]) % 10 == 0))
+        assert [g.headers["Round"] for g in games] == ["0", "10", "20", "30", "40"]
+        assert len(games[0].next().variations) == 1 and games[0].end().comment == ""
+        chunks = list(split_pgn(path, chunk_size=500))
+        assert len(chunks) > 1 and chunks[0][0] == 0 and chunks[-1][1] == path.stat().st_size
+        rounds = [g.headers["Round"] for start, stop in chunks for g in read_chunk(path, start, stop)]
+        assert rounds == [str(i) for i in range(50)]
+
+def test_telemetry():
+    import asyncio, json, pathlib, tempfile
+    from chess4fun._telemetry import telemetry_recorder, histogram
+    hist = histogram()
+    for value in (0.5, 1, 3, 4, 100):
+        hist.add(value)
+    assert hist.to_dict()["buckets"] == {"<=0.5": 1, "<=1": 1, "<=4": 2, "<=128": 1}
+    recorder = telemetry_recorder(enabled=False)
+    with recorder.span("off"):
+        pass
+    assert recorder.snapshot()["histograms"] == {}
+    recorder.enabled = True
+    @recorder.timed("coroutine")
+    async def search():
+        return 42
+    assert asyncio.run(search()) == 42
+    with recorder.span("block"):
+        pass
+    recorder.record_info([{"depth": 10, "nps": 1000000, "hashfull": 5}, {"depth": 10}])
+    histograms = recorder.snapshot()["histograms"]
+    assert histograms["coroutine"]["count"] == histograms["block"]["count"] == 1
+    assert histograms["info.depth"]["count"] == 2 and histograms["info.nps"]["max"] == 1000000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_path = recorder.save(pathlib.Path(tmp_dir) / "telemetry.jsonl")
+        assert "info.hashfull" in json.loads(pathlib.Path(log_path).read_text())["histograms"]
+        recorder.start_profile()
+        sum(range(1000))
+        profile_path, summary = recorder.stop_profile(pathlib.Path(tmp_dir) / "run.prof")
+        assert pathlib.Path(profile_path).is_file() and "cumulative" in summary
+
+def test_speculation():
+    import pathlib, sys, threading
+    import chess, chess.engine
+    from chess4fun._preferences import preferences
+    from chess4fun.analysis import engine_session, speculative_analysis, likely_positions
+    board = chess.Board()
+    e4, e5, d4 = chess.Move.from_uci("e2e4"), chess.Move.from_uci("e7e5"), chess.Move.from_uci("d2d4")
+    positions = likely_positions(board, chess.engine.PlayResult(e4, e5))
+    assert len(positions) == 2
+    assert positions[0].board_fen() == "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR" and positions[1].piece_at(chess.E5) is not None
+    positions = likely_positions(board, [{"pv": [e4, e5]}, {"pv": [d4]}, {"pv": [e4]}])
+    assert len(positions) == 3 and positions[1].piece_at(chess.D4) is not None # first moves before the reply, no duplicates
+    # against the stub engine of the benchmarks, which answers at once
+    preferences['evaluation_cache'], cache = False, preferences['evaluation_cache']
+    session = engine_session(command=[sys.executable, str(pathlib.Path(__file__).parent.parent / "benchmarks" / "stub_uci.py")])
+    try:
+        speculation = speculative_analysis(session=session)
+        speculation.speculate(positions[:1])
+        speculation._future.result(timeout=30)
+        served, infos = threading.Event(), []
+        future = speculation.claim(positions[0], lambda info, done: (infos.append(info), done and served.set()))
+        assert future is not None and served.wait(30) and infos[-1]["depth"] == 1
+        assert speculation.claim(positions[1], lambda info, done: None) is None
+    finally:
+        preferences['evaluation_cache'] = cache
+        session.close()
+
+def test_builtin_engine():
+    import asyncio
+    import chess
+    from chess4fun._preferences import preferences
+    from chess4fun.engine import search_engine, evaluate
+    from chess4fun.analysis import engine_session, evaluate_position, advise_move
+    assert evaluate(chess.Board()) == 0
+    assert evaluate(chess.Board("4k3/8/8/8/8/8/8/R3K3 b - - 0 1")) < -400 # from the side to move
+    engine = search_engine(hash_size=1)
+    lines = engine.search(chess.Board("6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1"), depth=3)
+    assert lines[0]["pv"][0] == chess.Move.from_uci("d1d8") and lines[0]["score"] > 29000
+    lines = engine.search(chess.Board(), depth=3, multipv=2)
+    assert len(lines) == 2 and lines[0]["pv"][0] != lines[1]["pv"][0] and lines[0]["nps"] > 0
+    assert engine.search(chess.Board("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1"), depth=3) == [] # stalemate
+    # without an external engine, evaluate_position and advise_move run the built-in one
+    saved = {key: preferences[key] for key in ('chess_engine_exe_path', 'evaluation_cache', 'opening_book')}
+    preferences.update(chess_engine_exe_path=None, evaluation_cache=False, opening_book=False)
+    session = engine_session()
+    try:
+        board = chess.Board("r1bq1rk1/pp2bppp/2n1pn2/2pp4/3P4/2PBPN2/PP1N1PPP/R1BQ1RK1 w - - 0 8")
+        info = asyncio.run(evaluate_position(board, session=session, limit=chess.engine.Limit(depth=2)))
+        assert info["depth"] == 2 and info["pv"][0] in board.legal_moves and "nps" in info
+        result = asyncio.run(advise_move(board, session=session, limit=chess.engine.Limit(time=0.2)))
+        assert result.move in board.legal_moves
+    finally:
+        preferences.update(saved)
+        session.close()
+
+def test_analysis_server():
+    import asyncio, pathlib, sys, threading, time
+    import chess, chess.engine
+    from chess4fun._preferences import preferences
+    from chess4fun.analysis import engine_pool, analysis_server, analysis_client, evaluate_position, evaluate_position_stream, advise_move
+    stub_engine = [sys.executable, str(pathlib.Path(__file__).parent.parent / "benchmarks" / "stub_uci.py")]
+    saved = {key: preferences[key] for key in ('analysis_server', 'evaluation_cache', 'opening_book')}
+    preferences.update(evaluation_cache=False, opening_book=False)
+    server = analysis_server(engine_pool(command=stub_engine, n_workers=1), port=0).start()
+    try:
+        preferences['analysis_server'] = server.url # client mode
+        board, limit = chess.Board("r1bq1rk1/pp2bppp/2n1pn2/2pp4/3P4/2PBPN2/PP1N1PPP/R1BQ1RK1 w - - 0 8"), chess.engine.Limit(depth=1)
+        info = asyncio.run(evaluate_position(board, limit=limit))
+        assert info["depth"] == 1 and info["score"].white() == chess.engine.Cp(20) and info["pv"][0] in board.legal_moves
+        assert len(asyncio.run(evaluate_position(board, limit=limit, multipv=3))) == 3
+        assert asyncio.run(advise_move(board, limit=limit)).move in board.legal_moves
+        async def stream():
+            return [info async for info in evaluate_position_stream(board, limit=limit)]
+        assert asyncio.run(stream())[-1]["depth"] == 1
+        # identical requests in flight are coalesced: the only engine is held while they come in
+        session = asyncio.run_coroutine_threadsafe(server._idle.get(), server._loop).result()
+        client, results, n_requests = analysis_client(server.url), [], server.status()["requests"]
+        threads = [threading.Thread(target=lambda: results.append(asyncio.run(client.evaluate(board, limit)))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while server.status()["requests"] < n_requests + 3:
+            time.sleep(0.01)
+        server._loop.call_soon_threadsafe(server._idle.put_nowait, session)
+        for thread in threads:
+            thread.join()
+        assert len(results) == 3 and server.status().get("coalesced") == 2
+        try:
+            asyncio.run(client.evaluate(chess.Board(None)))
+            assert False, "an invalid position is refused"
+        except chess.engine.EngineError:
+            pass
+        # an error once the stream has started is its last line
+        async def failing_stream():
+            return [info async for info in client.evaluate_stream(board, limit=limit, target_depth="deep")]
+        try:
+            asyncio.run(failing_stream())
+            assert False, "the stream fails"
+        except chess.engine.EngineError as error:
+            assert "TypeError" in str(error)
+        # the same position, reached by another game, is another search
+        transposed = chess.Board()
+        for san in ["Nf3", "Nf6", "Ng1", "Ng8"]:
+            transposed.push_san(san)
+        assert transposed.epd() == chess.Board().epd() and server._key("evaluate", transposed, {}) != server._key("evaluate", chess.Board(), {})
+    finally:
+        preferences.update(saved)
+        server.close()
+
+def test_analysis_server_abandoned_stream():
+    import asyncio, concurrent.futures, time
+    import chess, chess.engine
+    from chess4fun._preferences import preferences
+    from chess4fun.analysis import engine_pool, analysis_server, analysis_client
+    from chess4fun.analysis._server import _shared_search
+    from chess4fun.engine import BUILTIN_ENGINE
+    saved = {key: preferences[key] for key in ('evaluation_cache', 'syzygy_path')}
+    preferences.update(evaluation_cache=False, syzygy_path=None)
+    server = analysis_server(engine_pool(command=BUILTIN_ENGINE, n_workers=1), port=0).start()
+    try:
+        client = analysis_client(server.url)
+        async def first_info():
+            async for info in client.evaluate_stream(chess.Board(), limit=chess.engine.Limit(time=10), early_stop=False):
+                return info
+        assert asyncio.run(first_info())["depth"] >= 1
+        # the client left: its search is cancelled, and the engine free again, long before the 10 s
+        deadline = time.monotonic() + 3.0
+        while (server.status()["in_flight"], server.status()["idle"]) != (0, 1):
+            assert time.monotonic() < deadline, server.status()
+            time.sleep(0.05)
+        assert server.status()["abandoned"] == 1
+        # the last follower of a search that has just finished, before _run() is through with it: nothing is abandoned
+        shared, key = _shared_search(), ("evaluate", "finished")
+        shared.n_followers, shared.future = 1, concurrent.futures.Future()
+        shared.finish({"depth": 1})
+        server._in_flight[key] = shared
+        server._leave(key, shared)
+        assert server.status()["abandoned"] == 1 and not shared.future.cancelled()
+    finally:
+        preferences.update(saved)
+        server.close()
+
+def _qt_app():
+    # an offscreen QApplication, or None without Qt (the GUI tests are then skipped)
+    import os, sys
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PySide2.QtWidgets import QApplication
+    except ImportError:
+        return None
+    return QApplication.instance() or QApplication(sys.argv)
+
+def test_board_renderer():
+    import chess, chess.svg
+    app = _qt_app()
+    if app is None:
+        return
+    from chess4fun.gui._render import board_renderer
+    renderer, board = board_renderer(max_frames=3), chess.Board()
+    first = renderer.frame(board)
+    assert renderer.frame(board) is first and len(renderer._sprites) == 12 # 6 piece types, 2 colors
+    # frames drawn over the previous one, square by square, are those drawn from scratch
+    for uci in ("e2e4", "e7e5", "d1h5", "b8c6", "h5f7"):
+        move = chess.Move.from_uci(uci)
+        board.push(move)
+        state = {"lastmove": move, "check": board.king(board.turn) if board.is_check() else None}
+        arrows = [chess.svg.Arrow(chess.G8, chess.F6)] if uci == "d1h5" else []
+        frame = renderer.frame(board, arrows=arrows, **state)
+        assert frame.toImage() == board_renderer().frame(board, arrows=arrows, **state).toImage()
+    assert renderer.frame(chess.Board()) is not first # evicted from the frame cache
+    assert renderer.frame(board, width=400, height=400).width() == 400 and renderer._sprite_size == (50, 50, 1.0)
+
+def test_score_graph():
+    app = _qt_app()
+    if app is None:
+        return
+    from PySide2.QtCore import QEvent, QPointF, Qt
+    from PySide2.QtGui import QMouseEvent
+    from chess4fun.gui._graph import score_graph
+    def graph_of(scores: list = None) -> score_graph:
+        graph = score_graph(min_plies=20)
+        graph.resize(800, 600)
+        for ply, score in enumerate(scores, start=1):
+            graph.set_score(ply, score)
+        return graph
+    scores = [0.2 * ply * (-1) ** ply for ply in range(1, 16)]
+    graph = graph_of(scores[:10])
+    graph.grab()
+    base = graph._base
+    assert graph._baked == 10 and graph.n_plies == 20
+    # appending a ply only draws onto the cached pixmap, and the result is the chart drawn at once
+    for ply in range(11, 16):
+        graph.set_score(ply, scores[ply - 1])
+        image = graph.grab().toImage()
+        assert graph._base is base and graph._baked == ply
+    assert image == graph_of(scores).grab().toImage()
+    # the x range doubles as the game outgrows it, and shrinks back when the line is cut
+    graph.set_score(30, 1.0)
+    assert graph.n_plies == 40 and graph._base is None and len(graph._scores) == 31
+    graph.grab()
+    graph.truncate(12)
+    assert graph.n_plies == 20 and len(graph._scores) == 13 and graph._base is None
+    assert graph.grab().toImage() == graph_of(scores[:12]).grab().toImage()
+    # a click reports the nearest ply, if it has been played
+    clicked = []
+    graph.ply_clicked.connect(clicked.append)
+    rect = graph._plot_rect()
+    for ply in (7, 12, 19):
+        x = rect.left() + (ply + 0.3) / graph.n_plies * rect.width()
+        graph.mousePressEvent(QMouseEvent(QEvent.MouseButtonPress, QPointF(x, rect.center().y()), Qt.LeftButton, Qt.LeftButton, Qt.NoModifier))
+    assert clicked == [7, 12]
+
+def test_packed_evals():
+    import chess, chess.engine
+    from chess4fun.data._data import pack_eval, unpack_eval, NO_EVAL
+    Cp, Mate, MateGiven, PovScore = chess.engine.Cp, chess.engine.Mate, chess.engine.MateGiven, chess.engine.PovScore
+    for score in [Cp(0), Cp(35), Cp(-1250), Mate(1), Mate(-1), Mate(7), Mate(-12), Mate(-0), MateGiven]:
+        for pov in chess.COLORS:
+            assert unpack_eval(pack_eval(PovScore(score, pov))).white() == PovScore(score, pov).white()
+    # a mate just given is read back with the side that gave it
+    assert unpack_eval(pack_eval(PovScore(Mate(-0), chess.BLACK))) == PovScore(MateGiven, chess.WHITE)
+    assert unpack_eval(pack_eval(PovScore(Mate(-0), chess.WHITE))).white() == Mate(-0)
+    assert pack_eval(None) == NO_EVAL and unpack_eval(NO_EVAL) is None
+
+def test_game_navigator():
+    import random
+    import chess, chess.engine
+    from chess4fun.data import game_navigator
+    rng = random.Random(5)
+    navigator, replay = game_navigator(checkpoint_interval=8), chess.Board()
+    while len(replay.move_stack) < 100 and not replay.is_game_over():
+        move = rng.choice(sorted(replay.legal_moves, key=chess.Move.uci))
+        assert navigator.push(move)
+        replay.push(move)
+    n_plies = len(navigator)
+    navigator.set_eval(3, chess.engine.PovScore(chess.engine.Cp(-40), chess.BLACK))
+    assert navigator.eval_at(3).white() == chess.engine.Cp(40) and navigator.eval_at(4) is None
+    for ply in [0, n_plies, 37, 36, 35, 8, 9, 7, n_plies - 1, 16, 1]:
+        board = navigator.go_to(ply)
+        expected = chess.Board()
+        for move in replay.move_stack[:ply]:
+            expected.push(move)
+        assert board.move_stack == expected.move_stack and board.fen() == expected.fen() == navigator.board_at(ply).fen()
+        assert navigator.move_stack() == replay.move_stack[:ply]
+    # the same move keeps the line, another one drops the rest of it
+    navigator.go_to(2)
+    assert not navigator.push(replay.move_stack[2]) and len(navigator) == n_plies and navigator.eval_at(3) is not None
+    navigator.go_to(2)
+    other = next(move for move in navigator.board.legal_moves if move != replay.move_stack[2])
+    assert navigator.push(other) and len(navigator) == 3 and navigator.eval_at(3) is None
+    assert navigator.go_to(n_plies).move_stack == replay.move_stack[:2] + [other]
+    assert not navigator.forward() and navigator.back() and navigator.ply == 2
+    # a board restored from a checkpoint has the whole move stack: it pops back past the checkpoint
+    navigator.go_to(2)
+    for move in replay.move_stack[2:20]:
+        navigator.push(move)
+    board = navigator.board_at(19)
+    for _ in range(19):
+        board.pop()
+    assert board == chess.Board() and navigator.board_at(19).move_stack == replay.move_stack[:19]
+
+def test_game_analysis():
+    import asyncio, io, pathlib, tempfile
+    import chess, chess.engine, chess.pgn
+    from chess4fun._preferences import preferences
+    from chess4fun.analysis import classify_move, analyse_game, annotate_game, analyse_pgn_file
+    assert [classify_move(cp_loss) for cp_loss in (0, 49, 50, 100, 299, 300)] == \
+        [None, None, chess.pgn.NAG_DUBIOUS_MOVE, chess.pgn.NAG_MISTAKE, chess.pgn.NAG_MISTAKE, chess.pgn.NAG_BLUNDER]
+    class scripted_session(object):
+        # level, but for the side to move after 2. g4, which is 4 pawns up
+        command = "scripted"
+        async def analyse(self, board = None, limit = None, **kwargs):
+            return {"depth": 1, "score": chess.engine.PovScore(chess.engine.Cp(400 if board.ply() == 3 else 0), board.turn)}
+    game = chess.pgn.read_game(io.StringIO("1. f3 e5 2. g4 Qh4# 0-1"))
+    async def analyse() -> list:
+        return [result async for result in analyse_game(game.mainline_moves(), limit=chess.engine.Limit(depth=1), session=scripted_session())]
+    results = asyncio.run(analyse())
+    assert [(result["ply"], result["san"], result["cp_loss"], result["nag"]) for result in results] == \
+        [(1, "f3", 0, None), (2, "e5", 0, None), (3, "g4", 400, chess.pgn.NAG_BLUNDER), (4, "Qh4#", 0, None)]
+    assert results[2]["score"] == chess.engine.Cp(-400) and results[3]["score"].is_mate()
+    annotated = str(annotate_game(game, results))
+    assert "2. g4 $4 { [%eval -4.00] }" in annotated and "Qh4# 0-1" in annotated # no eval after the mating move
+    # a PGN file, over a pool of built-in engines
+    saved = {key: preferences[key] for key in ('chess_engine_exe_path', 'builtin_engine', 'evaluation_cache', 'syzygy_path', 'analysis_server')}
+    preferences.update(chess_engine_exe_path=None, builtin_engine=True, evaluation_cache=False, syzygy_path=None, analysis_server=None)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path, output_path = pathlib.Path(tmp_dir) / "games.pgn", pathlib.Path(tmp_dir) / "annotated.pgn"
+            input_path.write_text("1. e4 e5 2. Nf3 Nc6 *\n\n1. d4 d5 2. c4 *\n\n1. f3 e5 2. g4 Qh4# 0-1\n\n")
+            assert analyse_pgn_file(str(input_path), str(output_path), limit=chess.engine.Limit(depth=1), n_workers=2) == 3
+            with open(output_path) as pgn_file:
+                games = [chess.pgn.read_game(pgn_file) for _ in range(3)]
+            assert [len(list(game.mainline_moves())) for game in games] == [4, 3, 4] # in the input order
+            assert all(node.eval() is not None for game in games for node in list(game.mainline())[:3])
+    finally:
+        preferences.update(saved)
+
+if __name__ == "__main__":
+    test_engine_session()
+    test_evaluate_positions()
+    test_evaluation_cache()
+    test_evaluation_cache_command_line()
+    test_find_opening()
+    test_compiled_opening_book()
+    test_book_moves()
+    test_headless_imports()
+    test_time_control()
+    test_tournament_worker_crash()
+    test_tournament_worker_error()
+    test_search_budget()
+    test_search_move_resolution()
+    test_stream_early_stop_cached()
+    test_time_limited_evaluation_cached()
+    test_multipv()
+    test_syzygy_tablebase()
+    test_syzygy_ranking()
+    test_syzygy_open_tables()
+    test_user_game()
+    test_position_index()
+    test_pgn_stream()
+    test_telemetry()
+    test_speculation()
+    test_builtin_engine()
+    test_analysis_server()
+    test_analysis_server_abandoned_stream()
+    test_board_renderer()
+    test_score_graph()
+    test_packed_evals()
+    test_game_navigator()
+    test_game_analysis()